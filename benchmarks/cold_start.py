@@ -0,0 +1,126 @@
+"""
+Cold init time of the Python Lambda handlers.
+
+    python3 benchmarks/cold_start.py [--scenario NAME ...] [--runs 5] [--top 5] [--json results.json]
+
+Every handler of benchmarks/handlers.py is staged the same way, as index.py
+next to its modules. A fresh interpreter then imports it under `python -X
+importtime`, like the Lambda runtime does in its init phase. Nothing calls
+AWS: clients are only created when a request uses them. For each handler the
+median over --runs is reported of the whole interpreter run, of the import
+of index, and of the imports that took longest within it. Needs boto3.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import handlers  # noqa: E402
+
+ENV = {
+    "AWS_DEFAULT_REGION": handlers.REGION, "AWS_REGION": handlers.REGION,
+    "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing",
+}
+
+
+def parse_importtime(output):
+    """
+    The `-X importtime` lines of `output` as (module, depth, cumulative ms).
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        imports.append((name.strip(), depth, int(cumulative) / 1000.0))
+    return imports
+
+
+def measure(staging):
+    """
+    One cold import of the handler staged in `staging`.
+    """
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import index"], cwd=staging,
+        env=dict(os.environ, **ENV), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    process_ms = (time.perf_counter() - started) * 1000
+    output = completed.stderr.decode("utf-8", "replace")
+    if completed.returncode != 0:
+        raise RuntimeError(output.strip().splitlines()[-1] if output.strip() else "exit status {}".format(completed.returncode))
+
+    # Children are listed before their parent, so the imports made by index
+    # itself are the depth 1 lines between the previous top-level import
+    # (site and the like) and index.
+    children = {}
+    for name, depth, ms in parse_importtime(output):
+        if depth == 0:
+            if name == "index":
+                return {"process_ms": process_ms, "index_ms": ms, "imports": children}
+            children = {}
+        elif depth == 1:
+            children[name] = ms
+    raise RuntimeError("index was not imported")
+
+
+def run(scenario, runs):
+    staging = handlers.package(scenario)
+    try:
+        samples = [measure(staging) for _ in range(runs)]
+    finally:
+        handlers.shutil.rmtree(staging)
+    names = set().union(*(sample["imports"] for sample in samples))
+    return {
+        "process_ms": round(statistics.median(s["process_ms"] for s in samples), 1),
+        "index_ms": round(statistics.median(s["index_ms"] for s in samples), 1),
+        "imports": {
+            name: round(statistics.median(s["imports"].get(name, 0.0) for s in samples), 1)
+            for name in names
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(handlers.SCENARIOS), help="measure only this handler (repeatable)")
+    parser.add_argument("--runs", type=int, default=5, help="cold imports per handler (default 5)")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to show per handler (default 5)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    # Scenarios sharing a handler measure the same package.
+    handler_scenarios = {}
+    for name in args.scenario or list(handlers.SCENARIOS):
+        handler_scenarios.setdefault(handlers.SCENARIOS[name].handler, handlers.SCENARIOS[name])
+
+    print("{:<45} {:>10} {:>9}  {}".format("handler", "process ms", "index ms", "slowest imports (ms)"))
+    results = {}
+    failed = False
+    for handler, scenario in handler_scenarios.items():
+        try:
+            result = results[handler] = run(scenario, args.runs)
+        except RuntimeError as e:
+            print("{:<45} failed: {}".format(handler, e))
+            failed = True
+            continue
+        slowest = sorted(result["imports"].items(), key=lambda item: -item[1])[:args.top]
+        print("{:<45} {:>10.1f} {:>9.1f}  {}".format(
+            handler, result["process_ms"], result["index_ms"],
+            ", ".join("{} {:.0f}".format(name, ms) for name, ms in slowest)))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
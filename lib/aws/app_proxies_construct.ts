@@ -5,13 +5,16 @@ import * as s3 from 'aws-cdk-lib/aws-s3';
 import * as s3deploy from 'aws-cdk-lib/aws-s3-deployment';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as autoscaling from 'aws-cdk-lib/aws-autoscaling';
+import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as wafv2 from 'aws-cdk-lib/aws-wafv2';
 import { Construct } from 'constructs';
 import { readFileSync } from 'fs';
+import { createHash } from 'crypto';
 import { WAF } from './waf';
 import * as eks from 'aws-cdk-lib/aws-eks';
 import { IstioResources } from './istio_stack';
 import { SecurityGroups } from './security_groups';
+import { customResourceCode } from './lambda_code';
 
 export interface AppProxiesConstructProps {
   vpc: ec2.IVpc; 
@@ -142,16 +145,38 @@ export class AppProxiesConstruct extends Construct {
       });
       externalAppLoadBalancer.node.addDependency(envoyWaf);
 
-      let envoyConfigContent = readFileSync("lib/aws/configurations/envoy/envoy.yaml", "utf8")
-        .replaceAll("{{external_loadbalancer_dns}}", externalAppLoadBalancer.loadBalancerDnsName)
-        .replaceAll("{{internal_loadbalancer_dns}}", props.istioInternalAlbDnsName); 
+      // The config template is packaged with the publisher and rendered there,
+      // so its size is not limited by the Lambda source or the environment.
+      const envoyConfigTemplate = "lib/aws/configurations/envoy/envoy.yaml";
+      const envoyConfigPublisher = new lambda.Function(envoyScope, "EnvoyConfigPublisher", {
+        runtime: lambda.Runtime.PYTHON_3_9,
+        handler: "index.lambda_handler",
+        code: customResourceCode("lib/aws/lambda/store_envoy_cofig.py", [envoyConfigTemplate]),
+        timeout: cdk.Duration.minutes(5),
+        environment: {
+          BUCKET: proxyConfigBucket.bucketName,
+          CONFIG_PREFIX: "envoy/config",
+          POINTER_KEY: "envoy/current",
+        },
+      });
+      proxyConfigBucket.grantReadWrite(envoyConfigPublisher);
+
+      const envoyConfig = new cdk.CustomResource(envoyScope, "EnvoyConfig", {
+        serviceToken: envoyConfigPublisher.functionArn,
+        properties: {
+          // Changes with the template, so that editing it sends an Update.
+          TemplateDigest: createHash("sha256").update(readFileSync(envoyConfigTemplate)).digest("hex"),
+          Substitutions: {
+            "{{external_loadbalancer_dns}}": externalAppLoadBalancer.loadBalancerDnsName,
+            "{{internal_loadbalancer_dns}}": props.istioInternalAlbDnsName,
+          },
+        },
+      });
 
-      const envoyConfigDeployment = new s3deploy.BucketDeployment(envoyScope, "EnvoyConfigDeployment", {
-        sources: [s3deploy.Source.data("envoy/envoy.yaml", envoyConfigContent)],
-        destinationBucket: proxyConfigBucket,
-        prune: false,
+      new cdk.CfnOutput(envoyScope, "EnvoyConfigDigest", {
+        value: envoyConfig.getAtt("digest").toString(),
+        description: "Digest of the published Envoy config",
       });
-      envoyConfigDeployment.node.addDependency(externalAppLoadBalancer);
 
 
       let envoyUserdataContent = readFileSync("lib/aws/userdata/envoy_userdata.sh", "utf8")
@@ -209,7 +234,7 @@ export class AppProxiesConstruct extends Construct {
         launchTemplate: envoyLaunchTemplate,
         vpcSubnets: { subnetGroupName: 'incoming-web-envoy-zone' }
       });
-      envoyAsg.node.addDependency(envoyConfigDeployment);
+      envoyAsg.node.addDependency(envoyConfig);
 
       const envoyListener = externalAppLoadBalancer.addListener('EnvoyListenerHttp', {
         port: 80,
@@ -22,6 +22,7 @@ import * as s3 from "aws-cdk-lib/aws-s3";
 import { Code, Function, Runtime } from "aws-cdk-lib/aws-lambda";
 import { LockerConfig } from "../config";
 import { RetentionDays } from "aws-cdk-lib/aws-logs";
+import { SecretProvisioner } from "../secret_provisioner";
 
 type LockerData = {
   master_key: string; // kms encrypted
@@ -91,35 +92,14 @@ export class LockerEc2 extends Construct {
           actions: ["s3:PutObject"],
           resources: [`${envBucket.bucketArn}/*`],
         }),
+        // Lets HeadObject report a missing env file as 404 rather than 403.
+        new iam.PolicyStatement({
+          actions: ["s3:ListBucket"],
+          resources: [envBucket.bucketArn],
+        }),
       ],
     });
 
-    const lambda_role = new iam.Role(this, "locker-lambda-role", {
-      assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
-      inlinePolicies: {
-        "use-kms-sm-s3": kms_policy,
-      },
-    });
-
-    lambda_role.addToPolicy(
-      new iam.PolicyStatement({
-        actions: [
-          "ec2:CreateNetworkInterface",
-          "ec2:DescribeNetworkInterfaces",
-          "ec2:DeleteNetworkInterface",
-          "ec2:AttachNetworkInterface",
-          "ec2:DetachNetworkInterface",
-          "secretsmanager:GetSecretValue",
-          "logs:CreateLogGroup",
-          "logs:CreateLogStream",
-          "logs:PutLogEvents",
-          "s3:GetObject",
-          "s3:PutObject"
-        ],
-        resources: ["*"],
-      })
-    );
-
     const { privateKey: locker_private_key, publicKey: locker_public_key } =
       generateKeyPairSync("rsa", {
         modulusLength: 2048,
@@ -148,59 +128,44 @@ export class LockerEc2 extends Construct {
         .toString(),
     };
 
+    const secretValues = {
+      db_username: cdk.SecretValue.unsafePlainText(locker_data.database.user),
+      db_password: cdk.SecretValue.unsafePlainText(
+        locker_data.database.password,
+      ),
+      db_host: cdk.SecretValue.unsafePlainText(locker_data.database.host),
+      master_key: cdk.SecretValue.unsafePlainText(locker_data.master_key),
+      private_key: cdk.SecretValue.unsafePlainText(
+        this.locker_pair.private_key,
+      ),
+      public_key: cdk.SecretValue.unsafePlainText(this.tenant.public_key),
+      kms_id: cdk.SecretValue.unsafePlainText(kms_key.keyId),
+      region: cdk.SecretValue.unsafePlainText(kms_key.stack.region),
+    };
+
     let secret = new Secret(this, "locker-kms-userdata-secret", {
       secretName: "LockerKmsDataSecret",
       description: "Database master user credentials",
-      secretObjectValue: {
-        db_username: cdk.SecretValue.unsafePlainText(locker_data.database.user),
-        db_password: cdk.SecretValue.unsafePlainText(
-          locker_data.database.password,
-        ),
-        db_host: cdk.SecretValue.unsafePlainText(locker_data.database.host),
-        master_key: cdk.SecretValue.unsafePlainText(locker_data.master_key),
-        private_key: cdk.SecretValue.unsafePlainText(
-          this.locker_pair.private_key,
-        ),
-        public_key: cdk.SecretValue.unsafePlainText(this.tenant.public_key),
-        kms_id: cdk.SecretValue.unsafePlainText(kms_key.keyId),
-        region: cdk.SecretValue.unsafePlainText(kms_key.stack.region),
-      },
+      secretObjectValue: secretValues,
     });
 
-    const encryption_code = readFileSync(
-      "lib/aws/card-vault/encryption.py",
-    ).toString();
-
     let env_file = "envfile";
 
-    const kms_encrypt_function = new Function(this, "kms-encrypt", {
-      functionName: "KmsEncryptionLambda",
-      runtime: Runtime.PYTHON_3_9,
-      handler: "index.lambda_handler",
-      code: Code.fromInline(encryption_code),
-      timeout: cdk.Duration.minutes(15),
-      role: lambda_role,
-      environment: {
-        SECRET_MANAGER_ARN: secret.secretArn,
-        ENV_BUCKET_NAME: envBucket.bucketName,
-        ENV_FILE: env_file,
-      },
-      vpc: vpc,
-      vpcSubnets: {
-        subnetGroupName: "locker-database-zone",
-      },
-      logRetention: RetentionDays.INFINITE,
+    const provisioner = SecretProvisioner.of(this);
+    provisioner.addTarget({
+      name: "locker",
+      secret,
+      kmsKey: kms_key,
+      bucket: envBucket,
+      file: env_file,
     });
 
-    const triggerKMSEncryption = new cdk.CustomResource(
-      this,
-      "KmsEncryptionCR",
-      {
-        serviceToken: kms_encrypt_function.functionArn,
-      },
-    );
-
-    const userDataResponse = triggerKMSEncryption.getAtt("message").toString();
+    // Digest of the rendered env file; it only changes when the locker
+    // configuration does, and tells when `refresh-locker-env` has to be run.
+    new cdk.CfnOutput(this, "LockerEnvDigest", {
+      value: provisioner.attribute("locker", "digest"),
+      description: "Digest of the locker env file",
+    });
 
     const locker_role = new iam.Role(this, "locker-role", {
       assumedBy: new iam.ServicePrincipal("ec2.amazonaws.com"),
@@ -231,7 +196,8 @@ export class LockerEc2 extends Construct {
 
     let customData = readFileSync("lib/aws/card-vault/user-data.sh", "utf8")
       .replaceAll("{{BUCKET_NAME}}", envBucket.bucketName)
-      .replaceAll("{{ENV_FILE}}", env_file);
+      .replaceAll("{{ENV_FILE}}", env_file)
+      .replaceAll("{{REGION}}", cdk.Stack.of(this).region);
 
     let vpcSubnets: ec2.SubnetSelection;
     if (lockerSubnetId) {
@@ -269,6 +235,8 @@ export class LockerEc2 extends Construct {
     });
 
     envBucket.grantRead(this.instance);
+    // The instance reads the env file at boot, so it has to be written first.
+    this.instance.node.addDependency(provisioner.resource);
 
     new cdk.CfnOutput(this, "LockerIP", {
       value: `${this.instance.instancePrivateIp}`,
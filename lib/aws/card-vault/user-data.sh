@@ -5,6 +5,24 @@ yum update -y \
     && service docker start \
     && docker pull juspaydotin/hyperswitch-card-vault:latest
 
+# Reload the env file and restart the locker only when the digest stamped on
+# the S3 object by the KmsEncryption custom resource has changed. A restarted
+# locker has to be unlocked again, so after boot this is run by hand
+# (sudo refresh-locker-env) when the LockerEnvDigest output changes.
+cat > /usr/local/bin/refresh-locker-env <<'SCRIPT'
+#!/bin/bash
+set -e
+export AWS_DEFAULT_REGION={{REGION}}
+digest=$(aws s3api head-object --bucket {{BUCKET_NAME}} --key {{ENV_FILE}} --query Metadata.sha256 --output text)
+if [ "$digest" = "$(cat /home/ec2-user/.env.sha256 2>/dev/null)" ]; then
+    echo "Locker env is up to date ($digest)"
+    exit 0
+fi
 aws s3 cp s3://{{BUCKET_NAME}}/{{ENV_FILE}} /home/ec2-user/.env
+docker rm -f locker >/dev/null 2>&1 || true
+docker run --name locker --restart unless-stopped --env-file /home/ec2-user/.env -d --net=host juspaydotin/hyperswitch-card-vault:latest
+echo "$digest" > /home/ec2-user/.env.sha256
+SCRIPT
+chmod +x /usr/local/bin/refresh-locker-env
 
-docker run --restart unless-stopped --env-file /home/ec2-user/.env -d --net=host juspaydotin/hyperswitch-card-vault:latest
+/usr/local/bin/refresh-locker-env
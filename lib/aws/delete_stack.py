@@ -1,67 +1,116 @@
-import os
-import json
-import boto3
-import urllib3
-import base64
-from dataclasses import dataclass
-
-http = urllib3.PoolManager()
-
-def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
-    responseUrl = event['ResponseURL']
-
-    responseBody = {
-        'Status': responseStatus,
-        'Reason': reason or "See the details in CloudWatch Log Stream: {}".format(context.log_stream_name),
-        'PhysicalResourceId': physicalResourceId or context.log_stream_name,
-        'StackId': event['StackId'],
-        'RequestId': event['RequestId'],
-        'LogicalResourceId': event['LogicalResourceId'],
-        'NoEcho': noEcho,
-        'Data': responseData
-    }
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-    json_responseBody = json.dumps(responseBody)
+import custom_resource as cr
 
-    print("Response body:")
-    print(json_responseBody)
+elbv2 = cr.client('elbv2')
+ec2 = cr.client('ec2')
 
-    headers = {
-        'content-type': '',
-        'content-length': str(len(json_responseBody))
-    }
+LOAD_BALANCERS = ["hyperswitch", "hyperswitch-control-center", "hyperswitch-logs", "hyperswitch-sdk-demo", "hyperswitch-web"]
 
-    try:
-        response = http.request(
-            'PUT', responseUrl, headers=headers, body=json_responseBody)
-        print("Status code:", response.status)
-        return responseBody
+MAX_WORKERS = 8
+WAITER_DELAY_SECONDS = 5
+ENI_POLL_SECONDS = 10
 
-    except Exception as e:
 
-        print("send(..) failed executing http.request(..):", e)
-        return {}
+def find_load_balancers(names):
+    """
+    Look up the load balancers by name, skipping the ones that do not exist
+    instead of failing the whole lookup like DescribeLoadBalancers(Names=...).
+    """
+    wanted = set(names)
+    found = []
+    paginator = elbv2.get_paginator('describe_load_balancers')
+    for page in paginator.paginate():
+        found.extend(lb for lb in page['LoadBalancers'] if lb['LoadBalancerName'] in wanted)
 
+    missing = wanted - {lb['LoadBalancerName'] for lb in found}
+    for name in sorted(missing):
+        print("Loadbalancer {} doesn't exist.".format(name))
+    return found
 
-def lambda_handler(event, context):
-    try:
-        if event['RequestType'] == 'Delete':
-
-            # Try to delete the loadbalancer created also
-            loadbalancers = ["hyperswitch", "hyperswitch-control-center", "hyperswitch-logs", "hyperswitch-sdk-demo", "hyperswitch-web"]
-            elbv2 = boto3.client('elbv2')
-            reponse = elbv2.describe_load_balancers(Names=loadbalancers)
-            for lb in reponse["LoadBalancers"]:
-                try:
-                    elbv2.delete_load_balancer(LoadBalancerArn=lb["LoadBalancerArn"])
-                except:
-                    print("Loadbalancer {} doesn't exist.".format(lb["LoadBalancerArn"]))
-
-            send(event, context, "SUCCESS", {"message": "No action required"})
+
+def target_groups_of(lb):
+    paginator = elbv2.get_paginator('describe_target_groups')
+    return [
+        tg['TargetGroupArn']
+        for page in paginator.paginate(LoadBalancerArn=lb['LoadBalancerArn'])
+        for tg in page['TargetGroups']
+    ]
+
+
+def delete_load_balancer(lb, context):
+    """
+    Delete a load balancer (its listeners go with it) and wait until it is
+    gone, bounded by the time left in the invocation.
+    """
+    elbv2.delete_load_balancer(LoadBalancerArn=lb['LoadBalancerArn'])
+    attempts = max(1, int(cr.remaining_seconds(context) // WAITER_DELAY_SECONDS))
+    elbv2.get_waiter('load_balancers_deleted').wait(
+        LoadBalancerArns=[lb['LoadBalancerArn']],
+        WaiterConfig={'Delay': WAITER_DELAY_SECONDS, 'MaxAttempts': attempts},
+    )
+
+
+def wait_for_network_interfaces(lbs, context):
+    """
+    Wait until the ENIs the load balancers held are released, since they block
+    subnet and VPC deletion. Returns the descriptions still present at the
+    deadline.
+    """
+    descriptions = [
+        "ELB {}".format(lb['LoadBalancerArn'].split(':loadbalancer/', 1)[1])
+        for lb in lbs
+    ]
+    while True:
+        response = ec2.describe_network_interfaces(
+            Filters=[{'Name': 'description', 'Values': descriptions}])
+        remaining = sorted({eni['Description'] for eni in response['NetworkInterfaces']})
+        if not remaining or cr.remaining_seconds(context) <= ENI_POLL_SECONDS:
+            return remaining
+        time.sleep(ENI_POLL_SECONDS)
+
+
+def delete(event, context):
+    lbs = find_load_balancers(LOAD_BALANCERS)
+    if not lbs:
+        return {"message": "No action required"}
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        groups = list(pool.map(target_groups_of, lbs))
+        deletions = [(lb, pool.submit(delete_load_balancer, lb, context)) for lb in lbs]
+
+    deleted = []
+    freed, in_use = set(), set()
+    for (lb, future), arns in zip(deletions, groups):
+        error = future.exception()
+        if error is None:
+            deleted.append(lb)
+            freed.update(arns)
         else:
-            send(event, context, "SUCCESS", {"message": "No action required"})
-    except Exception as e:  # Use 'Exception as e' to properly catch and define the exception variable
-        send(event, context, "FAILED", {"message": str(e)})
-        return str(e)
-    # Return a success message
-    return '{ "status": 200, "message": "success" }'
+            print("Loadbalancer {} was not deleted: {}".format(lb['LoadBalancerName'], error))
+            in_use.update(arns)
+
+    # Target groups can only go once no listener references them any more: the
+    # ones of the deleted load balancers, unless one that is left shares them.
+    target_groups = sorted(freed - in_use)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        tg_deletions = [
+            (arn, pool.submit(elbv2.delete_target_group, TargetGroupArn=arn))
+            for arn in target_groups
+        ]
+    for arn, future in tg_deletions:
+        if future.exception() is not None:
+            print("Target group {} was not deleted: {}".format(arn, future.exception()))
+
+    pending_enis = wait_for_network_interfaces(deleted, context) if deleted else []
+
+    return {
+        "message": "Deleted {} of {} load balancers".format(len(deleted), len(lbs)),
+        "deleted": ",".join(sorted(lb['LoadBalancerName'] for lb in deleted)),
+        "pendingNetworkInterfaces": str(len(pending_enis)),
+    }
+
+
+def lambda_handler(event, context):
+    return cr.handle(event, context, on_delete=delete)
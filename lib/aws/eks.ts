@@ -32,6 +32,8 @@ import * as wafv2 from 'aws-cdk-lib/aws-wafv2';
 import { AppProxiesConstruct } from './app_proxies_construct';
 import { IstioResources } from './istio_stack';
 import { SecurityGroups } from './security_groups';
+import { customResourceCode } from "./lambda_code";
+import { SecretProvisioner } from "./secret_provisioner";
 // import { LockerSetup } from "./card-vault/components";
 
 export class EksStack {
@@ -455,66 +457,41 @@ export class EksStack {
       nodeRole: nodegroupRole,
     });
 
-    const lambda_role = new iam.Role(scope, "hyperswitch-lambda-role", {
-      assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
-      inlinePolicies: {
-        "use-kms-sm-s3": kms_policy_document,
-      },
-    });
-
-    const encryption_code = readFileSync(
-      "lib/aws/encryption.py",
-    ).toString();
+    const kmsSecretValues = {
+      db_password: cdk.SecretValue.unsafePlainText(
+        rds.password,
+      ),
+      jwt_secret: cdk.SecretValue.unsafePlainText("test_admin"),
+      master_key: cdk.SecretValue.unsafePlainText(config.hyperswitch_ec2.master_enc_key),
+      admin_api_key: cdk.SecretValue.unsafePlainText(config.hyperswitch_ec2.admin_api_key),
+      kms_id: cdk.SecretValue.unsafePlainText(kms_key.keyId),
+      region: cdk.SecretValue.unsafePlainText(kms_key.stack.region),
+      locker_public_key: cdk.SecretValue.unsafePlainText(locker ? locker.locker_ec2.locker_pair.public_key : "locker-key"),
+      tenant_private_key: cdk.SecretValue.unsafePlainText(locker ? locker.locker_ec2.tenant.private_key : "locker-key")
+    };
 
     let secret = new Secret(scope, "hyperswitch-kms-userdata-secret", {
       secretName: "HyperswitchKmsDataSecret",
       description: "KMS encryptable secrets for Hyperswitch",
-      secretObjectValue: {
-        db_password: cdk.SecretValue.unsafePlainText(
-          rds.password,
-        ),
-        jwt_secret: cdk.SecretValue.unsafePlainText("test_admin"),
-        master_key: cdk.SecretValue.unsafePlainText(config.hyperswitch_ec2.master_enc_key),
-        admin_api_key: cdk.SecretValue.unsafePlainText(config.hyperswitch_ec2.admin_api_key),
-        kms_id: cdk.SecretValue.unsafePlainText(kms_key.keyId),
-        region: cdk.SecretValue.unsafePlainText(kms_key.stack.region),
-        locker_public_key: cdk.SecretValue.unsafePlainText(locker ? locker.locker_ec2.locker_pair.public_key : "locker-key"),
-        tenant_private_key: cdk.SecretValue.unsafePlainText(locker ? locker.locker_ec2.tenant.private_key : "locker-key")
-      },
+      secretObjectValue: kmsSecretValues,
     });
 
-    const kms_encrypt_function = new Function(scope, "hyperswitch-kms-encrypt", {
-      functionName: "HyperswitchKmsEncryptionLambda",
-      runtime: Runtime.PYTHON_3_9,
-      handler: "index.lambda_handler",
-      code: Code.fromInline(encryption_code),
-      timeout: cdk.Duration.minutes(15),
-      role: lambda_role,
-      environment: {
-        SECRET_MANAGER_ARN: secret.secretArn,
-      },
+    const provisioner = SecretProvisioner.of(scope);
+    provisioner.addTarget({
+      name: "router",
+      secret,
+      kmsKey: kms_key,
+      parameterPath: "/hyperswitch/",
     });
-
-    const triggerKMSEncryption = new cdk.CustomResource(
-      scope,
-      "HyperswitchKmsEncryptionCR",
-      {
-        serviceToken: kms_encrypt_function.functionArn,
-      },
-    );
+    const triggerKMSEncryption = provisioner.resource;
 
     const kmsSecrets = new KmsSecrets(scope, triggerKMSEncryption);
 
-    // const delete_stack_code = readFileSync(
-    //   "lib/aws/delete_stack.py",
-    // ).toString();
-
-
     // const delete_stack_function = new Function(scope, "hyperswitch-stack-delete", {
     //   functionName: "HyperswitchStackDeletionLambda",
     //   runtime: Runtime.PYTHON_3_9,
     //   handler: "index.lambda_handler",
-    //   code: Code.fromInline(delete_stack_code),
+    //   code: customResourceCode("lib/aws/delete_stack.py"),
     //   timeout: cdk.Duration.minutes(15),
     //   role: lambda_role,
     //   environment: {
@@ -1506,8 +1483,6 @@ class DockerImagesToEcr {
       buildSpec: codebuild.BuildSpec.fromAsset("./dependencies/code_builder/buildspec.yml"),
     });
 
-    const lambdaStartBuildCode = readFileSync('./dependencies/code_builder/start_build.py').toString();
-
     const triggerCodeBuildRole = new iam.Role(scope, "ECRImageTransferLambdaRole", {
       assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
     });
@@ -1570,7 +1545,7 @@ class DockerImagesToEcr {
     const triggerCodeBuild = new Function(scope, "ECRImageTransferLambda", {
       runtime: Runtime.PYTHON_3_9,
       handler: "index.lambda_handler",
-      code: Code.fromInline(lambdaStartBuildCode),
+      code: customResourceCode("dependencies/code_builder/start_build.py"),
       timeout: cdk.Duration.minutes(15),
       role: triggerCodeBuildRole,
       environment: {
@@ -1,142 +1,409 @@
-import os
-import json
-import boto3
-import urllib3
+"""
+Provision the KMS-encrypted secrets of every target in one invocation.
+
+What each target writes is declared in secret_targets.py. The `Targets`
+property maps the targets a stack deploys to their options and a revision, a
+non-secret identifier of their values that is set in the stack. A new
+revision makes CloudFormation send an Update, and the manifest then compares
+the secrets themselves, so that the template never holds anything derived
+from them.
+
+The PROVISIONING_TARGETS environment variable gives each target its secret
+ARN and, for env file targets, the bucket and key of the file. Its `key_id`,
+when set, replaces the `kms_id` of the secret as the KMS key the target is
+encrypted with, which keeps a rotated target on its new key.
+
+All the secrets are fetched with a single BatchGetSecretValue call. The
+targets are then provisioned concurrently, each with the pipeline of its
+output: secret_pipeline for SSM parameters, and a digest-checked render for
+env files. The response Data holds the Data of every target under keys
+prefixed with its name (routerSucceeded, lockerDigest, ...). A failing
+target does not stop the others, and the resource fails once all of them
+have finished.
+
+For disaster recovery, the `Replicas` property maps other regions to the KMS
+key (a per-region key, or the replica of a multi-region key) the parameter
+targets are also provisioned with there. Each replica region runs the same
+pipeline as the function's own region, with its own clients, key, data key
+and manifest, concurrently with it. The plaintexts are already at hand, so a
+region costs one more set of concurrent calls rather than another pass. The
+Data of a replica is prefixed with the target and the region
+(routerUsWest2Failed, ...). Regions dropped from `Replicas` are torn down on
+Update.
+
+Invoked directly with `{"Rotate": {"target": ..., "key_id": ...}}`, the
+function moves the ciphertexts of a parameter target to another KMS key with
+key_rotation.py, continuing in a new asynchronous invocation of itself while
+the rotation is paused for time.
+"""
 import base64
-from dataclasses import dataclass
-
-http = urllib3.PoolManager()
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
+import custom_resource as cr
+import envelope
+import key_rotation
+import parameter_writer
+import secret_manifest
+import secret_pipeline
+import secret_targets
 
-def worker():
+logger = logging.getLogger()
 
-    dummy_val = "dummy_val"
+secrets_manager = cr.client('secretsmanager')
+ssm_manager = cr.client('ssm')
+kms_client = cr.client('kms')
+s3_client = cr.client('s3')
+# Writes are retried and paced by parameter_writer instead of botocore.
+ssm_writes = cr.client('ssm', max_attempts=1)
+lambda_client = cr.client('lambda')
 
-    api_hash_key = "0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef"
-    secrets_manager = boto3.client('secretsmanager')
-    ssm_manager = boto3.client('ssm')
+DIGEST_METADATA = 'sha256'
 
-    kms_client = boto3.client('kms')
+# Maximum number of secrets accepted by a single BatchGetSecretValue call.
+BATCH_GET_SIZE = 20
 
-    secret_arn = os.environ['SECRET_MANAGER_ARN']
-    secret_value_response = secrets_manager.get_secret_value(
-        SecretId=secret_arn)
-    credentials = json.loads(secret_value_response['SecretString'])
+# Bound on the invocations a single rotation request continues in.
+MAX_ROTATION_INVOCATIONS = 20
 
-    kms_fun = kms_encryptor(
-        credentials["kms_id"], credentials["region"], kms_client)
 
-    def enc_pl(x): return kms_fun(credentials[x])
-    def pl(x): return credentials[x]
+def kms_encryptor(key_id: str, region: str, kms_client=None):
+    if kms_client is None:
+        kms_client = cr.client('kms', region)
+    return lambda data: base64.b64encode(kms_client.encrypt(KeyId=key_id, Plaintext=data)["CiphertextBlob"]).decode("utf-8")
 
-    db_pass = enc_pl("db_password")
-    master_key = enc_pl("master_key")
-    admin_api_key = enc_pl("admin_api_key")
-    jwt_secret = enc_pl("jwt_secret")
 
-    locker_public_key = enc_pl("locker_public_key")
+def read_parameter(ssm, path, key):
+    try:
+        return ssm.get_parameter(Name="{}{}".format(path, key))["Parameter"]["Value"]
+    except ssm.exceptions.ParameterNotFound:
+        return None
+
+
+def store_parameter(writer, path, key, value):
+    writer.put("{}{}".format(path, key), value)
+
+
+def target_options():
+    return json.loads(os.environ.get('PROVISIONING_TARGETS', '{}'))
+
+
+def requested_targets(properties):
+    targets = sorted((properties or {}).get('Targets', {}))
+    unknown = [name for name in targets if name not in secret_targets.TARGETS]
+    if unknown:
+        raise ValueError("Unknown provisioning targets: {}".format(", ".join(unknown)))
+    return targets
+
+
+def requested_replicas(properties):
+    """
+    The `Replicas` property: region -> id, ARN or alias of the KMS key used
+    in that region.
+    """
+    replicas = dict((properties or {}).get('Replicas') or {})
+    home = os.environ.get('AWS_REGION')
+    if home in replicas:
+        raise ValueError("{} is the region of the function and cannot be a replica".format(home))
+    return replicas
+
+
+def replica_name(name, region):
+    return name + "".join(part.capitalize() for part in region.split("-"))
+
+
+def fetch_credentials(secret_ids):
+    """
+    The parsed SecretString of each of `secret_ids`, read with one
+    BatchGetSecretValue call per BATCH_GET_SIZE secrets.
+    """
+    ids = sorted(set(secret_ids))
+    credentials = {}
+    errors = {}
+    for start in range(0, len(ids), BATCH_GET_SIZE):
+        response = secrets_manager.batch_get_secret_value(SecretIdList=ids[start:start + BATCH_GET_SIZE])
+        for secret in response.get('SecretValues', []):
+            value = json.loads(secret['SecretString'])
+            credentials[secret['ARN']] = credentials[secret['Name']] = value
+        for error in response.get('Errors', []):
+            errors[error['SecretId']] = error.get('Message') or error.get('ErrorCode')
+
+    missing = [secret_id for secret_id in ids if secret_id not in credentials]
+    if missing:
+        raise cr.ResourceFailed("Could not read secrets: {}".format(
+            "; ".join("{}: {}".format(secret_id, errors.get(secret_id, "not returned")) for secret_id in missing)))
+    return {secret_id: credentials[secret_id] for secret_id in ids}
+
+
+def target_key(options, credentials):
+    """
+    The KMS key a target is provisioned with in the function's region: its
+    `key_id` option, set after a rotation, or else the `kms_id` of its secret.
+    """
+    return options.get('key_id') or credentials["kms_id"]
+
+
+def provision_parameters(spec, credentials, incremental, region=None, key_id=None):
+    """
+    Provision the parameters of `spec` with `key_id`, in the function's region
+    or in the replica `region`.
+    """
+    path = spec['path']
+    values = spec['values']
+    if region is None:
+        kms, ssm, writes = kms_client, ssm_manager, ssm_writes
+        region = credentials["region"]
+    else:
+        kms, ssm, writes = cr.client('kms', region), cr.client('ssm', region), cr.client('ssm', region, max_attempts=1)
+    writer = parameter_writer.Writer(writes)
+    return secret_pipeline.provision(
+        {key: secret_targets.resolve(value, credentials) for key, value in values.items()},
+        key_id, kms, kms_encryptor(key_id, region, kms),
+        read=lambda key: read_parameter(ssm, path, key),
+        store=lambda key, value: store_parameter(writer, path, key, value),
+        incremental=incremental, stats=writer.summary,
+        plain={key for key, value in values.items() if not secret_targets.is_encrypted(value)})
+
+
+def render(layout, credentials, encrypted=None):
+    """
+    The env file for `layout`. Encrypted fields are taken from `encrypted`
+    (variable -> ciphertext), or written in plaintext when it is None, which
+    is the form the digest is computed over.
+    """
+    lines = [""]
+    for entry in layout:
+        if entry is None:
+            lines.append("")
+            continue
+        name, value = entry
+        if encrypted is not None and secret_targets.is_encrypted(value):
+            lines.append("{}={}".format(name, encrypted[name]))
+        else:
+            lines.append("{}={}".format(name, secret_targets.resolve(value, credentials)))
+    return "\n".join(lines) + "\n"
 
-    tenant_private_key = enc_pl("tenant_private_key")
 
-    paze_private_key = kms_fun("PAZE_PRIVATE_KEY")
-    paze_private_key_passphrase = kms_fun("PAZE_PRIVATE_KEY_PASSPHRASE")
-    google_pay_root_signing_keys = kms_fun("GOOGLE_PAY_ROOT_SIGNING_KEYS")
+def encrypt_all(encrypt, plaintexts):
+    """
+    Encrypt the values of `plaintexts` concurrently, returning name -> ciphertext.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(plaintexts))) as pool:
+        futures = {name: pool.submit(encrypt, plaintext) for name, plaintext in plaintexts.items()}
+    return {name: future.result() for name, future in futures.items()}
 
-    dummy_val = kms_fun(dummy_val)
-    kms_encrypted_api_hash_key = kms_fun(api_hash_key)
 
-    secretval = {
-        "db-pass": db_pass,
-        "master-key": master_key,
-        "admin-api-key": admin_api_key,
-        "jwt-secret": jwt_secret,
-        "dummy-val": dummy_val,
-        "kms-encrypted-api-hash-key": kms_encrypted_api_hash_key,
-        "locker-public-key": locker_public_key,
-        "tenant-private-key": tenant_private_key,
-        "paze-private-key": paze_private_key,
-        "paze-private-key-passphrase" : paze_private_key_passphrase,
-        "google-pay-root-signing-keys" : google_pay_root_signing_keys,
+def stored_digest(bucket, key):
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key)['Metadata'].get(DIGEST_METADATA)
+    except s3_client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def provision_env_file(spec, options, credentials, incremental):
+    """
+    Render the env file into its bucket. KMS ciphertexts differ on every
+    call, so changes are detected on the plaintext rendering: its HMAC-SHA256,
+    keyed with the `digest_key` field, is stored as the object's `sha256`
+    metadata, and the object is only rewritten when that digest changes.
+    """
+    layout = spec['layout']
+    bucket, key = options['bucket'], options['file']
+
+    digest = hmac.new(
+        credentials[spec['digest_key']].encode("utf-8"),
+        render(layout, credentials).encode("utf-8"), hashlib.sha256).hexdigest()
+    if stored_digest(bucket, key) == digest:
+        logger.info("s3://%s/%s is up to date (%s)", bucket, key, digest)
+        return {"message": "Completed Successfully", "digest": digest, "written": "false"}
+
+    encrypted = encrypt_all(
+        kms_encryptor(target_key(options, credentials), credentials["region"], kms_client),
+        {
+            name: secret_targets.resolve(value, credentials)
+            for name, value in filter(None, layout) if secret_targets.is_encrypted(value)
+        })
+    s3_client.put_object(
+        Bucket=bucket, Key=key, Body=render(layout, credentials, encrypted).encode("utf-8"),
+        Metadata={DIGEST_METADATA: digest})
+    logger.info("Wrote s3://%s/%s (%s)", bucket, key, digest)
+    return {"message": "Completed Successfully", "digest": digest, "written": "true"}
+
+
+def teardown_parameters(spec, region=None):
+    path = spec['path']
+    names = [
+        "{}{}".format(path, key)
+        for key in list(spec['values']) + [
+            envelope.DATA_KEY_NAME, secret_manifest.MANIFEST_NAME, key_rotation.CHECKPOINT_NAME]
+    ]
+    ssm = ssm_manager if region is None else cr.client('ssm', region)
+    return secret_pipeline.teardown(ssm, names, path)
+
+
+def teardown_env_file(spec):
+    # The env file is removed with its bucket.
+    return {"message": "No action required"}
+
+
+TEARDOWNS = {
+    secret_targets.PARAMETERS: teardown_parameters,
+    secret_targets.ENV_FILE: teardown_env_file,
+}
+
+
+def prefixed(name, data):
+    return {name + key[0].upper() + key[1:]: value for key, value in (data or {}).items()}
+
+
+def in_replica(task, region, *listed):
+    """
+    `task` run for the replica `region`. The names it lists under the `listed`
+    keys are replaced by their count, which keeps the Data of several regions
+    within the size of a custom resource response.
+    """
+    def compact(data):
+        counts = {key: str(len(data[key].split(",")) if data.get(key) else 0) for key in listed}
+        return dict(data, region=region, **counts)
+
+    def run():
+        try:
+            return compact(task())
+        except cr.ResourceFailed as e:
+            raise cr.ResourceFailed(str(e), compact(e.data))
+    return run
+
+
+def fan_out(tasks):
+    """
+    Run `tasks` (target -> callable returning Data) concurrently and merge
+    their Data, raising ResourceFailed with the merged Data when any failed.
+    """
+    if not tasks:
+        return {"message": "No action required"}
+
+    with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        futures = {name: pool.submit(task) for name, task in tasks.items()}
+
+    data = {}
+    failed = {}
+    for name in sorted(futures):
+        try:
+            data.update(prefixed(name, futures[name].result()))
+        except cr.ResourceFailed as e:
+            data.update(prefixed(name, dict(e.data, message=str(e))))
+            failed[name] = str(e)
+        except Exception as e:
+            logger.exception("Target %s failed", name)
+            data.update(prefixed(name, {"message": str(e)}))
+            failed[name] = str(e)
+
+    if failed:
+        raise cr.ResourceFailed(
+            "; ".join("{}: {}".format(name, failed[name]) for name in sorted(failed)), data)
+
+    data["message"] = "Completed Successfully for {}".format(", ".join(sorted(futures)))
+    return data
+
+
+def provision(names, incremental, replicas=None):
+    options = target_options()
+    missing = [name for name in names if name not in options]
+    if missing:
+        raise ValueError("No PROVISIONING_TARGETS entry for {}".format(", ".join(missing)))
+
+    credentials = fetch_credentials([options[name]['secret'] for name in names])
+    tasks = {}
+    for name in names:
+        spec = secret_targets.TARGETS[name]
+        credential = credentials[options[name]['secret']]
+        if spec['output'] == secret_targets.ENV_FILE:
+            tasks[name] = functools.partial(provision_env_file, spec, options[name], credential, incremental)
+            continue
+        tasks[name] = functools.partial(
+            provision_parameters, spec, credential, incremental, key_id=target_key(options[name], credential))
+        for region, key_id in sorted((replicas or {}).items()):
+            tasks[replica_name(name, region)] = in_replica(
+                functools.partial(provision_parameters, spec, credential, incremental, region=region, key_id=key_id),
+                region, 'succeeded')
+    return tasks
+
+
+def teardown_replicas(names, regions):
+    return {
+        replica_name(name, region): in_replica(
+            functools.partial(teardown_parameters, secret_targets.TARGETS[name], region), region, 'deleted', 'invalid')
+        for name in names if secret_targets.TARGETS[name]['output'] == secret_targets.PARAMETERS
+        for region in regions
     }
 
-    for key in secretval:
-        store_parameter(ssm_manager, key, secretval[key])
 
-def kms_encryptor(key_id: str, region: str, kms_client):
-    return lambda data: base64.b64encode(kms_client.encrypt(KeyId=key_id, Plaintext=data)["CiphertextBlob"]).decode("utf-8")
+def teardown(names, regions=()):
+    tasks = {
+        name: functools.partial(TEARDOWNS[secret_targets.TARGETS[name]['output']], secret_targets.TARGETS[name])
+        for name in names
+    }
+    tasks.update(teardown_replicas(names, regions))
+    return tasks
 
 
-def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
-    responseUrl = event['ResponseURL']
+def create(event, context):
+    properties = event.get('ResourceProperties')
+    return fan_out(provision(requested_targets(properties), incremental=False, replicas=requested_replicas(properties)))
 
-    responseBody = {
-        'Status': responseStatus,
-        'Reason': reason or "See the details in CloudWatch Log Stream: {}".format(context.log_stream_name),
-        'PhysicalResourceId': physicalResourceId or context.log_stream_name,
-        'StackId': event['StackId'],
-        'RequestId': event['RequestId'],
-        'LogicalResourceId': event['LogicalResourceId'],
-        'NoEcho': noEcho,
-        'Data': responseData
-    }
 
-    json_responseBody = json.dumps(responseBody)
+def update(event, context):
+    properties, old_properties = event.get('ResourceProperties'), event.get('OldResourceProperties')
+    names = requested_targets(properties)
+    replicas = requested_replicas(properties)
+    old_regions = sorted((old_properties or {}).get('Replicas') or {})
+    removed = [name for name in requested_targets(old_properties) if name not in names]
+    tasks = provision(names, incremental=True, replicas=replicas)
+    tasks.update(teardown(removed, old_regions))
+    tasks.update(teardown_replicas(names, [region for region in old_regions if region not in replicas]))
+    return fan_out(tasks)
 
-    print("Response body:")
-    print(json_responseBody)
 
-    headers = {
-        'content-type': '',
-        'content-length': str(len(json_responseBody))
-    }
+def delete(event, context):
+    properties = event.get('ResourceProperties')
+    # Not validated, so that a resource whose Create was refused can still be deleted.
+    regions = sorted((properties or {}).get('Replicas') or {})
+    return fan_out(teardown(requested_targets(properties), regions))
 
-    try:
-        response = http.request(
-            'PUT', responseUrl, headers=headers, body=json_responseBody)
-        print("Status code:", response.status)
-        return responseBody
 
-    except Exception as e:
+def rotate(event, context):
+    request = event['Rotate']
+    spec = secret_targets.TARGETS.get(request.get('target'))
+    if spec is None or spec['output'] != secret_targets.PARAMETERS:
+        raise ValueError("Only parameter targets can be rotated, not {}".format(request.get('target')))
 
-        print("send(..) failed executing http.request(..):", e)
-        return {}
+    data = key_rotation.rotate(
+        ssm_manager, parameter_writer.Writer(ssm_writes), kms_client, spec['path'],
+        request['key_id'], context, source_key_id=request.get('source_key_id'))
 
-
-def store_parameter(ssm, key, value):
-    ssm.put_parameter(Name="/hyperswitch/{}".format(key),
-                      Value=value, Overwrite=True, Type='String', Tier='Advanced')
+    invocation = event.get('Invocation', 1)
+    if data['state'] == 'paused':
+        if invocation >= MAX_ROTATION_INVOCATIONS:
+            data['message'] = "Stopped after {} invocations: {}".format(invocation, data['message'])
+        else:
+            lambda_client.invoke(
+                FunctionName=context.invoked_function_arn, InvocationType='Event',
+                Payload=json.dumps(dict(event, Invocation=invocation + 1)).encode('utf-8'))
+            data['message'] = "{}, continuing in invocation {}".format(data['message'], invocation + 1)
+    logger.info("Rotation of %s: %s", request['target'], json.dumps(data, sort_keys=True))
+    return data
 
 
 def lambda_handler(event, context):
-    try:
-        if event['RequestType'] == 'Create':
-            try:
-                worker()
-                message = "Completed Successfully"
-                status = "SUCCESS"
-            except Exception as e:
-                message = str(e)
-                status = "FAILED"
-
-            send(event, context, status,
-                 {
-                     "message": message
-                 })
-        elif event['RequestType'] == 'Delete':
-            keys = ["db-pass", "master-key", "admin-api-key", "jwt-secret", "dummy-val", "kms-encrypted-api-hash-key", "locker-public-key", "tenant-private-key", "paze-private-key", "paze-private-key-passphrase", "google-pay-root-signing-keys"]
-            ssm = boto3.client('ssm')
-            for key in keys:
-                parameter_name="/hyperswitch/{}".format(key)
-                try:
-                    ssm.delete_parameter(Name=parameter_name)
-                except:
-                    print("Parameter {} doesn't exist.".format(parameter_name))
-
-            send(event, context, "SUCCESS", {"message": "No action required"})
-        else:
-            send(event, context, "SUCCESS", {"message": "No action required"})
-    except Exception as e:  # Use 'Exception as e' to properly catch and define the exception variable
-        send(event, context, "FAILED", {"message": str(e)})
-        return str(e)
-    # Return a success message
-    return '{ "status": 200, "message": "success" }'
+    # Key rotations are requested by invoking the function directly.
+    if 'Rotate' in event:
+        with cr.invocation(context, "Rotate"):
+            return rotate(event, context)
+    return cr.handle(event, context, on_create=create, on_update=update, on_delete=delete)
@@ -11,6 +11,7 @@ import { DistributionConstruct } from "./distribution"
 import * as iam from "aws-cdk-lib/aws-iam";
 import { readFileSync } from "fs";
 import { Code, Function, Runtime } from "aws-cdk-lib/aws-lambda";
+import { customResourceCode } from "./lambda_code";
 
 export class HyperswitchSDKStack extends Construct {
   constructor(scope: Construct, eks: EksStack, distribution: DistributionConstruct ) {
@@ -96,8 +97,6 @@ export class HyperswitchSDKStack extends Construct {
     project.node.addDependency(eks.lokiChart); 
     project.node.addDependency(distribution.routerDistribution);
 
-    const lambdaStartBuildCode = readFileSync('./dependencies/code_builder/start_build.py').toString();
-
     const triggerCodeBuildRole = new iam.Role(scope, "SdkAssetsUploadLambdaRole", {
       assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
     });
@@ -141,7 +140,7 @@ export class HyperswitchSDKStack extends Construct {
     const triggerCodeBuild = new Function(scope, "SdkAssetsUploadLambda", {
       runtime: Runtime.PYTHON_3_9,
       handler: "index.lambda_handler",
-      code: Code.fromInline(lambdaStartBuildCode),
+      code: customResourceCode("dependencies/code_builder/start_build.py"),
       timeout: cdk.Duration.minutes(15),
       role: triggerCodeBuildRole,
       environment: {
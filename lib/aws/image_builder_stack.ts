@@ -12,6 +12,8 @@ import { aws_logs as logs } from 'aws-cdk-lib';
 import { MachineImage, SubnetType, SecurityGroup } from 'aws-cdk-lib/aws-ec2';
 
 import { readFileSync } from "fs";
+import { createHash } from "crypto";
+import { customResourceCode } from "./lambda_code";
 
 type ImageBuilderProperties = {
     pipeline_name: string;
@@ -37,6 +39,20 @@ type RecordLambdaProperties = {
     topic: Topic,
 }
 
+const COMPONENT_VERSION = "1.0.1";
+const RECIPE_VERSION = "1.0.4";
+const INSTANCE_TYPES = ["t3.medium"];
+
+// Digest of everything that goes into a pipeline build except the parent
+// image, which may only be known at deploy time. start_ib.py uses it to skip
+// pipelines whose AMI is already built.
+function PipelineSourceHash(props: ImageBuilderProperties): string {
+    return createHash("sha256")
+        .update(readFileSync(props.compFilePath))
+        .update(JSON.stringify([COMPONENT_VERSION, RECIPE_VERSION, INSTANCE_TYPES]))
+        .digest("hex");
+}
+
 function CreateImagePipeline(
     stack: ImageBuilderStack,
     role: iam.Role,
@@ -46,14 +62,14 @@ function CreateImagePipeline(
         name: props.comp_name,
         description: props.description,
         platform: "Linux",
-        version: "1.0.1",
+        version: COMPONENT_VERSION,
         data: readFileSync(props.compFilePath).toString(),
     })
     let instance_profile = new iam.CfnInstanceProfile(stack, props.profile_name, { instanceProfileName: props.profile_name, roles: [role.roleName] })
 
     const squid_recipe = new image_builder.CfnImageRecipe(stack, props.recipe_name, {
         name: props.recipe_name,
-        version: "1.0.4",
+        version: RECIPE_VERSION,
         components: [
             { "componentArn": component.attrArn }
         ],
@@ -62,7 +78,7 @@ function CreateImagePipeline(
 
     let squid_infra_config = new image_builder.CfnInfrastructureConfiguration(stack, props.infra_config_name, {
         name: props.infra_config_name,
-        instanceTypes: ["t3.medium"],
+        instanceTypes: INSTANCE_TYPES,
         instanceProfileName: props.profile_name,
         snsTopicArn: props.snsTopicArn,
         subnetId: props.subnetId,
@@ -127,7 +143,7 @@ export class ImageBuilderStack extends cdk.Stack {
             snsTopicArn: squid_channel.topicArn,
         };
 
-        let envoy_arn = CreateImagePipeline(
+        let squid_arn = CreateImagePipeline(
             this,
             role,
             squid_properties,
@@ -149,7 +165,7 @@ export class ImageBuilderStack extends cdk.Stack {
             snsTopicArn: envoy_channel.topicArn,
         };
 
-        let squid_arn = CreateImagePipeline(
+        let envoy_arn = CreateImagePipeline(
             this,
             role,
             envoy_properties,
@@ -177,10 +193,6 @@ export class ImageBuilderStack extends cdk.Stack {
             base_properties,
         )
 
-        const start_ib_code = readFileSync(
-            "lib/aws/lambda/start_ib.py",
-        ).toString();
-
 
         const lambda_policy = new iam.PolicyDocument({
             statements: [
@@ -199,9 +211,21 @@ export class ImageBuilderStack extends cdk.Stack {
                     actions: ['ssm:*'],
                     resources: ["*"],
                 }),
+                new iam.PolicyStatement({
+                    effect: iam.Effect.ALLOW,
+                    actions: ['ec2:DescribeImages', 'ec2:DeregisterImage', 'ec2:DeleteSnapshot'],
+                    resources: ["*"],
+                }),
             ],
         });
 
+        // ssm_key must match the parameter the record lambda of the same image writes
+        const pipelines = [
+            { name: "envoy", arn: envoy_arn, hash: PipelineSourceHash(envoy_properties), ssm_key: "envoy_image_ami" },
+            { name: "squid", arn: squid_arn, hash: PipelineSourceHash(squid_properties), ssm_key: "squid_image_ami" },
+            { name: "base", arn: base_arn, hash: PipelineSourceHash(base_properties), ssm_key: "base_image_ami" },
+        ];
+
         const lambda_role = new iam.Role(this, "hyperswitch-ib-lambda-role", {
             assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
             inlinePolicies: {
@@ -213,13 +237,12 @@ export class ImageBuilderStack extends cdk.Stack {
             functionName: "HyperswitchIbStartLambda",
             runtime: Runtime.PYTHON_3_9,
             handler: "index.lambda_handler",
-            code: Code.fromInline(start_ib_code),
+            code: customResourceCode("lib/aws/lambda/start_ib.py"),
             timeout: cdk.Duration.minutes(15),
             role: lambda_role,
             environment: {
-                envoy_image_pipeline_arn: envoy_arn,
-                squid_image_pipeline_arn: squid_arn,
-                base_image_pipeline_arn: base_arn,
+                PIPELINES: this.toJsonString(pipelines),
+                PARENT_IMAGE: base_image_id,
             },
         });
 
@@ -229,6 +252,10 @@ export class ImageBuilderStack extends cdk.Stack {
             "HyperswitchIbStart",
             {
                 serviceToken: ib_lambda.functionArn,
+                properties: {
+                    PipelineHashes: pipelines.map((pipeline) => pipeline.hash).join(","),
+                    ParentImage: base_image_id,
+                },
             },
         );
 
@@ -260,19 +287,16 @@ export class ImageBuilderStack extends cdk.Stack {
 
 
 function addRecordLambda(stack: cdk.Stack, props: RecordLambdaProperties) {
-    const record_amid_code = readFileSync(
-        "lib/aws/lambda/record_ami.py"
-    ).toString();
-
     let ib_record_function = new Function(stack, props.id, {
         functionName: props.name,
         runtime: Runtime.PYTHON_3_9,
         handler: "index.lambda_handler",
-        code: Code.fromInline(record_amid_code),
+        code: customResourceCode("lib/aws/lambda/record_ami.py"),
         timeout: cdk.Duration.minutes(15),
         role: props.role,
         environment: {
             IMAGE_SSM_NAME: props.ssm_key,
+            AMI_RETENTION: "5",
         },
     });
 
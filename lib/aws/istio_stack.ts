@@ -117,6 +117,9 @@ export class IstioResources extends Construct {
       subnetGroupName: 'istio-lb-transit-zone', 
     });
 
+    const istioIngressGroupName = 'hyperswitch-istio-app-alb-ingress-group';
+    const albCacheParameterName = '/istio/internal-alb';
+
     const trafficControlChart = cluster.addHelmChart('TrafficControlChart', {
       chart: 'hyperswitch-istio',
       repository: 'https://juspay.github.io/hyperswitch-helm/',
@@ -133,7 +136,7 @@ export class IstioResources extends Construct {
           annotations: {
             'alb.ingress.kubernetes.io/backend-protocol': 'HTTP',
             'alb.ingress.kubernetes.io/backend-protocol-version': 'HTTP1',
-            'alb.ingress.kubernetes.io/group.name': 'hyperswitch-istio-app-alb-ingress-group', 
+            'alb.ingress.kubernetes.io/group.name': istioIngressGroupName, 
             'alb.ingress.kubernetes.io/healthcheck-interval-seconds': '5',
             'alb.ingress.kubernetes.io/healthcheck-path': '/healthz/ready', 
             'alb.ingress.kubernetes.io/healthcheck-port': '15021',         
@@ -177,8 +180,13 @@ export class IstioResources extends Construct {
       runtime: lambda.Runtime.PYTHON_3_9,
       handler: 'get_istio_alb_dns.handler',
       code: lambda.Code.fromAsset(path.join(__dirname, 'lambda')),
-      timeout: cdk.Duration.minutes(2),
+      timeout: cdk.Duration.minutes(10),
       description: 'Lambda function to find the DNS name of the Istio ALB',
+      environment: {
+        CLUSTER_NAME: cluster.clusterName,
+        INGRESS_STACK: istioIngressGroupName,
+        CACHE_PARAMETER: albCacheParameterName,
+      },
     });
     
     // Grant permissions to list and describe load balancers
@@ -190,6 +198,23 @@ export class IstioResources extends Construct {
       resources: ['*'],
     }));
 
+    // Discovered ALB is cached so later stack updates resolve it in one call,
+    // and the cache is removed with the stack
+    albLookupFunction.addToRolePolicy(new iam.PolicyStatement({
+      actions: [
+        'ssm:GetParameter',
+        'ssm:PutParameter',
+        'ssm:DeleteParameter'
+      ],
+      resources: [
+        cdk.Stack.of(this).formatArn({
+          service: 'ssm',
+          resource: 'parameter',
+          resourceName: albCacheParameterName.substring(1),
+        }),
+      ],
+    }));
+
     // Create custom resource to invoke the Lambda function
     const albLookup = new cr.AwsCustomResource(this, 'IstioAlbDnsLookup', {
       onCreate: {
@@ -208,11 +233,25 @@ export class IstioResources extends Construct {
         action: 'invoke',
         parameters: {
           FunctionName: albLookupFunction.functionName,
+          // The timestamp runs the lookup on every deployment. It is kept
+          // out of the physical id, whose change would send a Delete, which
+          // removes the cached ALB, after each update.
           Payload: JSON.stringify({
             RequestType: 'Update',
+            Deployment: new Date().getTime().toString(),
+          }),
+        },
+        physicalResourceId: cr.PhysicalResourceId.of('IstioAlbDnsName'),
+      },
+      onDelete: {
+        service: 'Lambda',
+        action: 'invoke',
+        parameters: {
+          FunctionName: albLookupFunction.functionName,
+          Payload: JSON.stringify({
+            RequestType: 'Delete',
           }),
         },
-        physicalResourceId: cr.PhysicalResourceId.of('IstioAlbDnsName-' + new Date().getTime().toString()),
       },
       policy: cr.AwsCustomResourcePolicy.fromStatements([
         new iam.PolicyStatement({
@@ -220,6 +259,7 @@ export class IstioResources extends Construct {
           resources: [albLookupFunction.functionArn],
         }),
       ]),
+      timeout: cdk.Duration.minutes(11),
     });
 
     albLookup.node.addDependency(trafficControlChart);
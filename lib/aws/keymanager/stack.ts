@@ -16,6 +16,8 @@ import {
 import { Code, Function, Runtime } from "aws-cdk-lib/aws-lambda";
 
 import { readFileSync } from "fs";
+import { customResourceCode } from "../lambda_code";
+import { PROVISIONING_MODULES, SecretProvisioner } from "../secret_provisioner";
 import { Secret } from "aws-cdk-lib/aws-secretsmanager";
 
 import * as iam from "aws-cdk-lib/aws-iam";
@@ -88,34 +90,6 @@ export class Keymanager extends Construct {
             }
         });
 
-        const kms_policy_document = new iam.PolicyDocument({
-            statements: [
-                new iam.PolicyStatement({
-                    actions: ["kms:*"],
-                    resources: [kms_key.keyArn],
-                }),
-                new iam.PolicyStatement({
-                    actions: ["elasticloadbalancing:DeleteLoadBalancer",
-                        "elasticloadbalancing:DescribeLoadBalancers"],
-                    resources: ["*"],
-                }),
-                new iam.PolicyStatement({
-                    actions: ["ssm:*"],
-                    resources: ["*"],
-                }),
-                new iam.PolicyStatement({
-                    actions: ["secretsmanager:*"],
-                    resources: ["*"],
-                }),
-            ],
-        });
-        const lambda_role = new iam.Role(scope, "hyperswitch-keymanager-lambda-role", {
-            assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
-            inlinePolicies: {
-                "use-kms-sm": kms_policy_document,
-            },
-        });
-
         const keymanagerNodegroup = cluster.addNodegroupCapacity("KeymanagerNodegroup", {
             nodegroupName: "keymanager-ng",
             minSize: 1,
@@ -132,47 +106,63 @@ export class Keymanager extends Construct {
             nodeRole: nodegroupRole,
         });
 
-        const encryption_code = readFileSync(
-            "lib/aws/keymanager/encryption.py",
-        ).toString();
+        const kmsSecretValues = {
+            db_pass: cdk.SecretValue.unsafePlainText(
+                config.db_pass,
+            ),
+            kms_id: cdk.SecretValue.unsafePlainText(kms_key.keyId),
+            region: cdk.SecretValue.unsafePlainText(kms_key.stack.region),
+            ca_cert: cdk.SecretValue.unsafePlainText(config.ca_cert),
+            tls_key: cdk.SecretValue.unsafePlainText(config.tls_key),
+            tls_cert: cdk.SecretValue.unsafePlainText(config.tls_cert),
+            client_cert: cdk.SecretValue.unsafePlainText(config.client_cert),
+            access_token: cdk.SecretValue.unsafePlainText(config.access_token),
+            hash_context: cdk.SecretValue.unsafePlainText(config.hash_context),
+        };
 
         let secret = new Secret(scope, "keymanager-kms-userdata-secret", {
             secretName: "KeymanagerKmsDataSecret",
             description: "KMS encryptable secrets for Keymanager",
-            secretObjectValue: {
-                db_pass: cdk.SecretValue.unsafePlainText(
-                    config.db_pass,
-                ),
-                kms_id: cdk.SecretValue.unsafePlainText(kms_key.keyId),
-                region: cdk.SecretValue.unsafePlainText(kms_key.stack.region),
-                ca_cert: cdk.SecretValue.unsafePlainText(config.ca_cert),
-                tls_key: cdk.SecretValue.unsafePlainText(config.tls_key),
-                tls_cert: cdk.SecretValue.unsafePlainText(config.tls_cert),
-                client_cert: cdk.SecretValue.unsafePlainText(config.client_cert),
-                access_token: cdk.SecretValue.unsafePlainText(config.access_token),
-                hash_context: cdk.SecretValue.unsafePlainText(config.hash_context),
-            },
+            secretObjectValue: kmsSecretValues,
         });
 
-        const kms_encrypt_function = new Function(scope, "keymanager-kms-encrypt", {
-            functionName: "KeymanagerKmsEncryptionLambda",
-            runtime: Runtime.PYTHON_3_9,
-            handler: "index.lambda_handler",
-            code: Code.fromInline(encryption_code),
-            timeout: cdk.Duration.minutes(15),
-            role: lambda_role,
-            environment: {
-                SECRET_MANAGER_ARN: secret.secretArn,
-            },
+        const provisioner = SecretProvisioner.of(scope);
+        provisioner.addTarget({
+            name: "keymanager",
+            secret,
+            kmsKey: kms_key,
+            parameterPath: "/keymanager/",
         });
+        const triggerKMSEncryption = provisioner.resource;
 
-        const triggerKMSEncryption = new cdk.CustomResource(
-            scope,
-            "KeymanagerKmsEncryptionCR",
-            {
-                serviceToken: kms_encrypt_function.functionArn,
-            },
-        );
+        // Stacks deployed before the stack-wide SecretProvisioner have a
+        // KeymanagerKmsEncryptionCR whose Delete, run by its old function,
+        // removes the /keymanager parameters. Removing both in one deployment
+        // would run that Delete, so for one release they are kept, with the
+        // function running the provisioning code with no targets, whose Delete
+        // does nothing. Once a stack has been deployed with this release,
+        // deploy it with `-c keymanager_legacy_cr=false` to delete them; new
+        // stacks can pass it from the start. The next release drops them.
+        const legacyCr = scope.node.tryGetContext("keymanager_legacy_cr");
+        if (legacyCr !== false && legacyCr !== "false") {
+            const retired_role = new iam.Role(scope, "hyperswitch-keymanager-lambda-role", {
+                assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
+                managedPolicies: [
+                    iam.ManagedPolicy.fromAwsManagedPolicyName("service-role/AWSLambdaBasicExecutionRole"),
+                ],
+            });
+            const retired_function = new Function(scope, "keymanager-kms-encrypt", {
+                functionName: "KeymanagerKmsEncryptionLambda",
+                runtime: Runtime.PYTHON_3_9,
+                handler: "index.lambda_handler",
+                code: customResourceCode("lib/aws/encryption.py", PROVISIONING_MODULES),
+                timeout: cdk.Duration.minutes(1),
+                role: retired_role,
+            });
+            new cdk.CustomResource(scope, "KeymanagerKmsEncryptionCR", {
+                serviceToken: retired_function.functionArn,
+            });
+        }
 
         const kmsSecrets = new KmsSecrets(scope, triggerKMSEncryption);
         const keymanagerChart = cluster.addHelmChart("KeymanagerService", {
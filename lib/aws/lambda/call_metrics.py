@@ -0,0 +1,302 @@
+"""
+Latency tracing of the AWS API calls made during a Lambda invocation.
+
+`instrument(client)` hooks into the client's botocore event system:
+`before-call` and `after-call`/`after-call-error` time every call, retries
+included, and `response-received` sees every attempt. A throttled attempt
+is therefore counted even when its retry succeeds. custom_resource.client()
+instruments every client it creates.
+
+An invocation is bracketed with `invocation(context)`; custom_resource.handle()
+does this itself. At the end of an invocation, one CloudWatch Embedded Metric
+Format line is printed per operation, plus one for the whole invocation. The
+logs also get a one-line summary of where the time went. The CloudFormation
+response is recorded as cloudformation.SendResponse by custom_resource.send().
+
+The first invocation of a process also reports its cold start: the time from
+the process start to the request, the imports timed with
+`startup.importing()` (custom_resource times boto3, which makes up most of
+it) and the boto3 clients that were created. Set
+PYTHONPROFILEIMPORTTIME=1 on a function for the interpreter's full import
+breakdown.
+
+Set AWS_CALL_METRICS=false on a function to turn this off.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "Hyperswitch/CustomResources")
+
+# Error codes botocore treats as throttling, plus SSM's PutParameter one.
+THROTTLE_CODES = {
+    "Throttling", "ThrottlingException", "ThrottledException", "RequestThrottledException",
+    "TooManyRequestsException", "ProvisionedThroughputExceededException", "TransactionInProgressException",
+    "RequestLimitExceeded", "BandwidthLimitExceeded", "LimitExceededException", "RequestThrottled",
+    "SlowDown", "PriorRequestNotComplete", "EC2ThrottledException", "TooManyUpdates",
+}
+
+# CloudWatch accepts at most 100 values for a metric in one EMF document.
+MAX_SAMPLES = 100
+
+
+def enabled():
+    return os.environ.get("AWS_CALL_METRICS", "true").lower() != "false"
+
+
+class Operation:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = []
+
+
+class Recorder:
+    """
+    Per-operation call statistics of the current invocation, shared by every
+    instrumented client and safe to update from worker threads. Lambda runs
+    one invocation per process at a time, so there is a single recorder.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = {}
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+
+    def _operation(self, service, name):
+        key = (service, name)
+        operation = self.operations.get(key)
+        if operation is None:
+            operation = self.operations[key] = Operation()
+        return operation
+
+    def call(self, service, name, elapsed_ms, retries=0, error=False):
+        with self._lock:
+            operation = self._operation(service, name)
+            operation.calls += 1
+            operation.errors += int(error)
+            operation.retries += retries
+            operation.total_ms += elapsed_ms
+            operation.max_ms = max(operation.max_ms, elapsed_ms)
+            if len(operation.samples) < MAX_SAMPLES:
+                operation.samples.append(round(elapsed_ms, 2))
+
+    def throttled(self, service, name):
+        with self._lock:
+            self._operation(service, name).throttles += 1
+
+
+recorder = Recorder()
+
+
+def process_age_ms():
+    """
+    Milliseconds since this process started, from /proc (10 ms resolution),
+    or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, (uptime - started_ticks / os.sysconf("SC_CLK_TCK")) * 1000)
+
+
+class Startup:
+    """
+    Where the cold start of the process went: the imports timed with
+    `importing()` and the clients created by custom_resource.client().
+    """
+
+    def __init__(self):
+        self.cold = True
+        self.init_ms = None
+        self.imports = []
+        self.clients = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def importing(self, name):
+        """
+        Time the import statements of the block as `name`.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.imports.append((name, (time.perf_counter() - started) * 1000))
+
+    def client_created(self, service, elapsed_ms):
+        with self._lock:
+            self.clients.append((service, elapsed_ms))
+
+    def first_invocation(self):
+        """
+        End the init phase. Returns whether this is the first invocation.
+        """
+        with self._lock:
+            if not self.cold:
+                return False
+            self.cold = False
+        self.init_ms = process_age_ms()
+        return True
+
+    def report(self, function_name):
+        import_ms = sum(elapsed for _, elapsed in self.imports)
+        client_ms = sum(elapsed for _, elapsed in self.clients)
+        values = {"ColdStart": 1, "ImportTime": round(import_ms, 2), "ClientInit": round(client_ms, 2)}
+        metrics = {"ColdStart": "Count", "ImportTime": "Milliseconds", "ClientInit": "Milliseconds"}
+        if self.init_ms is not None:
+            values["InitDuration"] = round(self.init_ms, 2)
+            metrics["InitDuration"] = "Milliseconds"
+        print(emf(function_name, [["FunctionName"]], metrics, values))
+
+        logger.info(
+            "Cold start: %s before the first request; imports %.0f ms (%s); %d clients %.0f ms (%s)",
+            "unknown" if self.init_ms is None else "{:.0f} ms".format(self.init_ms), import_ms,
+            ", ".join("{} {:.0f}".format(name, elapsed) for name, elapsed in sorted(
+                self.imports, key=lambda item: -item[1])[:8]) or "none",
+            len(self.clients), client_ms,
+            ", ".join("{} {:.0f}".format(service, elapsed) for service, elapsed in self.clients) or "none")
+
+
+startup = Startup()
+
+
+def _started(context, **kwargs):
+    context["call_metrics_started"] = time.perf_counter()
+
+
+def _elapsed_ms(context):
+    started = context.get("call_metrics_started")
+    return 0.0 if started is None else (time.perf_counter() - started) * 1000
+
+
+def _operation_name(event_name):
+    return event_name.rsplit(".", 1)[-1]
+
+
+def instrument(client):
+    """
+    Record the calls made through `client`. Returns the client.
+    """
+    if not enabled():
+        return client
+    service = client.meta.service_model.service_name
+
+    def after_call(parsed, context, event_name, **kwargs):
+        # Error responses come here too; after-call-error only sees
+        # exceptions raised before a response was parsed.
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        recorder.call(service, _operation_name(event_name), _elapsed_ms(context), retries, error="Error" in parsed)
+
+    def after_call_error(exception, context, event_name, **kwargs):
+        response = getattr(exception, "response", None) or {}
+        retries = response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        recorder.call(service, _operation_name(event_name), _elapsed_ms(context), retries, error=True)
+
+    def response_received(parsed_response, event_name, **kwargs):
+        if parsed_response and parsed_response.get("Error", {}).get("Code") in THROTTLE_CODES:
+            recorder.throttled(service, _operation_name(event_name))
+
+    events = client.meta.events
+    events.register("before-call", _started)
+    events.register("after-call", after_call)
+    events.register("after-call-error", after_call_error)
+    events.register("response-received", response_received)
+    return client
+
+
+def emf(function_name, dimensions, metrics, values):
+    """
+    An Embedded Metric Format document: `metrics` maps a metric name to its
+    unit and `values` holds the dimension and metric values.
+    """
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": dimensions,
+                "Metrics": [{"Name": name, "Unit": unit} for name, unit in metrics.items()],
+            }],
+        },
+        "FunctionName": function_name,
+    }
+    document.update(values)
+    return json.dumps(document, separators=(",", ":"))
+
+
+def flush(function_name, request_type, duration_ms):
+    """
+    Print the metrics of the invocation and log its summary line.
+    """
+    operations = sorted(recorder.operations.items(), key=lambda item: -item[1].total_ms)
+    api = [(key, operation) for key, operation in operations if key[0] != "cloudformation"]
+
+    for (service, name), operation in operations:
+        print(emf(function_name, [["Service", "Operation"], ["FunctionName", "Service", "Operation"]], {
+            "Latency": "Milliseconds", "Calls": "Count", "Errors": "Count", "Retries": "Count", "Throttles": "Count",
+        }, {
+            "Service": service, "Operation": name, "Latency": operation.samples, "Calls": operation.calls,
+            "Errors": operation.errors, "Retries": operation.retries, "Throttles": operation.throttles,
+        }))
+
+    calls = sum(operation.calls for _, operation in api)
+    api_ms = sum(operation.total_ms for _, operation in api)
+    retries = sum(operation.retries for _, operation in api)
+    throttles = sum(operation.throttles for _, operation in api)
+    print(emf(function_name, [["FunctionName"]], {
+        "Duration": "Milliseconds", "ApiCalls": "Count", "ApiTime": "Milliseconds",
+        "Retries": "Count", "Throttles": "Count",
+    }, {
+        "RequestType": request_type or "Invoke", "Duration": round(duration_ms, 2), "ApiCalls": calls,
+        "ApiTime": round(api_ms, 2), "Retries": retries, "Throttles": throttles,
+    }))
+
+    logger.info(
+        "%s took %.0f ms: %d AWS calls, %.0f ms in calls, %d retries, %d throttled; %s",
+        request_type or "Invocation", duration_ms, calls, api_ms, retries, throttles,
+        ", ".join(
+            "{}.{} {}x {:.0f}/{:.0f} ms".format(
+                service, name, operation.calls, operation.total_ms / operation.calls, operation.max_ms)
+            for (service, name), operation in operations) or "no calls")
+
+
+@contextmanager
+def invocation(context, request_type=None):
+    """
+    Collect the calls made in the block and report them when it exits.
+    """
+    if not enabled():
+        yield
+        return
+    cold = startup.first_invocation()
+    recorder.reset()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        function_name = getattr(context, "function_name", None) or os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+        try:
+            flush(function_name, request_type, (time.perf_counter() - started) * 1000)
+            if cold:
+                startup.report(function_name)
+        except Exception as e:
+            logger.warning("Reporting call metrics failed: %s", e)
@@ -0,0 +1,236 @@
+"""
+Shared runtime for the CloudFormation custom resource Lambdas.
+
+Every handler is packaged next to this module (see lib/aws/lambda_code.ts) and
+delegates the CloudFormation plumbing to `handle()`:
+
+    import custom_resource as cr
+
+    ssm = cr.client("ssm")
+
+    def create(event, context):
+        ...
+        return {"message": "Completed Successfully"}
+
+    def lambda_handler(event, context):
+        return cr.handle(event, context, on_create=create)
+
+Clients from `client()` are created on their first use, so a request only
+pays for the clients it calls, and are instrumented by call_metrics.
+`handle()` reports the AWS calls of every invocation (handlers that are not
+custom resources use `with cr.invocation(context):`).
+"""
+import json
+import logging
+import threading
+import time
+
+import call_metrics
+
+# The bulk of a handler's import time, reported with its cold start.
+with call_metrics.startup.importing("boto3"):
+    import boto3
+    import urllib3
+    from botocore.config import Config
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SUCCESS = "SUCCESS"
+FAILED = "FAILED"
+
+# A single ResponseURL PUT may never take longer than this. Without a bound a
+# stalled PUT leaves the stack waiting for the one hour custom resource timeout.
+RESPONSE_TIMEOUT = urllib3.Timeout(connect=5.0, read=10.0)
+RESPONSE_ATTEMPTS = 4
+RESPONSE_BACKOFF_SECONDS = 0.5
+
+# Time reserved at the end of an invocation for reporting FAILED before the
+# Lambda runtime kills the process.
+DEADLINE_MARGIN_MS = 15000
+
+http = urllib3.PoolManager(timeout=RESPONSE_TIMEOUT, retries=False)
+
+
+class ResourceFailed(Exception):
+    """
+    Raised by a callback to report FAILED while still returning response Data,
+    e.g. the keys that did succeed in a partially applied request.
+    """
+
+    def __init__(self, message, data=None):
+        super().__init__(message)
+        self.data = data or {}
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_create_lock = threading.Lock()
+
+
+class LazyClient:
+    """
+    A boto3 client created on the first access to one of its attributes.
+    Creating a client loads its service model, which is a large part of a
+    handler's cold start, so clients that a request type does not call are
+    never created. Clients are created one at a time, because the default
+    boto3 session is not safe to create clients from concurrently.
+    """
+
+    def __init__(self, service, region, max_attempts):
+        self._args = (service, region, max_attempts)
+        self._client = None
+
+    def _resolve(self):
+        if self._client is None:
+            with _create_lock:
+                if self._client is None:
+                    service, region, max_attempts = self._args
+                    config = None
+                    if max_attempts is not None:
+                        config = Config(retries={"max_attempts": max_attempts, "mode": "standard"})
+                    started = time.perf_counter()
+                    created = boto3.client(service, region_name=region, config=config)
+                    call_metrics.startup.client_created(service, (time.perf_counter() - started) * 1000)
+                    self._client = call_metrics.instrument(created)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+def client(service, region=None, max_attempts=None):
+    """
+    Return a boto3 client that is shared across warm invocations and created
+    on its first use. `max_attempts` overrides botocore's retry count (1
+    disables retries).
+    """
+    key = (service, region, max_attempts)
+    cached = _clients.get(key)
+    if cached is None:
+        with _clients_lock:
+            cached = _clients.get(key)
+            if cached is None:
+                cached = _clients[key] = LazyClient(service, region, max_attempts)
+    return cached
+
+
+def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
+    """
+    Report the outcome of a request to CloudFormation, retrying transient
+    failures with a bounded timeout per attempt.
+    """
+    responseBody = {
+        'Status': responseStatus,
+        'Reason': reason or "See the details in CloudWatch Log Stream: {}".format(context.log_stream_name),
+        'PhysicalResourceId': physicalResourceId or event.get('PhysicalResourceId') or context.log_stream_name,
+        'StackId': event['StackId'],
+        'RequestId': event['RequestId'],
+        'LogicalResourceId': event['LogicalResourceId'],
+        'NoEcho': noEcho,
+        'Data': responseData
+    }
+
+    json_responseBody = json.dumps(responseBody)
+    logger.info("Response body: %s", json_responseBody)
+
+    headers = {
+        'content-type': '',
+        'content-length': str(len(json_responseBody))
+    }
+
+    started = time.perf_counter()
+    for attempt in range(1, RESPONSE_ATTEMPTS + 1):
+        try:
+            response = http.request(
+                'PUT', event['ResponseURL'], headers=headers, body=json_responseBody)
+            logger.info("Status code: %s", response.status)
+            if response.status < 500:
+                _record_send(started, attempt)
+                return responseBody
+        except Exception as e:
+            logger.warning("send(..) attempt %d failed: %s", attempt, e)
+
+        if attempt < RESPONSE_ATTEMPTS:
+            time.sleep(RESPONSE_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+
+    logger.error("send(..) gave up after %d attempts", RESPONSE_ATTEMPTS)
+    _record_send(started, RESPONSE_ATTEMPTS, error=True)
+    return {}
+
+
+def _record_send(started, attempts, error=False):
+    call_metrics.recorder.call(
+        "cloudformation", "SendResponse", (time.perf_counter() - started) * 1000, attempts - 1, error)
+
+
+def invocation(context, request_type=None):
+    """
+    Context manager reporting the AWS calls made in its block, for handlers
+    that do not go through `handle()`.
+    """
+    return call_metrics.invocation(context, request_type)
+
+
+def remaining_seconds(context, margin_ms=DEADLINE_MARGIN_MS):
+    """
+    Seconds left before the deadline guard reports FAILED.
+    """
+    return max(0.0, (context.get_remaining_time_in_millis() - margin_ms) / 1000.0)
+
+
+def _run_with_deadline(fn, event, context):
+    outcome = {}
+
+    def target():
+        try:
+            outcome["data"] = fn(event, context)
+        except Exception as e:
+            logger.exception("Handler for %s failed", event['RequestType'])
+            outcome["error"] = e
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(remaining_seconds(context))
+
+    if worker.is_alive():
+        raise TimeoutError(
+            "{} did not finish before the Lambda deadline".format(event['RequestType']))
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("data")
+
+
+def handle(event, context, on_create=None, on_update=None, on_delete=None):
+    """
+    Dispatch a custom resource event to the matching callback and send exactly
+    one response to CloudFormation.
+
+    Callbacks take `(event, context)` and return the response `Data` dict.
+    Request types without a callback succeed with "No action required".
+    """
+    callbacks = {
+        "Create": on_create,
+        "Update": on_update,
+        "Delete": on_delete,
+    }
+    with invocation(context, event['RequestType']):
+        return _dispatch(event, context, callbacks.get(event['RequestType']))
+
+
+def _dispatch(event, context, callback):
+    if callback is None:
+        send(event, context, SUCCESS, {"message": "No action required"})
+        return '{ "status": 200, "message": "success" }'
+
+    try:
+        data = _run_with_deadline(callback, event, context)
+    except ResourceFailed as e:
+        send(event, context, FAILED, dict(e.data, message=str(e)), reason=str(e))
+        return str(e)
+    except Exception as e:
+        send(event, context, FAILED, {"message": str(e)}, reason=str(e))
+        return str(e)
+
+    send(event, context, SUCCESS, data or {"message": "Completed Successfully"})
+    return '{ "status": 200, "message": "success" }'
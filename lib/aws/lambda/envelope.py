@@ -0,0 +1,82 @@
+"""
+Envelope encryption with a single KMS data key per invocation.
+
+Instead of one KMS `Encrypt` call per secret (each capped at 4 KB of
+plaintext), `GenerateDataKey` is called once and every value is encrypted
+locally with AES-256-GCM. Enabled by setting ENVELOPE_ENCRYPTION=true on the
+function; the `cryptography` package must then be importable (e.g. from a
+Lambda layer), since the Python runtime does not ship it. Without it the
+request fails before anything is written.
+
+Stored format (version 1):
+
+    <prefix>/envelope-data-key   base64(KMS CiphertextBlob of the data key)
+    <prefix>/<name>              base64(0x01 || nonce[12] || ciphertext || tag[16])
+
+To decrypt, call KMS `Decrypt` on the data key parameter once, then AES-GCM
+decrypt each value with the 12 byte nonce, no associated data and the 16 byte
+tag appended to the ciphertext.
+"""
+import base64
+import importlib.util
+import os
+
+DATA_KEY_NAME = "envelope-data-key"
+FORMAT_VERSION = b"\x01"
+NONCE_BYTES = 12
+
+
+def enabled():
+    if os.environ.get("ENVELOPE_ENCRYPTION", "false").lower() != "true":
+        return False
+    if importlib.util.find_spec("cryptography") is None:
+        raise RuntimeError(
+            "ENVELOPE_ENCRYPTION=true requires the 'cryptography' package, which the "
+            "Lambda Python runtime does not include: add a layer providing it, or unset "
+            "ENVELOPE_ENCRYPTION to encrypt each value with KMS")
+    return True
+
+
+class DataKey:
+    """
+    A plaintext AES-256 data key together with its KMS-wrapped form.
+    """
+
+    def __init__(self, plaintext, wrapped):
+        # Imported here, so that handlers only load it when envelope
+        # encryption is used.
+        try:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        except ImportError:
+            raise RuntimeError(
+                "ENVELOPE_ENCRYPTION requires the 'cryptography' package")
+        self._aead = AESGCM(plaintext)
+        self.wrapped = wrapped
+
+    def wrapped_b64(self):
+        return base64.b64encode(self.wrapped).decode("utf-8")
+
+    def encrypt(self, plaintext):
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode("utf-8")
+        nonce = os.urandom(NONCE_BYTES)
+        sealed = self._aead.encrypt(nonce, plaintext, None)
+        return base64.b64encode(FORMAT_VERSION + nonce + sealed).decode("utf-8")
+
+    def decrypt(self, value):
+        raw = base64.b64decode(value)
+        if raw[:1] != FORMAT_VERSION:
+            raise ValueError("unsupported envelope format version")
+        nonce = raw[1:1 + NONCE_BYTES]
+        return self._aead.decrypt(nonce, raw[1 + NONCE_BYTES:], None).decode("utf-8")
+
+
+def generate_data_key(kms_client, key_id):
+    response = kms_client.generate_data_key(KeyId=key_id, KeySpec="AES_256")
+    return DataKey(response["Plaintext"], response["CiphertextBlob"])
+
+
+def unwrap_data_key(kms_client, wrapped_b64):
+    wrapped = base64.b64decode(wrapped_b64)
+    response = kms_client.decrypt(CiphertextBlob=wrapped)
+    return DataKey(response["Plaintext"], wrapped)
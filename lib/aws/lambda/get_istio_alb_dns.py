@@ -1,52 +1,195 @@
-import boto3
 import logging
 import json
+import os
+import time
 import traceback
 
+import custom_resource as cr
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def find_alb_by_namespace():
+elbv2 = cr.client('elbv2')
+ssm = cr.client('ssm')
+
+CLUSTER_TAG = 'elbv2.k8s.aws/cluster'
+INGRESS_STACK_TAG = 'ingress.k8s.aws/stack'
+
+# DescribeTags accepts at most 20 resource ARNs per call.
+TAGS_BATCH_SIZE = 20
+
+POLL_INITIAL_DELAY = 2.0
+POLL_MAX_DELAY = 30.0
+
+
+def describe_tags(arns):
     """
-    Find the ALB by matching its name with expected namespace patterns.
+    Return the tags of every load balancer in `arns` as {arn: {key: value}}.
     """
-    elbv2 = boto3.client('elbv2')
+    tags = {}
+    for i in range(0, len(arns), TAGS_BATCH_SIZE):
+        response = elbv2.describe_tags(ResourceArns=arns[i:i + TAGS_BATCH_SIZE])
+        for description in response['TagDescriptions']:
+            tags[description['ResourceArn']] = {
+                tag['Key']: tag['Value'] for tag in description.get('Tags', [])
+            }
+    return tags
 
-    # Get all load balancers
-    response = elbv2.describe_load_balancers()
-    load_balancers = response.get('LoadBalancers', [])
-    logger.info(f"Found {len(load_balancers)} load balancers")
 
-    # The expected naming patterns for AWS Load Balancer Controller
+def matches_name_pattern(lb_name):
+    # The expected naming patterns for AWS Load Balancer Controller, used when
+    # the cluster and ingress tags to match on are not configured.
     k8s_prefix = 'k8s-'
     namespace_patterns = ['hyperswitchistioa', 'hyperswitchistio', 'istiosystem']
+    return any(lb_name.startswith(k8s_prefix + pattern) for pattern in namespace_patterns)
+
+
+def is_istio_alb(lb, lb_tags, cluster_name, ingress_stack):
+    """
+    Whether `lb`, with its tags, is the ALB of the Istio ingress: by its tags
+    when the cluster is configured, by its name otherwise.
+    """
+    if lb.get('Type') != 'application':
+        return False
+    if not cluster_name:
+        return matches_name_pattern(lb['LoadBalancerName'])
+    if lb_tags.get(CLUSTER_TAG) != cluster_name:
+        return False
+    return not ingress_stack or lb_tags.get(INGRESS_STACK_TAG) == ingress_stack
+
+
+def describe_alb(arn):
+    """
+    The load balancer `arn`, or None when it no longer exists.
+    """
+    try:
+        return elbv2.describe_load_balancers(LoadBalancerArns=[arn])['LoadBalancers'][0]
+    except elbv2.exceptions.LoadBalancerNotFoundException:
+        return None
+
+
+def find_alb_by_tags(cluster_name, ingress_stack):
+    """
+    Page through every application load balancer and return the one the AWS
+    Load Balancer Controller created for the Istio ingress, or None.
+    """
+    candidates = []
+    paginator = elbv2.get_paginator('describe_load_balancers')
+    for page in paginator.paginate():
+        for lb in page['LoadBalancers']:
+            if lb.get('Type') != 'application':
+                continue
+            if cluster_name or lb['LoadBalancerName'].startswith('k8s-'):
+                candidates.append(lb)
+    logger.info(f"Found {len(candidates)} candidate load balancers")
+
+    if not cluster_name:
+        for lb in candidates:
+            if matches_name_pattern(lb['LoadBalancerName']):
+                logger.info(f"Found ALB by name pattern: {lb['LoadBalancerName']}")
+                return lb
+        return None
 
-    # Look for ALBs matching the naming pattern
-    for lb in load_balancers:
-        lb_name = lb['LoadBalancerName']
-        if lb_name.startswith(k8s_prefix):
-            for pattern in namespace_patterns:
-                if lb_name.startswith(k8s_prefix + pattern):
-                    logger.info(f"Found ALB by name pattern: {lb_name}")
-                    return lb['DNSName']
-    
-    # If not found
-    logger.warning("No ALB found matching expected namespace patterns")
+    tags = describe_tags([lb['LoadBalancerArn'] for lb in candidates])
+    for lb in candidates:
+        if is_istio_alb(lb, tags.get(lb['LoadBalancerArn'], {}), cluster_name, ingress_stack):
+            logger.info(f"Found ALB by tags: {lb['LoadBalancerName']}")
+            return lb
     return None
 
+
+def read_cached_alb(parameter_name, cluster_name, ingress_stack):
+    """
+    Resolve the ALB recorded by a previous invocation, or None when there is
+    none, or when it is gone or no longer carries the cluster and ingress
+    tags (it was replaced), in which case the caller scans for it again.
+    """
+    try:
+        cached = json.loads(ssm.get_parameter(Name=parameter_name)['Parameter']['Value'])
+        lb = describe_alb(cached['arn'])
+        lb_tags = describe_tags([lb['LoadBalancerArn']]).get(lb['LoadBalancerArn'], {}) if lb and cluster_name else {}
+    except Exception as e:
+        logger.info(f"No usable cached ALB in {parameter_name}: {e}")
+        return None
+    if lb is None or not is_istio_alb(lb, lb_tags, cluster_name, ingress_stack):
+        logger.info(f"The ALB cached in {parameter_name} is no longer the Istio ALB")
+        return None
+    return lb
+
+
+def write_cached_alb(parameter_name, lb):
+    ssm.put_parameter(
+        Name=parameter_name,
+        Value=json.dumps({'arn': lb['LoadBalancerArn'], 'dns': lb['DNSName']}),
+        Type='String',
+        Overwrite=True,
+    )
+
+
+def delete_cached_alb(parameter_name):
+    try:
+        ssm.delete_parameter(Name=parameter_name)
+    except ssm.exceptions.ParameterNotFound:
+        pass
+
+
+def wait_for_alb(context, cluster_name, ingress_stack, cache_parameter):
+    """
+    Poll with exponential backoff until the ALB exists and is active, or the
+    Lambda deadline is reached. A freshly discovered ALB is recorded in the
+    cache parameter so later invocations skip the scan.
+    """
+    delay = POLL_INITIAL_DELAY
+    lb = read_cached_alb(cache_parameter, cluster_name, ingress_stack) if cache_parameter else None
+    scanned = False
+    while True:
+        if lb is None:
+            lb = find_alb_by_tags(cluster_name, ingress_stack)
+            scanned = True
+        elif lb['State']['Code'] != 'active':
+            # Scanned for again on the next attempt when it was deleted.
+            lb = describe_alb(lb['LoadBalancerArn'])
+
+        if lb is not None and lb['State']['Code'] == 'active':
+            if scanned and cache_parameter:
+                write_cached_alb(cache_parameter, lb)
+            return lb
+
+        remaining = cr.remaining_seconds(context)
+        if remaining <= delay:
+            logger.warning("Deadline reached before the ALB became active")
+            return None
+        state = lb['State']['Code'] if lb else 'not created'
+        logger.info(f"ALB {state}, retrying in {delay:.0f}s")
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+
 def handler(event, context):
     """
     Lambda function to find the DNS name of the Istio ALB created by AWS Load Balancer Controller.
     """
     logger.info(f"Lambda invoked with event: {json.dumps(event)}")
 
+    cluster_name = os.environ.get('CLUSTER_NAME')
+    ingress_stack = os.environ.get('INGRESS_STACK')
+    cache_parameter = os.environ.get('CACHE_PARAMETER')
+
     try:
-        dns_name = find_alb_by_namespace()
+        if event.get('RequestType') == 'Delete':
+            with cr.invocation(context, 'Delete'):
+                if cache_parameter:
+                    delete_cached_alb(cache_parameter)
+            return {'DnsName': ''}
+
+        with cr.invocation(context, event.get('RequestType')):
+            lb = wait_for_alb(context, cluster_name, ingress_stack, cache_parameter)
 
-        if dns_name:
-            result = {'DnsName': dns_name}
+        if lb:
+            result = {'DnsName': lb['DNSName']}
         else:
+            logger.warning("No ALB found matching the Istio ingress")
             result = {'DnsName': 'istio-alb-not-found.example.com'}
 
         logger.info(f"Lambda response: {json.dumps(result)}")
@@ -57,4 +200,4 @@ def handler(event, context):
         logger.error(traceback.format_exc())
         return {
             'DnsName': f'error-{str(e)[:50]}'
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,186 @@
+"""
+Move the KMS ciphertexts stored under an SSM path to another KMS key.
+
+Every parameter under the path is passed to KMS `ReEncrypt`, so the
+plaintexts never leave KMS. Values that are not KMS ciphertexts, such as
+plain values or envelope-encrypted ones, come back as InvalidCiphertext and
+are skipped. With envelope encryption only the wrapped data key
+(envelope-data-key) is a KMS ciphertext, so only that is rewritten. Values
+already under the new key are left as they are.
+
+Parameters are processed in name order, in chunks of ROTATION_CHUNK_SIZE.
+A chunk is re-encrypted on a bounded thread pool and then written back
+through a parameter_writer.Writer. After each chunk the progress is saved in
+the CHECKPOINT_NAME parameter: the last name done and the names that failed.
+A rotation to the same key resumes from there, and retries the failed names.
+When the time left in the invocation would not fit another chunk, `rotate()`
+returns with `state` "paused" so that the caller can continue in a new
+invocation. Once every value has been moved, the HMAC key of the
+provisioning manifest is re-encrypted as well and the checkpoint removed.
+"""
+import base64
+import binascii
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import custom_resource as cr
+import secret_manifest
+import secret_pipeline
+
+logger = logging.getLogger()
+
+CHECKPOINT_NAME = "rotation-checkpoint"
+DEFAULT_CHUNK_SIZE = 50
+
+
+def chunk_size():
+    return max(1, int(os.environ.get("ROTATION_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)))
+
+
+def list_parameters(ssm, path):
+    """
+    (name, value, type) of every parameter under `path`, sorted by name.
+    """
+    paginator = ssm.get_paginator("get_parameters_by_path")
+    return sorted(
+        (parameter["Name"], parameter["Value"], parameter["Type"])
+        for page in paginator.paginate(Path=path, Recursive=True)
+        for parameter in page["Parameters"]
+    )
+
+
+class Rotation:
+    """
+    The re-encryption of values to `key_arn`. `reencrypt(value)` returns the
+    new base64 ciphertext, or None when the value is not a KMS ciphertext or
+    is already under the key.
+    """
+
+    def __init__(self, kms, key_arn, source_key_id=None):
+        self.kms = kms
+        self.key_arn = key_arn
+        self.source_key_id = source_key_id
+
+    def reencrypt(self, value):
+        try:
+            blob = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        request = {"CiphertextBlob": blob, "DestinationKeyId": self.key_arn}
+        if self.source_key_id:
+            request["SourceKeyId"] = self.source_key_id
+        try:
+            response = self.kms.re_encrypt(**request)
+        except (self.kms.exceptions.InvalidCiphertextException, self.kms.exceptions.IncorrectKeyException):
+            return None
+        if response["SourceKeyId"] == self.key_arn:
+            return None
+        return base64.b64encode(response["CiphertextBlob"]).decode("utf-8")
+
+
+def load_checkpoint(ssm, path, key_arn):
+    try:
+        raw = ssm.get_parameter(Name=path + CHECKPOINT_NAME)["Parameter"]["Value"]
+    except ssm.exceptions.ParameterNotFound:
+        return {"key_id": key_arn, "cursor": None, "failed": {}}
+    checkpoint = json.loads(raw)
+    if checkpoint.get("key_id") != key_arn:
+        logger.info("Discarding the checkpoint of a rotation to %s", checkpoint.get("key_id"))
+        return {"key_id": key_arn, "cursor": None, "failed": {}}
+    return checkpoint
+
+
+def summary(counts, failed, remaining):
+    data = {name: str(count) for name, count in counts.items()}
+    data.update(failed=",".join(sorted(failed)), remaining=str(remaining))
+    return data
+
+
+def rotate(ssm, writer, kms, path, key_id, context, source_key_id=None):
+    """
+    Rotate the ciphertexts under `path` to `key_id` (a key id, ARN or alias)
+    until they are all done or the invocation runs out of time. Returns the
+    Data of the run, with `state` "complete", "paused" or "failed".
+    """
+    key = kms.describe_key(KeyId=key_id)["KeyMetadata"]
+    key_arn = key["Arn"]
+    rotation = Rotation(kms, key_arn, source_key_id)
+    checkpoint = load_checkpoint(ssm, path, key_arn)
+    manifest_name = path + secret_manifest.MANIFEST_NAME
+
+    cursor = checkpoint["cursor"]
+    retry = set(checkpoint["failed"])
+    pending = [
+        parameter for parameter in list_parameters(ssm, path)
+        if parameter[0] not in (path + CHECKPOINT_NAME, manifest_name)
+        and (cursor is None or parameter[0] > cursor or parameter[0] in retry)
+    ]
+    logger.info("Rotating %d parameters under %s to %s (resuming after %s)", len(pending), path, key_arn, cursor)
+
+    counts = {"rotated": 0, "unchanged": 0}
+    failed = dict(checkpoint["failed"])
+    size = chunk_size()
+    chunk_seconds = 0.0
+    with ThreadPoolExecutor(max_workers=secret_pipeline.worker_count()) as pool:
+        for start in range(0, len(pending), size):
+            if start and cr.remaining_seconds(context) < 2 * chunk_seconds:
+                return dict(
+                    summary(counts, failed, len(pending) - start),
+                    state="paused", message="Paused after {}".format(cursor))
+
+            started = time.monotonic()
+            chunk = pending[start:start + size]
+
+            def rotate_one(parameter):
+                name, value, type = parameter
+                ciphertext = rotation.reencrypt(value)
+                if ciphertext is not None:
+                    writer.put(name, ciphertext, type)
+                return ciphertext is not None
+
+            futures = [(parameter[0], pool.submit(rotate_one, parameter)) for parameter in chunk]
+            for name, future in futures:
+                error = future.exception()
+                if error is not None:
+                    logger.error("Rotating %s failed: %s", name, error)
+                    failed[name] = str(error)
+                    continue
+                failed.pop(name, None)
+                counts["rotated" if future.result() else "unchanged"] += 1
+
+            if cursor is None or chunk[-1][0] > cursor:
+                cursor = chunk[-1][0]
+            checkpoint = {"key_id": key_arn, "cursor": cursor, "failed": failed}
+            writer.put(path + CHECKPOINT_NAME, json.dumps(checkpoint, sort_keys=True))
+            chunk_seconds = time.monotonic() - started
+
+    data = summary(counts, failed, 0)
+    if failed:
+        return dict(data, state="failed", message="Failed to rotate {} parameters".format(len(failed)))
+
+    rekey_manifest(ssm, writer, rotation, manifest_name, key_id)
+    ssm.delete_parameters(Names=[path + CHECKPOINT_NAME])
+    return dict(data, state="complete", message="Rotated the parameters under {} to {}".format(path, key_arn))
+
+
+def rekey_manifest(ssm, writer, rotation, name, key_id):
+    """
+    Re-encrypt the manifest's HMAC key and record `key_id`, as requested, in
+    it, so that the next incremental Update with the target's key set to the
+    same value keeps its digests.
+    """
+    try:
+        raw = ssm.get_parameter(Name=name)["Parameter"]["Value"]
+    except ssm.exceptions.ParameterNotFound:
+        return
+    document = json.loads(raw)
+    wrapped = rotation.reencrypt(document["hmac_key"])
+    if wrapped is None and document.get("key_id") == key_id:
+        return
+    if wrapped is not None:
+        document["hmac_key"] = wrapped
+    document["key_id"] = key_id
+    writer.put(name, json.dumps(document, sort_keys=True))
@@ -0,0 +1,174 @@
+"""
+Throttle-aware scheduling of SSM PutParameter calls.
+
+Every write first takes a token from a bucket shared by all the writers of a
+region in the process. The bucket starts at SSM_WRITE_RATE writes per second
+(bursting to SSM_WRITE_BURST), by default the PutParameter quota of an
+account with the standard parameter throughput, 3 per second. Accounts with a
+raised quota can set a higher rate. A throttled write (ThrottlingException,
+TooManyUpdates, ...) halves the rate and is retried after a jittered
+exponential backoff. Each successful write raises the rate again, up to the
+configured one. Writers in other Lambdas that hit the same account quota slow
+this one down through their throttles, so the pipeline settles at the
+throughput the quota allows instead of failing the deploy.
+
+The client used for writing should not retry by itself (max_attempts=1), so
+that every throttle is seen and paced here.
+
+Parameters are written with the Intelligent-Tiering tier: SSM stores values
+that fit the 4 KB Standard limit as Standard and the rest, as well as
+existing Advanced parameters, as Advanced, in a single write.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+from call_metrics import THROTTLE_CODES
+
+logger = logging.getLogger()
+
+DEFAULT_RATE = 3.0
+DEFAULT_BURST = 3
+MIN_RATE = 0.5
+RATE_INCREASE = 0.2
+# Throttles of writes that were already in flight when the rate was cut do
+# not cut it again.
+DECREASE_INTERVAL_SECONDS = 1.0
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_MAX_SECONDS = 8.0
+
+STANDARD_TIER_MAX_BYTES = 4096
+
+
+class TokenBucket:
+    """
+    Rate limiter with additive increase and multiplicative decrease of its
+    refill rate.
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._decreased = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Take a token, sleeping until it is available. The token is reserved
+        under the lock, which may leave the bucket in debt, and the wait for
+        it happens outside, so waiters are served in order without holding
+        up the other threads. Returns the seconds waited.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            waited = max(0.0, -self._tokens / self.rate)
+        if waited:
+            time.sleep(waited)
+        return waited
+
+    def throttled(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decreased >= DECREASE_INTERVAL_SECONDS:
+                self.rate = max(MIN_RATE, self.rate / 2)
+                self._decreased = now
+            self._tokens = min(self._tokens, 0.0)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_for(region):
+    with _buckets_lock:
+        bucket = _buckets.get(region)
+        if bucket is None:
+            bucket = _buckets[region] = TokenBucket(
+                float(os.environ.get("SSM_WRITE_RATE", DEFAULT_RATE)),
+                int(os.environ.get("SSM_WRITE_BURST", DEFAULT_BURST)))
+        return bucket
+
+
+def tier_of(response, value):
+    """
+    The tier SSM chose for an Intelligent-Tiering write, or the one the value
+    needs when the response does not say.
+    """
+    tier = response.get("Tier")
+    if tier in ("Standard", "Advanced"):
+        return tier
+    return "Standard" if len(value.encode("utf-8")) <= STANDARD_TIER_MAX_BYTES else "Advanced"
+
+
+def _error_code(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code")
+
+
+class Writer:
+    """
+    Writes parameters through the shared bucket of the client's region and
+    counts what happened, for the response Data of one invocation.
+    """
+
+    def __init__(self, ssm):
+        self.ssm = ssm
+        self.bucket = bucket_for(ssm.meta.region_name)
+        self._lock = threading.Lock()
+        self.counts = {"writes": 0, "throttled": 0, "standard": 0, "advanced": 0}
+        self.waited = 0.0
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _wait(self):
+        waited = self.bucket.acquire()
+        with self._lock:
+            self.waited += waited
+
+    def put(self, name, value, type="String"):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            self._wait()
+            try:
+                response = self.ssm.put_parameter(
+                    Name=name, Value=value, Type=type, Tier="Intelligent-Tiering", Overwrite=True)
+            except Exception as e:
+                code = _error_code(e)
+                if code in THROTTLE_CODES and attempt < MAX_ATTEMPTS:
+                    self._count("throttled")
+                    self.bucket.throttled()
+                    backoff = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                    logger.info("PutParameter %s throttled (%s), retrying in %.2fs", name, code, backoff)
+                    time.sleep(backoff)
+                    continue
+                raise
+            self.bucket.succeeded()
+            self._count("writes")
+            self._count(tier_of(response, value).lower())
+            return
+        raise RuntimeError("PutParameter {} did not succeed in {} attempts".format(name, MAX_ATTEMPTS))
+
+    def summary(self):
+        """
+        The counts of this writer as response Data values.
+        """
+        with self._lock:
+            data = {"ssm" + name.capitalize(): str(count) for name, count in self.counts.items()}
+            data["ssmWaitSeconds"] = "{:.1f}".format(self.waited)
+        return data
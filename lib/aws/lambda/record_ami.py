@@ -2,32 +2,188 @@ from typing import Union
 import json
 import os
 import logging
-import boto3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import custom_resource as cr
+
 logging.getLogger().setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
+# AMIs kept per region in the history of an image, overridable with AMI_RETENTION.
+DEFAULT_RETENTION = 5
+MAX_WORKERS = 8
+# Writes of the history retried after losing to a concurrent invocation.
+MAX_HISTORY_ATTEMPTS = 5
+
+
+def read_parameter(ssm_client, name):
+    try:
+        return ssm_client.get_parameter(Name=name)["Parameter"]["Value"]
+    except ssm_client.exceptions.ParameterNotFound:
+        return None
+
+
+def read_versioned(ssm_client, name):
+    """
+    The value and version of a parameter, or (None, 0) when it does not exist.
+    """
+    try:
+        parameter = ssm_client.get_parameter(Name=name)["Parameter"]
+    except ssm_client.exceptions.ParameterNotFound:
+        return None, 0
+    return parameter["Value"], parameter["Version"]
+
+
+def put_parameter(ssm_client, name, value):
+    """
+    Write a parameter, returning the version it was written as.
+    """
+    return ssm_client.put_parameter(
+        Name=name,
+        Value=value,
+        Type="String",
+        DataType="text",
+        Tier="Advanced",
+        Overwrite=True,
+    )["Version"]
+
+
+def built_amis(event):
+    """
+    Every AMI output, in every region, of the successful builds in the SNS records.
+    """
+    default_region = os.environ.get("AWS_REGION")
+    for record in event.get("Records", []):
+        body = json.loads(record["Sns"]["Message"])
+        status = body.get("state", {}).get("status")
+        if status and status != "AVAILABLE":
+            logger.info(f"skipping build {body.get('arn')} in state {status}")
+            continue
+        for ami in body.get("outputResources", {}).get("amis", []):
+            yield {"ami": ami["image"], "region": ami.get("region", default_region)}
+
+
+def apply_retention(history, retention):
+    """
+    Split a newest-first history into the entries kept (the newest `retention`
+    per region) and the expired ones.
+    """
+    kept, expired = [], []
+    per_region = {}
+    for entry in history:
+        count = per_region.get(entry["region"], 0)
+        (kept if count < retention else expired).append(entry)
+        per_region[entry["region"]] = count + 1
+    return kept, expired
+
+
+def deregister(entry):
+    """
+    Deregister an expired AMI and delete the snapshots backing it.
+    """
+    ec2 = cr.client("ec2", entry["region"])
+    images = ec2.describe_images(ImageIds=[entry["ami"]])["Images"]
+    snapshots = [
+        mapping["Ebs"]["SnapshotId"]
+        for image in images
+        for mapping in image.get("BlockDeviceMappings", [])
+        if mapping.get("Ebs", {}).get("SnapshotId")
+    ]
+    ec2.deregister_image(ImageId=entry["ami"])
+    for snapshot in snapshots:
+        ec2.delete_snapshot(SnapshotId=snapshot)
 
-def lambda_handler(event, _):
+
+def merge_history(*histories):
+    """
+    The newest-first union of `histories`, one entry per AMI.
+    """
+    entries = {}
+    for history in histories:
+        for entry in history:
+            entries.setdefault(entry["ami"], entry)
+    return sorted(entries.values(), key=lambda entry: entry["timestamp"], reverse=True)
+
+
+def cleanup(expired):
+    """
+    Deregister the expired AMIs in parallel. Returns the entries that could
+    not be removed so that the next invocation retries them.
+    """
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = [(entry, pool.submit(deregister, entry)) for entry in expired]
+
+    leftover = []
+    for entry, future in futures:
+        error = future.exception()
+        if error is None:
+            logger.info(f"deregistered {entry['ami']} in {entry['region']}")
+        elif "InvalidAMIID" in str(error):
+            logger.info(f"{entry['ami']} in {entry['region']} is already gone")
+        else:
+            logger.error(f"failed to deregister {entry['ami']} in {entry['region']}: {error}")
+            leftover.append(entry)
+    return leftover
+
+
+def update_history(ssm_client, name, added, retention):
+    """
+    Add the `added` entries to the history parameter `name`, deregister the
+    AMIs past the retention and return the history written.
+
+    SSM has no conditional writes, so the history is written and the version
+    it was written as checked instead: any version between the one read and
+    it comes from a concurrent invocation whose write was overwritten. Their
+    entries are merged back in and the history written again.
+    """
+    value, version = read_versioned(ssm_client, name)
+    history = merge_history(json.loads(value or "[]"), added)
+
+    for _ in range(MAX_HISTORY_ATTEMPTS):
+        kept, expired = apply_retention(history, retention)
+        history = kept + cleanup(expired)
+        written = put_parameter(ssm_client, name, json.dumps(history))
+        if written == version + 1:
+            return history
+        logger.info(f"{name} was written concurrently (versions {version + 1} to {written - 1}), merging")
+        history = merge_history(history, *(
+            json.loads(ssm_client.get_parameter(Name=f"{name}:{concurrent}")["Parameter"]["Value"])
+            for concurrent in range(version + 1, written)
+        ))
+        version = written
+    raise RuntimeError(f"{name} kept being written concurrently")
+
+
+def lambda_handler(event, context):
+    with cr.invocation(context, "Record"):
+        return record(event)
+
+
+def record(event):
     logger.info(event)
 
-    message_body = event.get("Records")[0].get("Sns").get("Message")
-    json_body = json.loads(message_body)
-    ami = json_body["outputResources"]["amis"][0]["image"]
+    amis = list(built_amis(event))
+    if not amis:
+        return create_response(200, {})
+
     ssm_key = os.environ["IMAGE_SSM_NAME"]
-    logger.info(f"updating ssm {ssm_key}")
-    ssm_client = boto3.client("ssm")
-    try:
-        result = ssm_client.put_parameter(
-            Name=ssm_key,
-            Value=ami,
-            Type="String",
-            DataType="text",
-            Tier="Advanced",
-            Overwrite=True,
-        )
-        logger.info(result)
-    except Exception as e:
-        logger.error(e)
+    retention = max(1, int(os.environ.get("AMI_RETENTION", DEFAULT_RETENTION)))
+    ssm_client = cr.client("ssm")
+
+    build_hash = read_parameter(ssm_client, f"{ssm_key}_pending_hash")
+    timestamp = int(time.time())
+    history = update_history(ssm_client, f"{ssm_key}_history", [
+        {"ami": ami["ami"], "region": ami["region"], "hash": build_hash, "timestamp": timestamp}
+        for ami in amis
+    ], retention)
+
+    own_region = os.environ.get("AWS_REGION")
+    current = next((entry["ami"] for entry in history if entry["region"] == own_region), history[0]["ami"])
+    logger.info(f"updating ssm {ssm_key} to {current}")
+    put_parameter(ssm_client, ssm_key, current)
+    if build_hash:
+        put_parameter(ssm_client, f"{ssm_key}_hash", build_hash)
 
     return create_response(200, {})
 
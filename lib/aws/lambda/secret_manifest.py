@@ -0,0 +1,77 @@
+"""
+Manifest of keyed digests for provisioned secrets.
+
+The manifest is stored as a plain parameter next to the secrets it describes
+and records an HMAC-SHA256 of every plaintext that was last written. The HMAC
+key is a KMS data key kept in wrapped form inside the manifest, so the digests
+reveal nothing about the plaintexts without KMS access. On Update only keys
+whose digest changed are re-encrypted and re-written.
+"""
+import base64
+import hashlib
+import hmac
+import json
+
+MANIFEST_NAME = "provisioning-manifest"
+VERSION = 1
+
+
+class Manifest:
+
+    def __init__(self, hmac_key, wrapped_key, key_id, mode, digests=None):
+        self._hmac_key = hmac_key
+        self.wrapped_key = wrapped_key
+        self.key_id = key_id
+        self.mode = mode
+        self.digests = dict(digests or {})
+
+    def digest(self, plaintext):
+        return hmac.new(self._hmac_key, plaintext.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def changed(self, plaintexts):
+        """
+        The subset of `plaintexts` whose digest differs from the recorded one.
+        """
+        return {
+            key: value for key, value in plaintexts.items()
+            if value is None or self.digests.get(key) != self.digest(value)
+        }
+
+    def record(self, plaintexts, keys):
+        for key in keys:
+            self.digests[key] = self.digest(plaintexts[key])
+
+    def dumps(self):
+        return json.dumps({
+            "version": VERSION,
+            "key_id": self.key_id,
+            "mode": self.mode,
+            "hmac_key": base64.b64encode(self.wrapped_key).decode("utf-8"),
+            "digests": self.digests,
+        }, sort_keys=True)
+
+
+def create(kms_client, key_id, mode):
+    response = kms_client.generate_data_key(KeyId=key_id, KeySpec="AES_256")
+    return Manifest(response["Plaintext"], response["CiphertextBlob"], key_id, mode)
+
+
+def load(read, kms_client, key_id, mode):
+    """
+    Load the stored manifest through `read(name)`. Returns None when there is
+    none, or when it was written for another KMS key or encryption mode, in
+    which case every secret has to be provisioned again.
+    """
+    raw = read(MANIFEST_NAME)
+    if raw is None:
+        return None
+
+    document = json.loads(raw)
+    if (document.get("version") != VERSION
+            or document.get("key_id") != key_id
+            or document.get("mode") != mode):
+        return None
+
+    wrapped_key = base64.b64decode(document["hmac_key"])
+    hmac_key = kms_client.decrypt(CiphertextBlob=wrapped_key)["Plaintext"]
+    return Manifest(hmac_key, wrapped_key, key_id, mode, document.get("digests"))
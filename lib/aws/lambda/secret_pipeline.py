@@ -0,0 +1,199 @@
+"""
+Concurrent encrypt-and-store pipeline for the secret provisioning Lambdas.
+
+Each key is encrypted and written in its own task on a bounded thread pool, so
+the KMS and SSM round-trips of different keys overlap instead of running one
+after another. Failures are collected per key rather than aborting the batch.
+
+`provision()` wraps the pipeline with the encryption mode selection and the
+digest manifest that lets Update re-write only the keys that changed, and
+`delete_parameters()` tears the parameters down in concurrent batches.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import custom_resource as cr
+import envelope
+import secret_manifest
+
+logger = logging.getLogger()
+
+DEFAULT_WORKERS = 8
+
+# Maximum number of names accepted by a single SSM DeleteParameters call.
+DELETE_BATCH_SIZE = 10
+
+
+def worker_count():
+    """
+    Pool size, overridable through the PROVISIONING_WORKERS environment variable.
+    """
+    return max(1, int(os.environ.get("PROVISIONING_WORKERS", DEFAULT_WORKERS)))
+
+
+def run(plaintexts, encrypt, store, max_workers=None, plain=()):
+    """
+    Encrypt every value of `plaintexts` with `encrypt(plaintext)` and write it
+    with `store(key, ciphertext)`. Keys in `plain` are written unencrypted.
+
+    Returns `(succeeded, failed)`: the keys that were stored and a mapping of
+    the keys that were not to their error message.
+    """
+    def task(key):
+        plaintext = plaintexts[key]
+        if plaintext is None:
+            raise ValueError("no plaintext provided")
+        store(key, plaintext if key in plain else encrypt(plaintext))
+
+    with ThreadPoolExecutor(max_workers=max_workers or worker_count()) as pool:
+        futures = {key: pool.submit(task, key) for key in plaintexts}
+
+    succeeded = []
+    failed = {}
+    for key, future in futures.items():
+        error = future.exception()
+        if error is None:
+            succeeded.append(key)
+        else:
+            logger.error("Provisioning %s failed: %s", key, error)
+            failed[key] = str(error)
+
+    return succeeded, failed
+
+
+def report(succeeded, failed, unchanged=0, extra=None):
+    """
+    Build the custom resource response Data for a pipeline run, raising
+    `ResourceFailed` with the partial results when any key failed. `extra`
+    is merged into the Data.
+    """
+    data = {
+        "succeeded": ",".join(sorted(succeeded)),
+        "failed": ",".join(sorted(failed)),
+        "unchanged": str(unchanged),
+    }
+    data.update(extra or {})
+    if failed:
+        raise cr.ResourceFailed(
+            "Failed to provision {} of {} keys: {}".format(
+                len(failed), len(succeeded) + len(failed),
+                "; ".join("{}: {}".format(key, failed[key]) for key in sorted(failed))),
+            data)
+
+    data["message"] = "Completed Successfully"
+    return data
+
+
+def provision(plaintexts, key_id, kms_client, encryptor, read, store, incremental=False, stats=None, plain=()):
+    """
+    Encrypt and store `plaintexts`, returning the response Data of `report()`.
+
+    `encryptor` encrypts a single value with KMS and is used unless envelope
+    encryption is enabled. `read(key)` returns the stored value of a key or
+    None and `store(key, value)` writes one. With `incremental` the stored
+    manifest is consulted and only keys whose plaintext changed are written.
+    `stats()`, when given, returns Data to add to the response, such as the
+    write counts of a parameter_writer.Writer. Keys in `plain` are written
+    unencrypted.
+    """
+    mode = "envelope" if envelope.enabled() else "kms"
+
+    manifest = None
+    data_key = None
+    if incremental:
+        manifest = secret_manifest.load(read, kms_client, key_id, mode)
+    if manifest is not None and mode == "envelope":
+        # Keys left untouched stay sealed under the stored data key, so the
+        # changed ones have to be sealed with that same key.
+        wrapped = read(envelope.DATA_KEY_NAME)
+        if wrapped is None:
+            manifest = None
+        else:
+            data_key = envelope.unwrap_data_key(kms_client, wrapped)
+    if manifest is None:
+        manifest = secret_manifest.create(kms_client, key_id, mode)
+
+    pending = manifest.changed(plaintexts)
+    logger.info("Provisioning %d of %d keys", len(pending), len(plaintexts))
+    if not pending:
+        return report([], {}, unchanged=len(plaintexts), extra=stats and stats())
+
+    if mode == "envelope":
+        if data_key is None:
+            data_key = envelope.generate_data_key(kms_client, key_id)
+            store(envelope.DATA_KEY_NAME, data_key.wrapped_b64())
+        encrypt = data_key.encrypt
+    else:
+        encrypt = encryptor
+
+    succeeded, failed = run(pending, encrypt, store, plain=plain)
+    if succeeded:
+        manifest.record(plaintexts, succeeded)
+        store(secret_manifest.MANIFEST_NAME, manifest.dumps())
+
+    return report(succeeded, failed, unchanged=len(plaintexts) - len(pending), extra=stats and stats())
+
+
+def sweep_enabled():
+    """
+    Whether Delete also removes every parameter under the handler's path,
+    including keys written by older releases (SWEEP_PARAMETER_PATH=true).
+    """
+    return os.environ.get("SWEEP_PARAMETER_PATH", "false").lower() == "true"
+
+
+def parameters_under(ssm, path):
+    paginator = ssm.get_paginator("get_parameters_by_path")
+    return [
+        parameter["Name"]
+        for page in paginator.paginate(Path=path, Recursive=True)
+        for parameter in page["Parameters"]
+    ]
+
+
+def delete_parameters(ssm, names, max_workers=None):
+    """
+    Delete `names` with batched DeleteParameters calls running concurrently.
+
+    Returns `(deleted, invalid)`: the names that were removed and a mapping of
+    the ones that were not (already missing, or failed) to the reason.
+    """
+    names = sorted(set(names))
+    batches = [names[i:i + DELETE_BATCH_SIZE] for i in range(0, len(names), DELETE_BATCH_SIZE)]
+
+    with ThreadPoolExecutor(max_workers=max_workers or worker_count()) as pool:
+        futures = [(batch, pool.submit(ssm.delete_parameters, Names=batch)) for batch in batches]
+
+    deleted = []
+    invalid = {}
+    for batch, future in futures:
+        error = future.exception()
+        if error is not None:
+            logger.error("Deleting %s failed: %s", batch, error)
+            invalid.update((name, str(error)) for name in batch)
+            continue
+        response = future.result()
+        deleted.extend(response.get("DeletedParameters", []))
+        invalid.update((name, "InvalidParameter") for name in response.get("InvalidParameters", []))
+
+    return deleted, invalid
+
+
+def teardown(ssm, names, path):
+    """
+    Delete the given parameters (plus everything under `path` when sweeping is
+    enabled) and build the Delete response Data.
+    """
+    if sweep_enabled():
+        names = list(names) + parameters_under(ssm, path)
+
+    deleted, invalid = delete_parameters(ssm, names)
+    for name in sorted(invalid):
+        print("Parameter {} was not deleted: {}".format(name, invalid[name]))
+
+    return {
+        "message": "Deleted {} parameters".format(len(deleted)),
+        "deleted": ",".join(sorted(deleted)),
+        "invalid": ",".join(sorted(invalid)),
+    }
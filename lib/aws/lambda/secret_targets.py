@@ -0,0 +1,106 @@
+"""
+Declarative manifest of the secret provisioning targets.
+
+Each target lists the fields it takes from the credentials in its Secrets
+Manager secret, whether each one is written KMS-encrypted, and where the
+result goes: SSM parameters under a path, or an env file in S3. The
+provisioning Lambda (lib/aws/encryption.py) drives every target from this
+table. The stacks only register the targets they deploy, together with their
+secret and output location (lib/aws/secret_provisioner.ts).
+"""
+import collections
+
+PARAMETERS = "parameters"
+ENV_FILE = "env_file"
+
+# A value written by a target: a credential `field` or a `literal`.
+Value = collections.namedtuple("Value", ["field", "literal", "encrypted"])
+
+
+def field(name, encrypted=True):
+    return Value(name, None, encrypted)
+
+
+def literal(value, encrypted=False):
+    return Value(None, value, encrypted)
+
+
+def resolve(value, credentials):
+    """
+    The plaintext of `value`. Plain strings are literals written as is.
+    """
+    if isinstance(value, str):
+        return value
+    if value.field is not None:
+        return credentials.get(value.field)
+    return value.literal
+
+
+def is_encrypted(value):
+    return not isinstance(value, str) and value.encrypted
+
+
+TARGETS = {
+    "router": {
+        "output": PARAMETERS,
+        "path": "/hyperswitch/",
+        "values": {
+            "db-pass": field("db_password"),
+            "master-key": field("master_key"),
+            "admin-api-key": field("admin_api_key"),
+            "jwt-secret": field("jwt_secret"),
+            "dummy-val": literal("dummy_val", encrypted=True),
+            "kms-encrypted-api-hash-key": literal(
+                "0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef", encrypted=True),
+            "locker-public-key": field("locker_public_key"),
+            "tenant-private-key": field("tenant_private_key"),
+            "paze-private-key": literal("PAZE_PRIVATE_KEY", encrypted=True),
+            "paze-private-key-passphrase": literal("PAZE_PRIVATE_KEY_PASSPHRASE", encrypted=True),
+            "google-pay-root-signing-keys": literal("GOOGLE_PAY_ROOT_SIGNING_KEYS", encrypted=True),
+        },
+    },
+    "keymanager": {
+        "output": PARAMETERS,
+        "path": "/keymanager/",
+        "values": {
+            "db_pass": field("db_pass"),
+            "ca_cert": field("ca_cert"),
+            "tls_key": field("tls_key"),
+            "tls_cert": field("tls_cert"),
+            "client_cert": field("client_cert"),
+            "access_token": field("access_token"),
+            "hash_context": field("hash_context"),
+        },
+    },
+    "locker": {
+        "output": ENV_FILE,
+        # The env file digest is an HMAC keyed with this field.
+        "digest_key": "master_key",
+        # (variable, value) pairs in the order they are written. None is a
+        # blank line.
+        "layout": [
+            ("LOCKER__SERVER__HOST", "0.0.0.0"),
+            ("LOCKER__SERVER__PORT", "8080"),
+            ("LOCKER__LOG__CONSOLE__ENABLED", "true"),
+            ("LOCKER__LOG__CONSOLE__LEVEL", "DEBUG"),
+            ("LOCKER__LOG__CONSOLE__LOG_FORMAT", "default"),
+            None,
+            ("LOCKER__DATABASE__USERNAME", field("db_username", encrypted=False)),
+            ("LOCKER__DATABASE__PASSWORD", field("db_password")),
+            ("LOCKER__DATABASE__HOST", field("db_host", encrypted=False)),
+            ("LOCKER__DATABASE__PORT", "5432"),
+            ("LOCKER__DATABASE__DBNAME", "locker"),
+            None,
+            ("LOCKER__LIMIT__REQUEST_COUNT", "100"),
+            ("LOCKER__LIMIT__DURATION", "60"),
+            None,
+            ("LOCKER__SECRETS__TENANT", "hyperswitch"),
+            ("LOCKER__SECRETS__MASTER_KEY", field("master_key")),
+            ("LOCKER__SECRETS__LOCKER_PRIVATE_KEY", field("private_key")),
+            ("LOCKER__SECRETS__TENANT_PUBLIC_KEY", field("public_key")),
+            None,
+            ("LOCKER__KMS__KEY_ID", field("kms_id", encrypted=False)),
+            ("LOCKER__KMS__REGION", field("region", encrypted=False)),
+        ],
+    },
+}
@@ -0,0 +1,166 @@
+"""
+Stage the database schema artifacts into the schema bucket.
+
+Each artifact in the ARTIFACTS environment variable (a JSON list of
+`{"url", "key", "sha256"?}`) is fetched over one pooled connection and written
+to SCHEMA_BUCKET, all artifacts concurrently. The S3 object metadata records
+the SHA-256 of the bytes and the ETag/Content-Length of the source. An
+artifact is skipped when that metadata shows the bucket already holds the same
+bytes: the pinned `sha256` when one is given, otherwise the source's
+ETag/Content-Length from a HEAD request.
+
+Content is spooled and hashed before anything is written. A pinned checksum
+that does not match fails the artifact. S3 verifies the upload against the
+computed checksum, so the DB init trigger never reads a partial or corrupt
+schema.
+"""
+import base64
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import urllib3
+
+import custom_resource as cr
+
+s3 = cr.client('s3')
+
+MAX_WORKERS = 4
+CHUNK_BYTES = 1024 * 1024
+SPOOL_BYTES = 8 * 1024 * 1024
+# Artifacts above this size are uploaded in parts.
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+
+http = urllib3.PoolManager(maxsize=MAX_WORKERS, timeout=urllib3.Timeout(connect=10.0, read=60.0))
+
+
+def transfer_config():
+    # Imported here, so that s3transfer is only loaded when an artifact is uploaded.
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=16 * 1024 * 1024)
+
+
+def stored_metadata(bucket, key):
+    try:
+        return s3.head_object(Bucket=bucket, Key=key)['Metadata']
+    except s3.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def source_version(url):
+    response = http.request('HEAD', url)
+    if response.status != 200:
+        raise RuntimeError("HEAD {} returned {}".format(url, response.status))
+    return {
+        'source-etag': response.headers.get('ETag', ''),
+        'source-length': response.headers.get('Content-Length', ''),
+    }
+
+
+def is_current(artifact, metadata):
+    """
+    Whether the object described by `metadata` already holds the artifact.
+    """
+    if metadata is None:
+        return False
+    if artifact.get('sha256'):
+        return metadata.get('sha256') == artifact['sha256']
+
+    version = source_version(artifact['url'])
+    return bool(version['source-etag']) and all(
+        metadata.get(name) == value for name, value in version.items())
+
+
+def fetch(url, spool):
+    """
+    Stream `url` into `spool`, returning its SHA-256 digest and the source
+    ETag/Content-Length.
+    """
+    response = http.request('GET', url, preload_content=False)
+    try:
+        if response.status != 200:
+            raise RuntimeError("GET {} returned {}".format(url, response.status))
+        digest = hashlib.sha256()
+        for chunk in response.stream(CHUNK_BYTES):
+            digest.update(chunk)
+            spool.write(chunk)
+        version = {
+            'source-etag': response.headers.get('ETag', ''),
+            'source-length': response.headers.get('Content-Length', ''),
+        }
+    finally:
+        response.release_conn()
+    spool.seek(0)
+    return digest, version
+
+
+def upload(bucket, key, spool, size, digest, metadata):
+    if size <= MULTIPART_THRESHOLD:
+        s3.put_object(
+            Bucket=bucket, Key=key, Body=spool, Metadata=metadata,
+            ChecksumSHA256=base64.b64encode(digest.digest()).decode('utf-8'))
+    else:
+        s3.upload_fileobj(
+            spool, bucket, key, Config=transfer_config(),
+            ExtraArgs={'Metadata': metadata, 'ChecksumAlgorithm': 'SHA256'})
+
+
+def stage(bucket, artifact):
+    key = artifact['key']
+    if is_current(artifact, stored_metadata(bucket, key)):
+        return "unchanged"
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, dir='/tmp') as spool:
+        digest, version = fetch(artifact['url'], spool)
+        sha256 = digest.hexdigest()
+        if artifact.get('sha256') and artifact['sha256'] != sha256:
+            raise RuntimeError("checksum mismatch: expected {}, got {}".format(artifact['sha256'], sha256))
+
+        spool.seek(0, os.SEEK_END)
+        size = spool.tell()
+        spool.seek(0)
+        upload(bucket, key, spool, size, digest, dict(version, sha256=sha256))
+
+    return "uploaded {}".format(sha256)
+
+
+def worker():
+    bucket = os.environ['SCHEMA_BUCKET']
+    artifacts = json.loads(os.environ['ARTIFACTS'])
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = [(artifact['key'], pool.submit(stage, bucket, artifact)) for artifact in artifacts]
+
+    data = {}
+    failed = []
+    for key, future in futures:
+        error = future.exception()
+        if error is None:
+            data[key] = future.result()
+        else:
+            data[key] = "failed: {}".format(error)
+            failed.append(key)
+        print("{}: {}".format(key, data[key]))
+
+    if failed:
+        raise cr.ResourceFailed("Failed to stage {}".format(", ".join(failed)), data)
+
+    data["message"] = "Files uploaded successfully"
+    return data
+
+
+def create(event, context):
+    return worker()
+
+
+def lambda_handler(event, context):
+    # The function is also invoked directly by a trigger, without a
+    # CloudFormation ResponseURL to report to.
+    if 'ResponseURL' not in event:
+        with cr.invocation(context, "Trigger"):
+            return worker()
+    return cr.handle(event, context, on_create=create, on_update=create)
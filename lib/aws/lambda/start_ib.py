@@ -1,78 +1,98 @@
-
 import os
 import json
-import boto3
-import urllib3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
-http = urllib3.PoolManager()
+import custom_resource as cr
 
+imagebuilder = cr.client("imagebuilder")
+ssm = cr.client("ssm")
+ec2 = cr.client("ec2")
+
+# Suffixes of the SSM parameters kept next to the AMI parameter written by
+# record_ami.py: the build key of the recorded AMI, and the build key of the
+# execution started last (promoted by record_ami.py once its AMI is recorded).
+HASH_SUFFIX = "_hash"
+PENDING_HASH_SUFFIX = "_pending_hash"
 
-def worker():
-    imagebuilder = boto3.client("imagebuilder")
 
-    envoy_arn = os.environ['envoy_image_pipeline_arn']
-    squid_arn = os.environ['squid_image_pipeline_arn']
-    base_arn = os.environ['base_image_pipeline_arn']
+def build_key(pipeline):
+    """
+    Content address of a pipeline build: the synth-time digest of its
+    component document and recipe, combined with the parent image resolved at
+    deploy time.
+    """
+    source = "{}:{}".format(pipeline["hash"], os.environ["PARENT_IMAGE"])
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
 
-    imagebuilder.start_image_pipeline_execution(
-        imagePipelineArn=envoy_arn)
 
-    imagebuilder.start_image_pipeline_execution(
-        imagePipelineArn=squid_arn)
+def read_parameter(name):
+    try:
+        return ssm.get_parameter(Name=name)["Parameter"]["Value"]
+    except ssm.exceptions.ParameterNotFound:
+        return None
+
+
+def cached_ami(pipeline, key):
+    """
+    The AMI already built for `key`, if it is still available.
+    """
+    if read_parameter(pipeline["ssm_key"] + HASH_SUFFIX) != key:
+        return None
+    ami = read_parameter(pipeline["ssm_key"])
+    if ami is None:
+        return None
+    try:
+        images = ec2.describe_images(ImageIds=[ami])["Images"]
+    except Exception as e:
+        print("Cached AMI {} is not usable: {}".format(ami, e))
+        return None
+    if images and images[0]["State"] == "available":
+        return ami
+    return None
+
 
-    imagebuilder.start_image_pipeline_execution(
-        imagePipelineArn=base_arn)
+def start(pipeline):
+    key = build_key(pipeline)
+    ami = cached_ami(pipeline, key)
+    if ami:
+        return "cached {}".format(ami)
 
+    ssm.put_parameter(Name=pipeline["ssm_key"] + PENDING_HASH_SUFFIX,
+                      Value=key, Type="String", Overwrite=True)
+    execution = imagebuilder.start_image_pipeline_execution(
+        imagePipelineArn=pipeline["arn"])
+    return "started {}".format(execution["imageBuildVersionArn"])
 
-def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
-    responseUrl = event['ResponseURL']
 
-    responseBody = {
-        'Status': responseStatus,
-        'Reason': reason or "See the details in CloudWatch Log Stream: {}".format(context.log_stream_name),
-        'PhysicalResourceId': physicalResourceId or context.log_stream_name,
-        'StackId': event['StackId'],
-        'RequestId': event['RequestId'],
-        'LogicalResourceId': event['LogicalResourceId'],
-        'NoEcho': noEcho,
-        'Data': responseData
-    }
+def worker():
+    pipelines = json.loads(os.environ["PIPELINES"])
 
-    json_responseBody = json.dumps(responseBody)
+    with ThreadPoolExecutor(max_workers=len(pipelines)) as pool:
+        futures = [(pipeline["name"], pool.submit(start, pipeline)) for pipeline in pipelines]
 
-    print("Response body:")
-    print(json_responseBody)
+    data = {}
+    failed = []
+    for name, future in futures:
+        error = future.exception()
+        if error is None:
+            data[name] = future.result()
+        else:
+            data[name] = "failed: {}".format(error)
+            failed.append(name)
+        print("{}: {}".format(name, data[name]))
 
-    headers = {
-        'content-type': '',
-        'content-length': str(len(json_responseBody))
-    }
+    if failed:
+        raise cr.ResourceFailed(
+            "Failed to start pipelines: {}".format(", ".join(failed)), data)
 
-    try:
-        response = http.request(
-            'PUT', responseUrl, headers=headers, body=json_responseBody)
-        print("Status code:", response.status)
-        return responseBody
+    data["message"] = "Completed Successfully"
+    return data
 
-    except Exception as e:
 
-        print("send(..) failed executing http.request(..):", e)
-        return {}
+def create(event, context):
+    return worker()
 
 
 def lambda_handler(event, context):
-    if event['RequestType'] == 'Create':
-        try:
-            worker()
-            message = "Completed Successfully"
-            status = "SUCCESS"
-            send(event, context, status,
-                 {
-                     "message": message
-                 })
-        except Exception as e:
-            send(event, context, "FAILED", {"message": str(e)})
-    else:
-        send(event, context, "SUCCESS", {"message": "No action required"})
-
-    send(event, context, "SUCCESS", {"message": "No action required"})
+    return cr.handle(event, context, on_create=create, on_update=create)
@@ -1,60 +1,103 @@
-import boto3
-import urllib3
-import json
+"""
+Publish the Envoy config to the proxy config bucket.
+
+The config is read from the ENVOY_CONFIG environment variable, or else from
+the ENVOY_CONFIG_FILE packaged with the function (envoy.yaml by default). The
+`Substitutions` property maps template placeholders, such as
+{{internal_loadbalancer_dns}}, to their values.
+
+The rendered config is stored gzip-compressed under its SHA-256,
+`<CONFIG_PREFIX>/<sha256>.yaml.gz`, and the small POINTER_KEY object names
+the current one: its body is the key of the config and its `sha256` metadata
+the digest. The config object is written before the pointer, so instances
+never see a pointer to a missing config. Nothing is written when the pointer
+already holds the digest. Instances compare the pointer's metadata with the
+digest of their own config (fetch-envoy-config in envoy_userdata.sh) and only
+download the config when it changed.
+"""
+import gzip
+import hashlib
+import logging
 import os
 
-SUCCESS = "SUCCESS"
-FAILED = "FAILED"
+import custom_resource as cr
 
-http = urllib3.PoolManager()
+logger = logging.getLogger()
 
-data = {{envoy_config}}
-def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
-    responseUrl = event['ResponseURL']
+s3 = cr.client('s3')
 
-    responseBody = {
-        'Status' : responseStatus,
-        'Reason' : reason or "See the details in CloudWatch Log Stream: {}".format(context.log_stream_name),
-        'PhysicalResourceId' : physicalResourceId or context.log_stream_name,
-        'StackId' : event['StackId'],
-        'RequestId' : event['RequestId'],
-        'LogicalResourceId' : event['LogicalResourceId'],
-        'NoEcho' : noEcho,
-        'Data' : responseData
-    }
+DIGEST_METADATA = 'sha256'
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'envoy.yaml')
 
-    json_responseBody = json.dumps(responseBody)
 
-    print("Response body:")
-    print(json_responseBody)
+def read_config():
+    config = os.environ.get('ENVOY_CONFIG')
+    if config:
+        return config
+    with open(os.environ.get('ENVOY_CONFIG_FILE', DEFAULT_CONFIG_FILE), encoding='utf-8') as f:
+        return f.read()
 
-    headers = {
-        'content-type' : '',
-        'content-length' : str(len(json_responseBody))
-    }
 
+def render(template, substitutions):
+    for placeholder, value in sorted(substitutions.items()):
+        template = template.replace(placeholder, value)
+    return template
+
+
+def compress(data):
+    # A fixed mtime keeps the object identical for identical configs.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def stored_digest(bucket, key):
     try:
-        response = http.request('PUT', responseUrl, headers=headers, body=json_responseBody)
-        print("Status code:", response.status)
+        return s3.head_object(Bucket=bucket, Key=key)['Metadata'].get(DIGEST_METADATA)
+    except s3.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
 
-    except Exception as e:
+def publish(bucket, config, prefix, pointer_key):
+    """
+    Store `config` under its digest and point POINTER_KEY at it, unless the
+    pointer already does. Returns the digest, the config key, the compressed
+    size and whether anything was written.
+    """
+    data = config.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    key = '{}/{}.yaml.gz'.format(prefix.rstrip('/'), digest)
+    body = compress(data)
 
-        print("send(..) failed executing http.request(..):", e)
+    if stored_digest(bucket, pointer_key) == digest:
+        logger.info("s3://%s/%s already points to %s", bucket, pointer_key, key)
+        return digest, key, len(body), False
+
+    if stored_digest(bucket, key) != digest:
+        s3.put_object(
+            Bucket=bucket, Key=key, Body=body, ContentType='application/gzip',
+            Metadata={DIGEST_METADATA: digest})
+    s3.put_object(
+        Bucket=bucket, Key=pointer_key, Body=key.encode('utf-8'), ContentType='text/plain',
+        Metadata={DIGEST_METADATA: digest})
+    logger.info("Published s3://%s/%s (%d bytes, %d compressed)", bucket, key, len(data), len(body))
+    return digest, key, len(body), True
+
+
+def create(event, context):
+    properties = event.get('ResourceProperties', {})
+    config = render(read_config(), properties.get('Substitutions', {}))
+    digest, key, size, written = publish(
+        os.environ['BUCKET'], config,
+        os.environ.get('CONFIG_PREFIX', 'envoy/config'), os.environ.get('POINTER_KEY', 'envoy/current'))
+    return {
+        "message": "Envoy config published",
+        "digest": digest,
+        "key": key,
+        "bytes": str(size),
+        "written": str(written).lower(),
+    }
 
-def upload_file(url, bucket, key):
-    s3=boto3.client('s3')
-    s3.Bucket(bucket).put_object(Key=key, Body=data.encode('utf-8'))
 
 def lambda_handler(event, context):
-    try:
-        # Call the upload_file_from_url function to upload two files to S3
-        if event['RequestType'] == 'Create':
-          upload_file(os.environ['BUCKET'], os.environ['KEY'])
-          send(event, context, SUCCESS, { "message" : "Files uploaded successfully"})
-        else:
-          send(event, context, SUCCESS, { "message" : "No action required"})
-    except Exception as e:
-        send(event, context, FAILED, {"message": str(e)})
-        return str(e)
-    # Return a success message
-    return '{ "status": 200, "message": "success" }'
\ No newline at end of file
+    return cr.handle(event, context, on_create=create, on_update=create)
@@ -0,0 +1,25 @@
+import * as os from "os";
+import * as path from "path";
+import { copyFileSync, mkdtempSync } from "fs";
+import { Code } from "aws-cdk-lib/aws-lambda";
+
+// Shared CloudFormation custom resource runtime imported by every Python handler.
+const CUSTOM_RESOURCE_RUNTIME = [
+  "lib/aws/lambda/custom_resource.py",
+  "lib/aws/lambda/call_metrics.py",
+];
+
+// Package a Python custom resource handler as `index.py` next to the shared
+// runtime (and any extra modules it imports), so `index.lambda_handler` keeps
+// working as the function handler.
+export function customResourceCode(handlerPath: string, modules: string[] = []): Code {
+  const staging = mkdtempSync(path.join(os.tmpdir(), "hs-lambda-"));
+
+  copyFileSync(handlerPath, path.join(staging, "index.py"));
+  for (const module of [...CUSTOM_RESOURCE_RUNTIME, ...modules]) {
+    copyFileSync(module, path.join(staging, path.basename(module)));
+  }
+
+  return Code.fromAsset(staging);
+}
+
@@ -30,6 +30,7 @@ import { PolicyStatement, Role, ServicePrincipal } from "aws-cdk-lib/aws-iam";
 import { Function, Code, Runtime } from "aws-cdk-lib/aws-lambda";
 import { BucketDeployment, Source } from "aws-cdk-lib/aws-s3-deployment";
 import * as triggers from "aws-cdk-lib/triggers";
+import { customResourceCode } from "./lambda_code";
 
 export class DataBaseConstruct {
   sg: SecurityGroup;
@@ -97,71 +98,14 @@ export class DataBaseConstruct {
 
       this.bucket = schemaBucket;
 
-      const uploadSchemaAndMigrationCode = `import boto3
-import urllib3
-import json
-
-SUCCESS = "SUCCESS"
-FAILED = "FAILED"
-
-http = urllib3.PoolManager()
-
-
-def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, reason=None):
-    responseUrl = event['ResponseURL']
-
-    responseBody = {
-        'Status' : responseStatus,
-        'Reason' : reason or "See the details in CloudWatch Log Stream: {}".format(context.log_stream_name),
-        'PhysicalResourceId' : physicalResourceId or context.log_stream_name,
-        'StackId' : event['StackId'],
-        'RequestId' : event['RequestId'],
-        'LogicalResourceId' : event['LogicalResourceId'],
-        'NoEcho' : noEcho,
-        'Data' : responseData
-    }
-
-    json_responseBody = json.dumps(responseBody)
-
-    print("Response body:")
-    print(json_responseBody)
-
-    headers = {
-        'content-type' : '',
-        'content-length' : str(len(json_responseBody))
-    }
-
-    try:
-        response = http.request('PUT', responseUrl, headers=headers, body=json_responseBody)
-        print("Status code:", response.status)
-
-    except Exception as e:
-
-        print("send(..) failed executing http.request(..):", e)
-
-def upload_file_from_url(url, bucket, key):
-    s3=boto3.client('s3')
-    http=urllib3.PoolManager()
-    s3.upload_fileobj(http.request('GET', url,preload_content=False), bucket, key)
-    s3.upload_fileobj
-
-def lambda_handler(event, context):
-    try:
-        # Call the upload_file_from_url function to upload two files to S3
-        if event['RequestType'] == 'Create':
-          upload_file_from_url("https://raw.githubusercontent.com/juspay/hyperswitch-cdk/main/lib/aws/migrations/migration_runner.zip", "hyperswitch-schema-${process.env.CDK_DEFAULT_ACCOUNT}-${process.env.CDK_DEFAULT_REGION}", "migration_runner.zip")
-          upload_file_from_url("https://raw.githubusercontent.com/juspay/hyperswitch-cdk/main/lib/aws/migrations/v1.107.0/schema.sql", "hyperswitch-schema-${process.env.CDK_DEFAULT_ACCOUNT}-${process.env.CDK_DEFAULT_REGION}", "schema.sql")
-          upload_file_from_url("https://raw.githubusercontent.com/juspay/hyperswitch-cdk/main/lib/aws/migrations/locker-schema.sql", "hyperswitch-schema-${process.env.CDK_DEFAULT_ACCOUNT}-${process.env.CDK_DEFAULT_REGION}", "locker-schema.sql")
-          send(event, context, SUCCESS, { "message" : "Files uploaded successfully"})
-        else:
-          send(event, context, SUCCESS, { "message" : "No action required"})
-    except Exception as e:  # Use 'Exception as e' to properly catch and define the exception variable
-        # Handle exceptions and return an error message
-        send(event, context, FAILED, {"message": str(e)})
-        return str(e)
-    # Return a success message
-    return '{ "status": 200, "message": "success" }'
-      `
+      const migrationsUrl = "https://raw.githubusercontent.com/juspay/hyperswitch-cdk/main/lib/aws/migrations";
+      // Staged by lib/aws/lambda/stage_schema.py. An optional `sha256` pins
+      // the content of an artifact.
+      const schemaArtifacts = [
+        { url: `${migrationsUrl}/migration_runner.zip`, key: "migration_runner.zip" },
+        { url: `${migrationsUrl}/v1.107.0/schema.sql`, key: "schema.sql" },
+        { url: `${migrationsUrl}/locker-schema.sql`, key: "locker-schema.sql" },
+      ];
 
       const lambdaRole = new Role(scope, "SchemaUploadLambdaRole", {
         assumedBy: new ServicePrincipal("lambda.amazonaws.com"),
@@ -180,9 +124,11 @@ def lambda_handler(event, context):
             "logs:CreateLogStream",
             "logs:PutLogEvents",
             "s3:GetObject",
-            "s3:PutObject"
+            "s3:PutObject",
+            "s3:AbortMultipartUpload",
+            "s3:ListBucket"
           ],
-          resources: ["*", schemaBucket.bucketArn + "/*"],
+          resources: ["*", schemaBucket.bucketArn, schemaBucket.bucketArn + "/*"],
         })
       );
 
@@ -203,14 +149,21 @@ def lambda_handler(event, context):
       const initializeUploadFunction = new Function(scope, "initializeUploadFunction", {
         runtime: Runtime.PYTHON_3_9,
         handler: "index.lambda_handler",
-        code: Code.fromInline(uploadSchemaAndMigrationCode),
+        code: customResourceCode("lib/aws/lambda/stage_schema.py"),
         timeout: Duration.minutes(15),
         role: lambdaRole,
+        environment: {
+          SCHEMA_BUCKET: schemaBucket.bucketName,
+          ARTIFACTS: JSON.stringify(schemaArtifacts),
+        },
       });
 
 
       const initializeDbTriggerCustomResource = new cdk.CustomResource(scope, 'InitializeDbTriggerCustomResource', {
         serviceToken: initializeUploadFunction.functionArn,
+        properties: {
+          Artifacts: JSON.stringify(schemaArtifacts),
+        },
       });
 
       const initializeDBFunction = new Function(scope, "InitializeDBFunction", {
@@ -0,0 +1,262 @@
+"""
+Benchmark the hot router and locker queries against a database.
+
+    python3 lib/aws/schema/bench.py --duration 60 --concurrency 16 [--dsn ...]
+    python3 lib/aws/schema/bench.py --query intent_by_id --query payment_list --explain
+    python3 lib/aws/schema/bench.py --locker-dsn ... --json r6g.large.json
+
+The queries are the ones the router runs on every payment (fetching the
+intent and its active attempt, webhook lookups by connector transaction id,
+refund lookups) and on the dashboard (payment lists and status counts), plus
+the locker card lookups when --locker-dsn is given. Their parameters are
+drawn from keys sampled out of the tables with TABLESAMPLE, so any data works,
+seed.py's or a copy of production.
+
+Each of --concurrency threads holds its own connection and runs a weighted
+mix of the queries, close to the router's, for --duration seconds. The report
+gives the throughput and the latency percentiles per query; --json keeps them
+for comparing instance classes and index choices. --explain prints the plan
+of every query once, with buffers, before the run. Write queries only run
+with --writes, since they modify the sampled rows.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import migrate
+
+DEFAULT_DURATION = 30
+DEFAULT_CONCURRENCY = 8
+SAMPLE_SIZE = 20000
+
+
+@dataclass
+class Query:
+    name: str
+    database: str
+    weight: int
+    sql: str
+    keys: str
+    write: bool = False
+
+
+# Key sets sampled before the run; every query draws its parameters from one.
+KEY_SAMPLES = {
+    "intent": ("router", "SELECT payment_id, merchant_id, active_attempt_id FROM payment_intent"),
+    "attempt": ("router", "SELECT connector_transaction_id, merchant_id FROM payment_attempt "
+                          "WHERE connector_transaction_id IS NOT NULL"),
+    "refund": ("router", "SELECT refund_id, merchant_id, payment_id FROM refund"),
+    "merchant": ("router", "SELECT merchant_id FROM payment_intent"),
+    "card": ("locker", "SELECT tenant_id, merchant_id, customer_id, locker_id, hash_id FROM locker"),
+}
+
+QUERIES = [
+    Query("intent_by_id", "router", 20,
+          "SELECT * FROM payment_intent WHERE payment_id = %(0)s AND merchant_id = %(1)s", "intent"),
+    Query("active_attempt", "router", 20,
+          "SELECT * FROM payment_attempt WHERE payment_id = %(0)s AND merchant_id = %(1)s AND attempt_id = %(2)s",
+          "intent"),
+    Query("attempts_of_payment", "router", 5,
+          "SELECT * FROM payment_attempt WHERE payment_id = %(0)s AND merchant_id = %(1)s ORDER BY modified_at DESC",
+          "intent"),
+    Query("attempt_by_connector_txn", "router", 10,
+          "SELECT * FROM payment_attempt WHERE connector_transaction_id = %(0)s AND merchant_id = %(1)s", "attempt"),
+    Query("refunds_of_payment", "router", 5,
+          "SELECT * FROM refund WHERE payment_id = %(2)s AND merchant_id = %(1)s", "refund"),
+    Query("refund_by_id", "router", 5,
+          "SELECT * FROM refund WHERE refund_id = %(0)s AND merchant_id = %(1)s", "refund"),
+    Query("payment_list", "router", 3,
+          "SELECT * FROM payment_intent WHERE merchant_id = %(0)s ORDER BY created_at DESC LIMIT 20", "merchant"),
+    Query("payment_list_filtered", "router", 2,
+          "SELECT * FROM payment_intent WHERE merchant_id = %(0)s AND status = 'succeeded' "
+          "AND created_at >= (SELECT max(created_at) FROM payment_intent) - INTERVAL '7 days' "
+          "ORDER BY created_at DESC LIMIT 20 OFFSET 20", "merchant"),
+    Query("status_counts", "router", 1,
+          "SELECT status, count(*) FROM payment_intent WHERE merchant_id = %(0)s "
+          "AND created_at >= (SELECT max(created_at) FROM payment_intent) - INTERVAL '1 day' GROUP BY status",
+          "merchant"),
+    Query("update_intent", "router", 10,
+          "UPDATE payment_intent SET modified_at = now(), last_synced = now() "
+          "WHERE payment_id = %(0)s AND merchant_id = %(1)s", "intent", write=True),
+    Query("update_attempt", "router", 10,
+          "UPDATE payment_attempt SET modified_at = now() "
+          "WHERE attempt_id = %(2)s AND merchant_id = %(1)s", "intent", write=True),
+    Query("card_by_id", "locker", 10,
+          "SELECT * FROM locker WHERE tenant_id = %(0)s AND merchant_id = %(1)s AND customer_id = %(2)s "
+          "AND locker_id = %(3)s", "card"),
+    Query("cards_of_customer", "locker", 5,
+          "SELECT * FROM locker WHERE tenant_id = %(0)s AND merchant_id = %(1)s AND customer_id = %(2)s", "card"),
+    Query("card_by_hash", "locker", 5,
+          "SELECT * FROM hash_table WHERE hash_id = %(4)s", "card"),
+]
+
+
+@dataclass
+class Stats:
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+    errors: Dict[str, int] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def merge(self, latencies, errors):
+        with self.lock:
+            for name, values in latencies.items():
+                self.latencies.setdefault(name, []).extend(values)
+            for name, count in errors.items():
+                self.errors[name] = self.errors.get(name, 0) + count
+
+
+def params(row):
+    return {str(i): value for i, value in enumerate(row)}
+
+
+def sample(cursor, sql, size):
+    """
+    Up to `size` distinct key rows, from a block sample of the table when
+    it is large enough for one.
+    """
+    table = sql.split(" FROM ")[1].split()[0]
+    cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", (table,))
+    row = cursor.fetchone()
+    estimate = row[0] if row and row[0] > 0 else 0
+    if estimate > size * 10:
+        percent = min(100.0, 100.0 * size * 3 / estimate)
+        sql = sql.replace(" FROM {}".format(table), " FROM {} TABLESAMPLE SYSTEM ({})".format(table, percent), 1)
+    cursor.execute("SELECT DISTINCT * FROM ({}) keys LIMIT %s".format(sql), (size,))
+    return cursor.fetchall()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Worker(threading.Thread):
+    def __init__(self, connections, queries, keys, deadline, stats, seed):
+        super().__init__(daemon=True)
+        self.connections = connections
+        self.queries = queries
+        self.keys = keys
+        self.deadline = deadline
+        self.stats = stats
+        self.rng = random.Random(seed)
+
+    def run(self):
+        cursors = {name: conn.cursor() for name, conn in self.connections.items()}
+        weights = [query.weight for query in self.queries]
+        latencies = {query.name: [] for query in self.queries}
+        errors = {}
+        while time.monotonic() < self.deadline:
+            query = self.rng.choices(self.queries, weights)[0]
+            values = params(self.rng.choice(self.keys[query.keys]))
+            cursor = cursors[query.database]
+            started = time.perf_counter()
+            try:
+                cursor.execute(query.sql, values)
+                if cursor.description is not None:
+                    cursor.fetchall()
+            except Exception as e:
+                errors[query.name] = errors.get(query.name, 0) + 1
+                print("{}: {}".format(query.name, str(e).strip().splitlines()[0]), file=sys.stderr)
+                continue
+            latencies[query.name].append(time.perf_counter() - started)
+        self.stats.merge(latencies, errors)
+
+
+def explain(connections, queries, keys):
+    for query in queries:
+        cursor = connections[query.database].cursor()
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query.sql, params(keys[query.keys][0]))
+        print("-- {}".format(query.name))
+        for (line,) in cursor.fetchall():
+            print(line)
+        connections[query.database].rollback()
+        print()
+
+
+def report(queries, stats, elapsed):
+    results = {}
+    print("{:<26} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>7}".format(
+        "query", "count", "qps", "p50 ms", "p95 ms", "p99 ms", "max ms", "errors"))
+    for query in queries:
+        values = sorted(stats.latencies.get(query.name, []))
+        result = {
+            "count": len(values), "qps": len(values) / elapsed, "errors": stats.errors.get(query.name, 0),
+            "p50_ms": percentile(values, 0.50) * 1000, "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000, "max_ms": (values[-1] if values else 0.0) * 1000,
+        }
+        results[query.name] = result
+        print("{:<26} {count:>9} {qps:>9.1f} {p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} {max_ms:>9.2f} {errors:>7}".format(
+            query.name, **result))
+    total = sum(result["count"] for result in results.values())
+    print("{} queries in {:.1f}s: {:.1f} qps".format(total, elapsed, total / elapsed))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", help="router database (default: DATABASE_URL)")
+    parser.add_argument("--locker-dsn", help="locker database; its queries are skipped without one")
+    parser.add_argument("--query", action="append", help="run only this query (repeatable)")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--writes", action="store_true", help="include the UPDATE queries")
+    parser.add_argument("--explain", action="store_true", help="print the plan of each query first")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    dsns = {"router": args.dsn}
+    if args.locker_dsn:
+        dsns["locker"] = args.locker_dsn
+    queries = [
+        query for query in QUERIES
+        if query.database in dsns and (args.writes or not query.write) and (not args.query or query.name in args.query)
+    ]
+    if not queries:
+        parser.error("no query selected")
+
+    conn = {name: migrate.connect(dsn) for name, dsn in dsns.items()}
+    keys = {}
+    for name in {query.keys for query in queries}:
+        database, sql = KEY_SAMPLES[name]
+        keys[name] = sample(conn[database].cursor(), sql, SAMPLE_SIZE)
+        conn[database].rollback()
+        if not keys[name]:
+            sys.exit("No rows to sample for the {} queries: load data first (seed.py)".format(name))
+    if args.explain:
+        explain(conn, queries, keys)
+    for connection in conn.values():
+        connection.close()
+
+    stats = Stats()
+    deadline = time.monotonic() + args.duration
+    workers = []
+    for i in range(args.concurrency):
+        connections = {name: migrate.connect(dsn) for name, dsn in dsns.items()}
+        for connection in connections.values():
+            connection.autocommit = True
+        workers.append(Worker(connections, queries, keys, deadline, stats, args.seed + i))
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+    for worker in workers:
+        for connection in worker.connections.values():
+            connection.close()
+
+    results = report(queries, stats, elapsed)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"concurrency": args.concurrency, "duration": elapsed, "queries": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
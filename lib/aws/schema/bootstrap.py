@@ -0,0 +1,346 @@
+"""
+Bootstrap a database from schema scripts with independent statements run in
+parallel.
+
+    python3 lib/aws/schema/bootstrap.py --to v1.116.0 [--workers 4] [--dsn ...]
+    python3 lib/aws/schema/bootstrap.py --script lib/aws/migrations/locker-schema.sql
+    python3 lib/aws/schema/bootstrap.py --to v1.116.0 --dry-run
+
+Each statement reads and writes named objects (types, tables, indexes,
+functions). A statement waits for the last earlier writer of every object it
+touches, and a writer also waits for the readers since then. The original
+order is kept wherever two statements share an object, while index builds
+and unrelated tables proceed concurrently on a small pool of connections.
+Data statements write everything they mention and wait for every earlier enum
+change. A statement that mentions no known object is a barrier.
+
+Every statement runs in autocommit, so a failed bootstrap leaves a partial
+schema behind: run it against an empty database. After a successful
+`--to` bootstrap the version is recorded in the migration ledger, so
+migrate.py can upgrade from it. The timing report lists the slowest
+statements, the time per statement kind and the critical path.
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Set
+
+import migrate
+import model
+import planner
+import sql as sqllex
+
+DEFAULT_WORKERS = 4
+# Pseudo-object written by every enum change and read by data statements,
+# which may use the values added.
+ENUM_VALUES = "enum:*"
+
+
+@dataclass
+class Node:
+    index: int
+    statement: sqllex.Statement
+    kind: str
+    reads: Set[str] = field(default_factory=set)
+    writes: Set[str] = field(default_factory=set)
+    barrier: bool = False
+    deps: Set[int] = field(default_factory=set)
+    dependents: List[int] = field(default_factory=list)
+    elapsed: Optional[float] = None
+
+    @property
+    def summary(self):
+        return " ".join(self.statement.sql.split())[:90]
+
+
+def declared_objects(statements):
+    """
+    Every type, table, index and function the statements create, by name.
+    """
+    objects = {}
+    for statement in statements:
+        cursor = model.Cursor(statement.sql)
+        try:
+            if cursor.accept("CREATE", "TYPE"):
+                objects[cursor.name()] = "type"
+            elif cursor.accept("CREATE", "TABLE") or cursor.accept("CREATE", "UNLOGGED", "TABLE"):
+                cursor.accept("IF", "NOT", "EXISTS")
+                objects[cursor.name()] = "table"
+            elif cursor.accept("CREATE", "OR", "REPLACE", "FUNCTION") or cursor.accept("CREATE", "FUNCTION"):
+                objects[cursor.name()] = "function"
+            elif cursor.peek() == "CREATE" and "INDEX" in (cursor.peek(1), cursor.peek(2)):
+                cursor.accept("CREATE")
+                cursor.accept("UNIQUE")
+                cursor.expect("INDEX")
+                cursor.accept("CONCURRENTLY")
+                cursor.accept("IF", "NOT", "EXISTS")
+                objects.setdefault(cursor.name(), "index")
+        except model.ParseError:
+            continue
+    return objects
+
+
+def mentions(text, objects):
+    """
+    The known objects named in a statement, also inside string literals (as
+    in SELECT diesel_manage_updated_at('table')).
+    """
+    found = set()
+    for token in sqllex.tokenize(text):
+        if token.text.startswith("'"):
+            names = re.findall(r"[A-Za-z_][A-Za-z0-9_]*", token.text)
+        elif token.text.startswith("$"):
+            found |= mentions(token.text.strip("$").split("$", 1)[-1], objects)
+            continue
+        else:
+            names = [model.unquote(token.text)]
+        for name in names:
+            if name in objects:
+                found.add("{}:{}".format(objects[name], name))
+    return found
+
+
+def classify(statement, objects, index_tables):
+    """
+    The kind of a statement and the objects it reads and writes.
+    """
+    words = statement.keywords
+    touched = mentions(statement.sql, objects)
+    cursor = model.Cursor(statement.sql)
+    try:
+        if cursor.accept("CREATE", "TYPE") or cursor.accept("ALTER", "TYPE") or cursor.accept("DROP", "TYPE"):
+            cursor.accept("IF", "EXISTS")
+            name = "type:{}".format(cursor.name())
+            return "type", touched - {name}, {name, ENUM_VALUES}
+        if cursor.accept("CREATE", "TABLE") or cursor.accept("ALTER", "TABLE"):
+            cursor.accept("IF", "NOT", "EXISTS") or cursor.accept("IF", "EXISTS")
+            cursor.accept("ONLY")
+            name = "table:{}".format(cursor.name())
+            return "table" if words[0] == "CREATE" else "alter table", touched - {name}, {name}
+        if cursor.peek() == "CREATE" and "INDEX" in (cursor.peek(1), cursor.peek(2)):
+            names = declared_objects([statement])
+            name = "index:{}".format(next(iter(names)))
+            return "index", touched - {name}, {name}
+        if cursor.accept("DROP", "INDEX"):
+            writes = {obj for obj in touched if obj.startswith("index:")}
+            writes |= {"table:{}".format(index_tables[obj]) for obj in writes if obj in index_tables}
+            return "drop index", set(), writes
+        if cursor.accept("DROP", "TABLE"):
+            return "drop table", set(), touched
+        if cursor.accept("CREATE", "OR", "REPLACE", "FUNCTION") or cursor.accept("CREATE", "FUNCTION"):
+            # Function bodies are resolved when called, not when created.
+            return "function", set(), {"function:{}".format(cursor.name())}
+    except (model.ParseError, StopIteration):
+        pass
+    return "data", {ENUM_VALUES}, touched
+
+
+def build_graph(statements):
+    objects = declared_objects(statements)
+    index_tables = {}
+    for statement in statements:
+        match = re.match(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(\S+)\s+ON\s+(?:ONLY\s+)?(\S+)",
+                         statement.sql, re.I)
+        if match:
+            index_tables["index:{}".format(model.unquote(match.group(1)))] = model.unquote(match.group(2).split(".")[-1])
+
+    nodes = []
+    last_writer = {}
+    readers = {}
+    last_barrier = None
+    for index, statement in enumerate(statements):
+        kind, reads, writes = classify(statement, objects, index_tables)
+        node = Node(index, statement, kind, reads, writes)
+        if kind == "data" and not writes:
+            node.barrier = True
+            node.deps = set(range(index))
+        if last_barrier is not None:
+            node.deps.add(last_barrier)
+        for obj in reads:
+            if obj in last_writer:
+                node.deps.add(last_writer[obj])
+            readers.setdefault(obj, []).append(index)
+        for obj in writes:
+            if obj in last_writer:
+                node.deps.add(last_writer[obj])
+            node.deps.update(readers.pop(obj, []))
+            last_writer[obj] = index
+        node.deps.discard(index)
+        if node.barrier:
+            last_barrier = index
+        nodes.append(node)
+
+    for node in nodes:
+        for dep in node.deps:
+            nodes[dep].dependents.append(node.index)
+    return nodes
+
+
+def depth(nodes, weight=lambda node: 1):
+    """
+    The heaviest chain of dependencies, as (total weight, node indexes).
+    """
+    best = {}
+    for node in nodes:
+        previous = max(node.deps, key=lambda dep: best[dep][0], default=None)
+        base, chain = best[previous] if previous is not None else (0, [])
+        best[node.index] = (base + weight(node), chain + [node.index])
+    return max(best.values(), key=lambda value: value[0], default=(0, []))
+
+
+class Executor:
+    """
+    Runs a dependency graph on `workers` connections.
+    """
+
+    def __init__(self, nodes, connect, workers):
+        self.nodes = nodes
+        self.connect = connect
+        self.workers = workers
+        self.remaining = {node.index: len(node.deps) for node in nodes}
+        self.ready = [node.index for node in nodes if not node.deps]
+        self.done = 0
+        self.error = None
+        self.condition = threading.Condition()
+
+    def next_node(self):
+        with self.condition:
+            while not self.ready and self.error is None and self.done < len(self.nodes):
+                self.condition.wait()
+            if self.error is not None or not self.ready:
+                return None
+            # Lowest index first keeps the run close to the script order.
+            self.ready.sort()
+            return self.nodes[self.ready.pop(0)]
+
+    def finish(self, node, error=None):
+        with self.condition:
+            self.done += 1
+            if error is not None and self.error is None:
+                self.error = "line {} ({}): {}\n{}".format(node.statement.line, node.kind, error, node.statement.sql)
+            for dependent in node.dependents:
+                self.remaining[dependent] -= 1
+                if self.remaining[dependent] == 0:
+                    self.ready.append(dependent)
+            self.condition.notify_all()
+
+    def worker(self):
+        conn = self.connect()
+        conn.autocommit = True
+        cursor = conn.cursor()
+        try:
+            while True:
+                node = self.next_node()
+                if node is None:
+                    return
+                started = time.monotonic()
+                try:
+                    cursor.execute(node.statement.sql)
+                except Exception as e:
+                    self.finish(node, e)
+                    continue
+                node.elapsed = time.monotonic() - started
+                self.finish(node)
+        finally:
+            conn.close()
+
+    def run(self):
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise RuntimeError(self.error)
+
+
+def report(nodes, wall, top):
+    ran = [node for node in nodes if node.elapsed is not None]
+    busy = sum(node.elapsed for node in ran)
+    print("{} statements, {:.3f}s of statement time in {:.3f}s wall clock ({:.1f}x)".format(
+        len(ran), busy, wall, busy / wall if wall else 0.0))
+
+    per_kind = {}
+    for node in ran:
+        count, total = per_kind.get(node.kind, (0, 0.0))
+        per_kind[node.kind] = (count + 1, total + node.elapsed)
+    print("\nBy kind:")
+    for kind, (count, total) in sorted(per_kind.items(), key=lambda item: -item[1][1]):
+        print("  {:<12} {:5} statements {:9.3f}s".format(kind, count, total))
+
+    print("\nSlowest statements:")
+    for node in sorted(ran, key=lambda node: -node.elapsed)[:top]:
+        print("  {:8.3f}s  line {:<5} {}".format(node.elapsed, node.statement.line, node.summary))
+
+    length, chain = depth(nodes, lambda node: node.elapsed or 0.0)
+    print("\nCritical path: {:.3f}s over {} statements".format(length, len(chain)))
+
+
+def describe(nodes):
+    steps, chain = depth(nodes)
+    widths = {}
+    level = {}
+    for node in nodes:
+        level[node.index] = 1 + max((level[dep] for dep in node.deps), default=0)
+        widths[level[node.index]] = widths.get(level[node.index], 0) + 1
+    kinds = {}
+    for node in nodes:
+        kinds[node.kind] = kinds.get(node.kind, 0) + 1
+    print("{} statements, {} dependencies, {} barriers".format(
+        len(nodes), sum(len(node.deps) for node in nodes), sum(node.barrier for node in nodes)))
+    print("Kinds: {}".format(", ".join("{} {}".format(count, kind) for kind, count in sorted(kinds.items()))))
+    print("Longest chain: {} statements; widest level: {} statements".format(steps, max(widths.values(), default=0)))
+
+
+def load_statements(args):
+    statements = []
+    if args.to:
+        statements.extend(planner.Snapshot.load(args.to).statements)
+    for path in args.script or []:
+        with open(path, encoding="utf-8") as f:
+            statements.extend(sqllex.split_files(f.read()))
+    return statements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--to", help="snapshot version or schema.sql path; recorded in the ledger")
+    parser.add_argument("--script", action="append", help="additional SQL script (repeatable)")
+    parser.add_argument("--dsn", help="libpq connection string (default: DATABASE_URL)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BOOTSTRAP_WORKERS", DEFAULT_WORKERS)))
+    parser.add_argument("--top", type=int, default=15, help="slowest statements to list")
+    parser.add_argument("--dry-run", action="store_true", help="describe the dependency graph only")
+    args = parser.parse_args(argv)
+    if not args.to and not args.script:
+        parser.error("pass --to or --script")
+
+    nodes = build_graph(load_statements(args))
+    if args.dry_run:
+        describe(nodes)
+        return
+
+    started = time.monotonic()
+    try:
+        Executor(nodes, lambda: migrate.connect(args.dsn), max(1, args.workers)).run()
+    except RuntimeError as e:
+        sys.exit("Bootstrap failed at {}".format(e))
+    wall = time.monotonic() - started
+    report(nodes, wall, args.top)
+
+    if args.to:
+        snapshot = planner.Snapshot.load(args.to)
+        conn = migrate.connect(args.dsn)
+        conn.autocommit = True
+        cursor = conn.cursor()
+        migrate.current_version(cursor)
+        migrate.record(cursor, snapshot, None, len(nodes), int(wall * 1000))
+        conn.close()
+        print("Recorded {} in {}".format(snapshot.version, migrate.LEDGER_TABLE))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+"""
+Lock impact of a migration plan, and an online form of it.
+
+    python3 lib/aws/schema/locks.py --from v1.107.0 --to v1.116.0
+    python3 lib/aws/schema/locks.py --from v1.107.0 --to v1.116.0 --output online.sql
+    python3 lib/aws/schema/locks.py --from v1.116.0 --script delta.sql --dsn ...
+
+Every statement of the plan, or of a hand-written delta script replayed over
+the --from snapshot, is classified by the lock it takes on an existing table
+and by whether Postgres rewrites or scans the table while holding it:
+
+    high     ACCESS EXCLUSIVE held for a rewrite or a full scan: type changes,
+             SET NOT NULL, new primary key, unique and check constraints,
+             volatile defaults. Reads and writes wait.
+    medium   writes wait (index builds, foreign key validation), or one
+             transaction locks every row it changes (unbatched backfills)
+    low      ACCESS EXCLUSIVE held briefly for a catalog change. It still
+             queues behind long transactions, hence the lock_timeout.
+    none     objects created by the plan itself
+
+The online plan replaces the risky statements with their non-blocking forms on
+Postgres 14: CREATE/DROP INDEX CONCURRENTLY, constraints added NOT VALID and
+validated separately, primary and unique keys attached to an index built
+concurrently, SET NOT NULL proven by a validated CHECK first, and UPDATE and
+DELETE backfills committed in primary key batches. Type changes that rewrite
+the table have no online form and are flagged for an expand/contract
+migration. Run the online plan with psql in autocommit mode (not
+--single-transaction): every statement commits on its own, so a failed run
+resumes from the failed statement. Its last statement records the target
+version in the migration ledger.
+
+With --dsn the table sizes are read from pg_class, and the time each statement
+would hold its lock is estimated from --scan-rate and --rewrite-rate.
+"""
+import argparse
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import migrate
+import model
+import planner
+import sql as sqllex
+
+ACCESS_EXCLUSIVE = "ACCESS EXCLUSIVE"
+SHARE = "SHARE"
+SHARE_ROW_EXCLUSIVE = "SHARE ROW EXCLUSIVE"
+SHARE_UPDATE_EXCLUSIVE = "SHARE UPDATE EXCLUSIVE"
+ROW_EXCLUSIVE = "ROW EXCLUSIVE"
+
+RISKS = ["high", "medium", "low", "none"]
+
+# Defaults evaluated once per row: adding a column with one rewrites the table.
+VOLATILE = re.compile(
+    r"\b(nextval|random|gen_random_uuid|uuid_generate_v\w+|clock_timestamp|timeofday|txid_current)\s*\(", re.I)
+# varchar/text types, whose conversions among each other may be catalog-only.
+STRING_TYPE = re.compile(r"(varchar|text)(?:\((\d+)\))?(\[\])?$")
+
+DEFAULT_BATCH_ROWS = 5000
+DEFAULT_LOCK_TIMEOUT = "5s"
+# MB/s, only used for the estimates.
+DEFAULT_SCAN_RATE = 200
+DEFAULT_REWRITE_RATE = 50
+
+BATCH_TEMPLATE = """DO $batch$
+DECLARE
+{declarations}
+    more BOOLEAN;
+BEGIN
+    SELECT {key} INTO {lower} FROM {table} ORDER BY {key} LIMIT 1;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+    LOOP
+        SELECT {key} INTO {next} FROM {table}
+        WHERE ({key}) >= ({lower}) ORDER BY {key} OFFSET {rows} LIMIT 1;
+        more := FOUND;
+        IF more THEN
+            {bounded};
+        ELSE
+            {last};
+        END IF;
+        COMMIT;
+        EXIT WHEN NOT more;
+        {advance}
+    END LOOP;
+END
+$batch$"""
+
+
+@dataclass
+class Impact:
+    sql: str
+    phase: str
+    table: Optional[str] = None
+    lock: str = ""
+    risk: str = "none"
+    rewrite: bool = False
+    scan: bool = False
+    reason: str = ""
+    online: List[str] = field(default_factory=list)
+    seconds: Optional[float] = None
+
+    @property
+    def summary(self):
+        return " ".join(self.sql.split())[:90]
+
+
+def q(name):
+    return sqllex.quote_ident(name)
+
+
+def binary_coercible(old, new):
+    """
+    Whether converting normalized type `old` to `new` leaves the stored
+    values as they are, so that Postgres skips the table rewrite.
+    """
+    if old == new:
+        return True
+    a, b = STRING_TYPE.match(old), STRING_TYPE.match(new)
+    if not a or not b or bool(a.group(3)) != bool(b.group(3)):
+        return False
+    if b.group(2) is None:
+        return True
+    # A length check on array elements coerces every element.
+    if a.group(3):
+        return False
+    return a.group(1) == "varchar" and a.group(2) is not None and int(b.group(2)) >= int(a.group(2))
+
+
+def not_null_steps(table, column):
+    """
+    SET NOT NULL without the scan under ACCESS EXCLUSIVE: a CHECK validated
+    under SHARE UPDATE EXCLUSIVE proves it first.
+    """
+    check = q(model.default_constraint_name(table, [column], "not_null"))
+    table, column = q(table), q(column)
+    return [
+        "ALTER TABLE {} ADD CONSTRAINT {} CHECK ({} IS NOT NULL) NOT VALID".format(table, check, column),
+        "ALTER TABLE {} VALIDATE CONSTRAINT {}".format(table, check),
+        "ALTER TABLE {} ALTER COLUMN {} SET NOT NULL".format(table, column),
+        "ALTER TABLE {} DROP CONSTRAINT {}".format(table, check),
+    ]
+
+
+def split_actions(text):
+    """
+    An ALTER TABLE with several actions as one statement per action, so
+    that each is classified, and made online, on its own.
+    """
+    cursor = model.Cursor(text)
+    if not cursor.accept("ALTER", "TABLE"):
+        return [text]
+    start = cursor.tokens[cursor.pos].start if not cursor.at_end() else len(text)
+    cursor.accept("IF", "EXISTS")
+    cursor.accept("ONLY")
+    try:
+        cursor.name()
+    except model.ParseError:
+        return [text]
+    head = text[start:cursor.tokens[cursor.pos - 1].end]
+    actions = []
+    while not cursor.at_end():
+        actions.append(cursor.until())
+        cursor.accept(",")
+    if len(actions) <= 1:
+        return [text]
+    return ["ALTER TABLE {} {}".format(head, action) for action in actions]
+
+
+def batch_key(schema, table):
+    """
+    Columns that identify a row of `table`: its primary key, else a unique
+    constraint or plain unique index over NOT NULL columns. A plan may have
+    dropped the primary key by the time its backfills run.
+    """
+    candidates = [c.columns for c in table.constraints.values() if c.kind == "p"]
+    candidates += [c.columns for c in table.constraints.values() if c.kind == "u"]
+    candidates += [
+        model.column_names(index.definition[1:-1]) for index in schema.indexes.values()
+        if index.table == table.name and index.unique and re.fullmatch(r"\(\s*[\w\s,\"]+\)", index.definition)
+    ]
+    for columns in candidates:
+        if columns and all(c in table.columns and not table.columns[c].nullable for c in columns):
+            return list(columns)
+    return None
+
+
+class Analyzer:
+    """
+    Classifies statements against the schema they run on, replaying each
+    one after it is classified.
+    """
+
+    def __init__(self, schema, batch_rows=DEFAULT_BATCH_ROWS):
+        self.replayer = model.Replayer(schema.copy())
+        self.created = set()
+        self.batch_rows = batch_rows
+
+    @property
+    def schema(self):
+        return self.replayer.schema
+
+    def run(self, steps):
+        impacts = []
+        for index, step in enumerate(steps):
+            for text in split_actions(sqllex.strip_comments(step.sql)):
+                impact = Impact(text, step.phase)
+                try:
+                    self.classify(impact, model.Cursor(text))
+                except (model.ParseError, KeyError) as e:
+                    impact.lock, impact.risk = "?", "medium"
+                    impact.reason = "not classified ({}): review it by hand".format(e)
+                    impact.online = []
+                if not impact.online:
+                    impact.online = [text]
+                impacts.append(impact)
+                try:
+                    self.replayer.statement(index, text)
+                except (model.ParseError, KeyError, ValueError):
+                    # Data statements change no objects.
+                    pass
+        return impacts
+
+    def existing(self, impact, table):
+        """
+        Whether `table` holds rows already, i.e. the plan did not create it.
+        """
+        impact.table = table
+        if table in self.created or table not in self.schema.tables:
+            impact.lock, impact.risk = "", "none"
+            impact.reason = "table created by the plan"
+            return False
+        return True
+
+    def classify(self, impact, cursor):
+        if cursor.accept("ALTER", "TABLE"):
+            self.alter_table(impact, cursor)
+        elif cursor.peek() == "CREATE" and "INDEX" in (cursor.peek(1), cursor.peek(2)):
+            self.create_index(impact, cursor)
+        elif cursor.accept("DROP", "INDEX"):
+            concurrently = cursor.accept("CONCURRENTLY")
+            cursor.accept("IF", "EXISTS")
+            index = self.schema.indexes.get(cursor.name())
+            if index is None or not self.existing(impact, index.table):
+                return
+            impact.lock, impact.risk, impact.reason = ACCESS_EXCLUSIVE, "low", "catalog change"
+            if not concurrently:
+                impact.online = [re.sub(r"^DROP\s+INDEX", "DROP INDEX CONCURRENTLY", impact.sql, flags=re.I)]
+        elif cursor.peek() in ("UPDATE", "DELETE"):
+            self.backfill(impact, cursor)
+        elif cursor.accept("INSERT", "INTO"):
+            if self.existing(impact, cursor.name()):
+                impact.lock, impact.risk, impact.reason = ROW_EXCLUSIVE, "low", "new rows only"
+        elif cursor.accept("CREATE", "TABLE") or cursor.accept("CREATE", "UNLOGGED", "TABLE"):
+            cursor.accept("IF", "NOT", "EXISTS")
+            impact.table = cursor.name()
+            self.created.add(impact.table)
+            impact.reason = "new table"
+        elif cursor.accept("ALTER", "TYPE"):
+            impact.lock, impact.risk = ACCESS_EXCLUSIVE, "low"
+            impact.reason = "brief lock on the type; an added value is usable once committed"
+        elif cursor.accept("DROP"):
+            impact.lock, impact.risk, impact.reason = ACCESS_EXCLUSIVE, "low", "catalog change"
+        elif cursor.peek() == "CREATE":
+            impact.reason = "new object"
+        else:
+            impact.lock, impact.risk = "?", "medium"
+            impact.reason = "{} statement: review it by hand".format(cursor.peek())
+
+    def alter_table(self, impact, cursor):
+        cursor.accept("IF", "EXISTS")
+        cursor.accept("ONLY")
+        if not self.existing(impact, cursor.name()):
+            return
+        table = self.schema.tables[impact.table]
+        impact.lock, impact.risk, impact.reason = ACCESS_EXCLUSIVE, "low", "catalog change"
+        if cursor.accept("ADD"):
+            if cursor.peek() in model.TABLE_CONSTRAINT_WORDS:
+                self.add_constraint(impact, table, model.parse_table_constraint(cursor, table.name, table.columns))
+                return
+            cursor.accept("COLUMN")
+            cursor.accept("IF", "NOT", "EXISTS")
+            column, constraints = model.parse_column(cursor, table.name)
+            if column.name not in table.columns:
+                self.add_column(impact, table, column, constraints)
+        elif cursor.accept("VALIDATE", "CONSTRAINT"):
+            impact.lock, impact.scan = SHARE_UPDATE_EXCLUSIVE, True
+            impact.reason = "scan that lets reads and writes through"
+        elif cursor.accept("ALTER"):
+            cursor.accept("COLUMN")
+            column = table.columns[cursor.name()]
+            if cursor.accept("SET", "DATA", "TYPE") or cursor.accept("TYPE"):
+                self.alter_type(impact, table, column, cursor)
+            elif cursor.accept("SET", "NOT", "NULL") and column.nullable:
+                impact.risk, impact.scan = "high", True
+                impact.reason = "reads and writes wait while every row is checked"
+                impact.online = not_null_steps(table.name, column.name)
+
+    def add_column(self, impact, table, column, constraints):
+        name = q(table.name)
+        if column.type_key in planner.SERIAL_TYPES:
+            impact.risk, impact.rewrite = "high", True
+            impact.reason = "the sequence default is written to every row; no online form, use a maintenance window"
+        elif column.default is not None and VOLATILE.search(column.default):
+            impact.risk, impact.rewrite = "high", True
+            impact.reason = "the default is evaluated for every row, rewriting the table"
+            impact.online = [
+                "ALTER TABLE {} ADD COLUMN IF NOT EXISTS {}".format(
+                    name, planner.column_sql(model.Column(column.name, column.type), nullable=True)),
+                "ALTER TABLE {} ALTER COLUMN {} SET DEFAULT {}".format(name, q(column.name), column.default),
+                self.batched("UPDATE {} SET {} = {} WHERE {} IS NULL".format(
+                    name, q(column.name), column.default, q(column.name)), table),
+            ]
+            if not column.nullable:
+                impact.online.extend(not_null_steps(table.name, column.name))
+        elif not column.nullable and column.default is None:
+            impact.risk = "high"
+            impact.reason = "NOT NULL without a default fails on a table with rows"
+            impact.online = [
+                "ALTER TABLE {} ADD COLUMN IF NOT EXISTS {}".format(name, planner.column_sql(column, nullable=True)),
+                "-- backfill {}.{} here".format(table.name, column.name),
+            ] + not_null_steps(table.name, column.name)
+        else:
+            impact.reason = "catalog change; a constant default is not written to the rows"
+        if constraints:
+            impact.risk, impact.scan = "high", True
+            impact.reason = "inline constraints are checked against every row; add them separately"
+
+    def add_constraint(self, impact, table, constraint):
+        name, table_name = q(constraint.name), q(table.name)
+        columns = ", ".join(q(c) for c in constraint.columns)
+        impact.scan = True
+        if constraint.kind in ("f", "c"):
+            if constraint.kind == "f":
+                referenced = re.search(r"REFERENCES\s+(\S+?)\s*\(", constraint.definition, re.I)
+                impact.lock, impact.risk = SHARE_ROW_EXCLUSIVE, "medium"
+                impact.reason = "writes to {} and {} wait while every row is checked".format(
+                    table.name, model.unquote(referenced.group(1)) if referenced else "the referenced table")
+            else:
+                impact.risk = "high"
+                impact.reason = "reads and writes wait while every row is checked"
+            impact.online = [
+                "ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID".format(table_name, name, constraint.definition),
+                "ALTER TABLE {} VALIDATE CONSTRAINT {}".format(table_name, name),
+            ]
+            return
+
+        kind = "PRIMARY KEY" if constraint.kind == "p" else "UNIQUE"
+        impact.risk = "high"
+        impact.reason = "reads and writes wait while the index is built"
+        if model.normalize_expr(constraint.definition) != model.normalize_expr("{} ({})".format(kind, columns)):
+            impact.reason += "; no online form for its options"
+            return
+        impact.online = ["CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})".format(name, table_name, columns)]
+        if constraint.kind == "p":
+            for column in constraint.columns:
+                if table.columns[column].nullable:
+                    impact.online.extend(not_null_steps(table.name, column))
+        impact.online.append("ALTER TABLE {} ADD CONSTRAINT {} {} USING INDEX {}".format(table_name, name, kind, name))
+
+    def alter_type(self, impact, table, column, cursor):
+        new_type = cursor.until({"USING", "COLLATE"})
+        using = cursor.accept("USING")
+        new_key = model.normalize_type(new_type)
+        if binary_coercible(column.type_key, new_key):
+            # A USING cast is a conversion unless it only relabels to text.
+            string = STRING_TYPE.match(new_key)
+            if using and not (string and string.group(2) is None):
+                impact.risk, impact.rewrite = "high", True
+                impact.reason = "the USING cast rewrites the table although the types are binary compatible"
+            else:
+                impact.reason = "binary compatible: catalog change only"
+            impact.online = ["ALTER TABLE {} ALTER COLUMN {} TYPE {}".format(q(table.name), q(column.name), new_type)]
+            return
+        impact.risk, impact.rewrite = "high", True
+        impact.reason = "reads and writes wait while the table and its indexes are rewritten; " \
+                        "on a large table use expand/contract (new column, sync trigger, batched copy, swap)"
+
+    def create_index(self, impact, cursor):
+        cursor.expect("CREATE")
+        cursor.accept("UNIQUE")
+        cursor.expect("INDEX")
+        concurrently = cursor.accept("CONCURRENTLY")
+        cursor.accept("IF", "NOT", "EXISTS")
+        if cursor.peek() != "ON":
+            cursor.name()
+        cursor.expect("ON")
+        cursor.accept("ONLY")
+        if not self.existing(impact, cursor.name()):
+            return
+        impact.scan = True
+        if concurrently:
+            impact.lock, impact.risk = SHARE_UPDATE_EXCLUSIVE, "low"
+            impact.reason = "built while reads and writes go on"
+            return
+        impact.lock, impact.risk = SHARE, "medium"
+        impact.reason = "writes wait while the index is built"
+        impact.online = [re.sub(r"^CREATE\s+(UNIQUE\s+)?INDEX", lambda m: "CREATE {}INDEX CONCURRENTLY".format(
+            "UNIQUE " if m.group(1) else ""), impact.sql, flags=re.I)]
+
+    def backfill(self, impact, cursor):
+        if cursor.take().upper() == "DELETE":
+            cursor.expect("FROM")
+        cursor.accept("ONLY")
+        table_token = cursor.tokens[cursor.pos].text
+        if not self.existing(impact, cursor.name()):
+            return
+        alias = table_token
+        if cursor.accept("AS"):
+            alias = cursor.take()
+        elif cursor.peek() not in ("SET", "USING", "WHERE", None):
+            alias = cursor.take()
+        impact.lock, impact.risk, impact.scan = ROW_EXCLUSIVE, "medium", True
+        impact.reason = "one transaction locks every row it changes; writes to them wait until it commits"
+        table = self.schema.tables[impact.table]
+        online = self.batched(impact.sql, table, alias, cursor)
+        if online is None:
+            impact.reason += "; not batched: no unique key or a RETURNING clause"
+        else:
+            impact.online = [online]
+
+    def batched(self, text, table, alias=None, cursor=None):
+        """
+        `text`, an UPDATE or DELETE of `table`, as a DO block that works
+        through the rows in primary key order and commits every batch_rows
+        rows. Keys are compared as rows, so composite keys work too.
+        """
+        key = batch_key(self.schema, table)
+        if cursor is None:
+            cursor = model.Cursor(text)
+            cursor.pos = len(cursor.tokens)
+            alias = q(table.name)
+        if key is None:
+            return None
+        where = returning = None
+        depth = 0
+        for token in cursor.tokens:
+            if token.text in "([":
+                depth += 1
+            elif token.text in ")]":
+                depth -= 1
+            elif depth == 0 and token.upper == "WHERE" and where is None:
+                where = token
+            elif depth == 0 and token.upper == "RETURNING":
+                returning = token
+        if returning is not None:
+            return None
+
+        columns = [q(column) for column in key]
+        qualified = ", ".join("{}.{}".format(alias, column) for column in columns)
+        lower = ["lower_{}".format(i) for i in range(len(key))]
+        upper = ["next_{}".format(i) for i in range(len(key))]
+        if where is None:
+            head, condition = text.rstrip(), None
+        else:
+            head, condition = text[:where.start].rstrip(), text[where.end:].strip()
+        if not any("\n" in token.text for token in cursor.tokens if token.text[0] in "'$"):
+            head = head.replace("\n", "\n" + " " * 12)
+            condition = condition and condition.replace("\n", "\n" + " " * 12)
+
+        def bounded(extra):
+            predicates = ([] if condition is None else ["({})".format(condition)]) + extra
+            return "{}\n            WHERE {}".format(head, "\n              AND ".join(predicates))
+
+        from_lower = "({}) >= ({})".format(qualified, ", ".join(lower))
+        below_next = "({}) < ({})".format(qualified, ", ".join(upper))
+        declarations = "\n".join("    {} {}.{}%TYPE;".format(variable, q(table.name), column)
+                                 for variables in (lower, upper) for variable, column in zip(variables, columns))
+        return BATCH_TEMPLATE.format(
+            declarations=declarations,
+            key=", ".join(columns),
+            lower=", ".join(lower),
+            next=", ".join(upper),
+            table=q(table.name),
+            rows=self.batch_rows,
+            bounded=bounded([from_lower, below_next]),
+            last=bounded([from_lower]),
+            advance=" ".join("{} := {};".format(a, b) for a, b in zip(lower, upper)),
+        )
+
+
+def table_stats(cursor):
+    """
+    Estimated rows, heap bytes and index bytes of the tables in public.
+    """
+    cursor.execute("""
+        SELECT c.relname, GREATEST(c.reltuples, 0)::bigint, pg_table_size(c.oid), pg_indexes_size(c.oid)
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')""")
+    return {name: (rows, heap, indexes) for name, rows, heap, indexes in cursor.fetchall()}
+
+
+def estimate(impacts, stats, scan_rate, rewrite_rate):
+    """
+    Seconds each rewrite, scan or index build holds its lock, from the
+    table sizes and the given MB/s rates.
+    """
+    for impact in impacts:
+        if impact.table not in stats or not (impact.rewrite or impact.scan) or impact.risk == "none":
+            continue
+        rows, heap, indexes = stats[impact.table]
+        if impact.rewrite:
+            size, rate = heap + indexes, rewrite_rate
+        elif impact.lock in (SHARE, ROW_EXCLUSIVE) or impact.reason.endswith("index is built"):
+            size, rate = heap, rewrite_rate
+        else:
+            size, rate = heap, scan_rate
+        impact.seconds = size / (rate * 1024 * 1024)
+
+
+def report(impacts, stats, shown=("high", "medium")):
+    print("{:<7} {:<20} {:<3} {:<28} {:>12} {:>9}  {}".format(
+        "risk", "lock", "R/S", "table", "rows", "est.", "statement"))
+    for impact in impacts:
+        if impact.risk not in shown:
+            continue
+        flags = ("R" if impact.rewrite else "-") + ("S" if impact.scan else "-")
+        rows = "{:,}".format(stats[impact.table][0]) if impact.table in stats else ""
+        seconds = "{:.1f}s".format(impact.seconds) if impact.seconds is not None else ""
+        print("{:<7} {:<20} {:<3} {:<28} {:>12} {:>9}  {}".format(
+            impact.risk, impact.lock, flags, (impact.table or "")[:28], rows, seconds, impact.summary))
+        print("        {}".format(impact.reason))
+    counts = {risk: sum(1 for impact in impacts if impact.risk == risk) for risk in RISKS}
+    print("\n{} statements: {}".format(len(impacts), ", ".join("{} {}".format(counts[r], r) for r in RISKS)))
+    blocking = [impact for impact in impacts if impact.seconds is not None and impact.lock in (ACCESS_EXCLUSIVE, SHARE, SHARE_ROW_EXCLUSIVE)]
+    if blocking:
+        print("Estimated time the plan blocks writes: {:.1f}s".format(sum(impact.seconds for impact in blocking)))
+    replaced = sum(1 for impact in impacts if impact.online != [impact.sql])
+    print("Online plan: {} statements replaced".format(replaced))
+
+
+def render_online(impacts, title, lock_timeout, ledger=None):
+    lines = [
+        "-- Online migration plan {}".format(title),
+        "-- Run with psql in autocommit mode; every statement commits on its own.",
+        "-- A failed CONCURRENTLY build leaves an INVALID index: drop it before rerunning.",
+        "SET lock_timeout = {};".format(sqllex.quote_literal(lock_timeout)),
+        "SET statement_timeout = 0;",
+    ]
+    for impact in impacts:
+        lines.append("")
+        if impact.risk in ("high", "medium"):
+            lines.append("-- {}: {}".format(impact.risk, impact.reason))
+        for statement in impact.online:
+            lines.append(statement if statement.startswith("--") else statement.rstrip().rstrip(";") + ";")
+    if ledger is not None:
+        source, target = ledger
+        lines.append("")
+        lines.append("INSERT INTO {} (version, checksum, previous_version, statements, duration_ms) "
+                     "VALUES ({}, {}, {}, {}, 0);".format(
+                         migrate.LEDGER_TABLE, sqllex.quote_literal(target.version), sqllex.quote_literal(target.checksum),
+                         sqllex.quote_literal(source.version), len(impacts)))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--from", required=True, help="snapshot version or schema.sql path the database is at")
+    parser.add_argument("--to", help="target snapshot; the plan between the two is analysed")
+    parser.add_argument("--script", action="append", help="delta script to analyse instead of a plan (repeatable)")
+    parser.add_argument("--dsn", help="libpq connection string for the size estimates")
+    parser.add_argument("--output", help="write the online plan to this file (- for stdout)")
+    parser.add_argument("--all", action="store_true", help="list the low risk statements too")
+    parser.add_argument("--lock-timeout", default=DEFAULT_LOCK_TIMEOUT)
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS, help="rows per backfill transaction")
+    parser.add_argument("--scan-rate", type=float, default=DEFAULT_SCAN_RATE, help="MB/s read by a validating scan")
+    parser.add_argument("--rewrite-rate", type=float, default=DEFAULT_REWRITE_RATE, help="MB/s of a rewrite or index build")
+    args = parser.parse_args(argv)
+    if bool(args.to) == bool(args.script):
+        parser.error("pass either --to or --script")
+
+    source = planner.Snapshot.load(getattr(args, "from"))
+    if args.to:
+        target = planner.Snapshot.load(args.to)
+        plan = planner.plan(source, target)
+        for warning in plan.warnings:
+            print("WARNING: {}".format(warning), file=sys.stderr)
+        steps = plan.ordered()
+        title, ledger = "{} -> {}".format(source.version, target.version), (source, target)
+    else:
+        steps = []
+        for path in args.script:
+            with open(path, encoding="utf-8") as f:
+                steps.extend(planner.Step("script", s.sql) for s in sqllex.split_statements(f.read(), path))
+        title, ledger = "{} + {}".format(source.version, ", ".join(args.script)), None
+
+    impacts = Analyzer(source.replay.schema, args.batch_rows).run(steps)
+    stats = {}
+    if args.dsn:
+        conn = migrate.connect(args.dsn)
+        stats = table_stats(conn.cursor())
+        conn.close()
+        estimate(impacts, stats, args.scan_rate, args.rewrite_rate)
+
+    online = render_online(impacts, title, args.lock_timeout, ledger)
+    if args.output == "-":
+        sys.stdout.write(online)
+        return
+    report(impacts, stats, RISKS[:3] if args.all else RISKS[:2])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(online)
+        print("Wrote {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
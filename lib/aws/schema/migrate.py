@@ -0,0 +1,262 @@
+"""
+Plan and apply incremental upgrades between the schema snapshots.
+
+    python3 lib/aws/schema/migrate.py plan --from v1.107.0 --to v1.116.0
+    python3 lib/aws/schema/migrate.py status
+    python3 lib/aws/schema/migrate.py apply --to v1.116.0 [--baseline v1.107.0] [--allow-destructive]
+    python3 lib/aws/schema/migrate.py verify --to v1.116.0
+
+The database records the snapshot it is at in the schema_snapshot_ledger
+table. `apply` plans from that version to the target and runs the plan: enum
+additions first (each committed on its own), then every other step and the new
+ledger row in one transaction. A database initialised before the ledger
+existed has to be told its version once with --baseline; the RDS init function
+loads v1.107.0.
+
+The connection is taken from --dsn, DATABASE_URL or the libpq PG* variables.
+psycopg2 is needed for every command but `plan`.
+"""
+import argparse
+import os
+import sys
+import time
+
+import planner
+
+LEDGER_TABLE = "schema_snapshot_ledger"
+# Serialises concurrent `apply` runs against the same database.
+ADVISORY_LOCK_KEY = 7310461
+
+LEDGER_DDL = """
+CREATE TABLE IF NOT EXISTS {} (
+    id SERIAL PRIMARY KEY,
+    version VARCHAR(32) NOT NULL,
+    checksum CHAR(64) NOT NULL,
+    previous_version VARCHAR(32),
+    statements INTEGER NOT NULL,
+    duration_ms INTEGER NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT now()
+)""".format(LEDGER_TABLE)
+
+
+def connect(dsn):
+    try:
+        import psycopg2
+    except ImportError:
+        sys.exit("psycopg2 is required to connect to the database: pip install psycopg2-binary")
+    return psycopg2.connect(dsn or os.environ.get("DATABASE_URL", ""))
+
+
+def current_version(cursor):
+    cursor.execute(LEDGER_DDL)
+    cursor.execute("SELECT version, checksum FROM {} ORDER BY id DESC LIMIT 1".format(LEDGER_TABLE))
+    return cursor.fetchone()
+
+
+def record(cursor, snapshot, previous, statements, duration_ms):
+    cursor.execute(
+        "INSERT INTO {} (version, checksum, previous_version, statements, duration_ms) "
+        "VALUES (%s, %s, %s, %s, %s)".format(LEDGER_TABLE),
+        (snapshot.version, snapshot.checksum, previous, statements, duration_ms),
+    )
+
+
+def execute(cursor, step, timings):
+    started = time.monotonic()
+    try:
+        cursor.execute(step.sql)
+    except Exception as e:
+        raise RuntimeError("{} step failed: {}\n{}".format(step.phase, e, step.sql)) from e
+    timings[step.phase] = timings.get(step.phase, 0.0) + time.monotonic() - started
+
+
+def apply(args):
+    target = planner.Snapshot.load(args.to)
+    conn = connect(args.dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+    try:
+        row = current_version(cursor)
+        if row is None:
+            if not args.baseline:
+                sys.exit("{} is empty: pass --baseline with the snapshot the database was initialised from".format(LEDGER_TABLE))
+            baseline = planner.Snapshot.load(args.baseline)
+            record(cursor, baseline, None, 0, 0)
+            row = (baseline.version, baseline.checksum)
+
+        version, checksum = row
+        if version == target.version:
+            print("Already at {}".format(version))
+            return
+        source = planner.Snapshot.load(version)
+        if source.checksum != checksum.strip() and not args.force:
+            sys.exit("{} changed since it was applied; pass --force to plan from it anyway".format(source.path))
+
+        plan = planner.plan(source, target)
+        for warning in plan.warnings:
+            print("WARNING: {}".format(warning))
+        if plan.destructive and not args.allow_destructive:
+            print(planner.Plan(plan.source, plan.target, plan.destructive).render())
+            sys.exit("The plan drops data (above); pass --allow-destructive to apply it")
+
+        started = time.monotonic()
+        timings = {}
+        steps = plan.ordered()
+        for step in steps:
+            if not step.transactional:
+                execute(cursor, step, timings)
+
+        conn.autocommit = False
+        try:
+            for step in steps:
+                if step.transactional:
+                    execute(cursor, step, timings)
+            record(cursor, target, source.version, len(steps), int((time.monotonic() - started) * 1000))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        for phase in planner.PHASES:
+            if phase in timings:
+                print("{:<18} {:8.3f}s".format(phase, timings[phase]))
+        print("Applied {} -> {}: {} statements in {:.3f}s".format(
+            source.version, target.version, len(steps), time.monotonic() - started))
+    finally:
+        conn.autocommit = True
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+        conn.close()
+
+
+def status(args):
+    conn = connect(args.dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute(LEDGER_DDL)
+    cursor.execute("SELECT version, previous_version, statements, duration_ms, applied_at FROM {} ORDER BY id".format(LEDGER_TABLE))
+    rows = cursor.fetchall()
+    conn.close()
+    if not rows:
+        print("No version recorded")
+    for version, previous, statements, duration_ms, applied_at in rows:
+        origin = "from {}".format(previous) if previous else "baseline"
+        print("{}  {:<10} {:<16} {:5} statements {:7} ms".format(applied_at, version, origin, statements, duration_ms))
+    print("Snapshots: {}".format(", ".join(planner.versions())))
+
+
+def introspect(cursor):
+    """
+    Names and shapes of the objects in the public schema of the database.
+    """
+    cursor.execute("""
+        SELECT table_name, column_name, is_nullable = 'YES'
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name <> %s""", (LEDGER_TABLE,))
+    columns = {(table, column): nullable for table, column, nullable in cursor.fetchall()}
+    cursor.execute("""
+        SELECT t.typname, e.enumlabel
+        FROM pg_enum e JOIN pg_type t ON t.oid = e.enumtypid
+        JOIN pg_namespace n ON n.oid = t.typnamespace
+        WHERE n.nspname = 'public'
+        ORDER BY t.typname, e.enumsortorder""")
+    enums = {}
+    for name, label in cursor.fetchall():
+        enums.setdefault(name, []).append(label)
+    cursor.execute("""
+        SELECT c.conrelid::regclass::text, c.conname
+        FROM pg_constraint c JOIN pg_namespace n ON n.oid = c.connamespace
+        WHERE n.nspname = 'public' AND c.contype IN ('p', 'u', 'f', 'c')""")
+    constraints = {(table.strip('"'), name) for table, name in cursor.fetchall() if table != LEDGER_TABLE}
+    cursor.execute("""
+        SELECT i.indexname FROM pg_indexes i
+        WHERE i.schemaname = 'public' AND NOT EXISTS (
+            SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)""")
+    indexes = {name for (name,) in cursor.fetchall()}
+    return columns, enums, constraints, indexes
+
+
+def differences(schema, live):
+    columns, enums, constraints, indexes = live
+    expected_columns = {
+        (table.name, column.name): column.nullable
+        for table in schema.tables.values() for column in table.columns.values()
+    }
+    expected_constraints = {
+        (table.name, constraint.name)
+        for table in schema.tables.values() for constraint in table.constraints.values()
+    }
+    found = []
+    for key in sorted(expected_columns.keys() - columns.keys()):
+        found.append("missing column {}.{}".format(*key))
+    for key in sorted(columns.keys() - expected_columns.keys()):
+        found.append("unexpected column {}.{}".format(*key))
+    for key in sorted(expected_columns.keys() & columns.keys()):
+        if expected_columns[key] != columns[key]:
+            found.append("column {}.{} should be {}".format(*key, "NULL" if expected_columns[key] else "NOT NULL"))
+    for name, values in schema.enums.items():
+        if enums.get(name) != values:
+            found.append("enum {} is {}, expected {}".format(name, enums.get(name), values))
+    for name in sorted(enums.keys() - schema.enums.keys()):
+        found.append("unexpected enum {}".format(name))
+    for key in sorted(expected_constraints - constraints):
+        found.append("missing constraint {}.{}".format(*key))
+    for key in sorted(constraints - expected_constraints):
+        found.append("unexpected constraint {}.{}".format(*key))
+    for name in sorted(schema.indexes.keys() - indexes):
+        found.append("missing index {}".format(name))
+    for name in sorted(indexes - schema.indexes.keys()):
+        found.append("unexpected index {}".format(name))
+    return found
+
+
+def verify(args):
+    target = planner.Snapshot.load(args.to)
+    conn = connect(args.dsn)
+    live = introspect(conn.cursor())
+    conn.close()
+    found = differences(target.replay.schema, live)
+    for difference in found:
+        print(difference)
+    if found:
+        sys.exit("{} differences from {}".format(len(found), target.version))
+    print("Database matches {}".format(target.version))
+
+
+def show_plan(args):
+    plan = planner.plan(planner.Snapshot.load(getattr(args, "from")), planner.Snapshot.load(args.to))
+    sys.stdout.write(plan.render())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = commands.add_parser("plan", help="print the DDL between two snapshots")
+    plan_parser.add_argument("--from", required=True, help="snapshot version or schema.sql path")
+    plan_parser.add_argument("--to", required=True)
+    plan_parser.set_defaults(run=show_plan)
+
+    apply_parser = commands.add_parser("apply", help="upgrade the database to a snapshot")
+    apply_parser.add_argument("--to", required=True)
+    apply_parser.add_argument("--baseline", help="version of a database without a ledger yet")
+    apply_parser.add_argument("--allow-destructive", action="store_true", help="allow dropping columns, tables and enums")
+    apply_parser.add_argument("--force", action="store_true", help="plan even if the recorded snapshot changed")
+    apply_parser.set_defaults(run=apply)
+
+    status_parser = commands.add_parser("status", help="show the ledger")
+    status_parser.set_defaults(run=status)
+
+    verify_parser = commands.add_parser("verify", help="compare the database with a snapshot")
+    verify_parser.add_argument("--to", required=True)
+    verify_parser.set_defaults(run=verify)
+
+    for sub in (apply_parser, status_parser, verify_parser):
+        sub.add_argument("--dsn", help="libpq connection string (default: DATABASE_URL)")
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,707 @@
+"""
+Object model of a schema snapshot.
+
+`replay` runs the statements of a snapshot against an in-memory `Schema`
+(enums, tables with their columns and constraints, indexes and functions), the
+way Postgres would apply them to an empty database. Data statements (UPDATE,
+INSERT, DO blocks, ...) change no objects; they are kept in order so that a
+planner can carry the backfills of newer migrations over. Renames are kept in
+a journal, since an object diff alone cannot tell a rename from a drop and an
+add.
+"""
+import copy
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import sql as sqllex
+
+# Postgres truncates identifiers to NAMEDATALEN - 1 bytes.
+MAX_IDENTIFIER = 63
+
+COLUMN_CONSTRAINT_WORDS = {"NOT", "NULL", "DEFAULT", "PRIMARY", "UNIQUE", "REFERENCES", "CHECK", "CONSTRAINT", "COLLATE", "GENERATED"}
+TABLE_CONSTRAINT_WORDS = {"CONSTRAINT", "PRIMARY", "UNIQUE", "FOREIGN", "CHECK", "EXCLUDE"}
+DATA_KEYWORDS = {"UPDATE", "INSERT", "DELETE", "TRUNCATE", "DO", "SELECT", "WITH", "COPY"}
+
+TYPE_ALIASES = {
+    "int": "integer", "int4": "integer", "int8": "bigint", "int2": "smallint",
+    "bool": "boolean", "float8": "double precision", "float4": "real",
+    "character varying": "varchar", "decimal": "numeric",
+    "timestamp without time zone": "timestamp", "timestamp with time zone": "timestamptz",
+    "serial4": "serial", "serial8": "bigserial", "character": "char",
+}
+
+
+class ParseError(Exception):
+    pass
+
+
+@dataclass
+class Column:
+    name: str
+    type: str
+    nullable: bool = True
+    default: Optional[str] = None
+
+    @property
+    def type_key(self):
+        return normalize_type(self.type)
+
+    @property
+    def default_key(self):
+        if self.default is None or normalize_expr(self.default) == "null":
+            return None
+        return normalize_expr(self.default)
+
+
+@dataclass
+class Constraint:
+    name: str
+    kind: str
+    definition: str
+    columns: Tuple[str, ...] = ()
+
+    @property
+    def key(self):
+        return normalize_expr(self.definition)
+
+
+@dataclass
+class Table:
+    name: str
+    columns: Dict[str, Column] = field(default_factory=dict)
+    constraints: Dict[str, Constraint] = field(default_factory=dict)
+
+
+@dataclass
+class Index:
+    name: str
+    table: str
+    unique: bool
+    definition: str
+
+    @property
+    def key(self):
+        return (self.table, self.unique, normalize_expr(self.definition))
+
+    @property
+    def columns(self):
+        return {unquote(token) for token in re.findall(r'"[^"]+"|[A-Za-z_][A-Za-z0-9_]*', self.definition)}
+
+
+@dataclass
+class Schema:
+    enums: Dict[str, List[str]] = field(default_factory=dict)
+    tables: Dict[str, Table] = field(default_factory=dict)
+    indexes: Dict[str, Index] = field(default_factory=dict)
+    functions: Dict[str, str] = field(default_factory=dict)
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def columns_of_type(self, type_name):
+        quoted = sqllex.quote_ident(type_name)
+        return [
+            (table.name, column)
+            for table in self.tables.values()
+            for column in table.columns.values()
+            if column.type.rstrip("[]").strip() in (quoted, type_name)
+        ]
+
+
+@dataclass
+class Rename:
+    kind: str
+    table: Optional[str]
+    old: str
+    new: str
+
+
+@dataclass
+class Replay:
+    """
+    Outcome of replaying a snapshot: the resulting schema, its data
+    statements, the renames performed, the columns dropped and the statements
+    that could not be modelled. Entries are keyed by statement index.
+    """
+    schema: Schema
+    data: List[Tuple[int, sqllex.Statement]] = field(default_factory=list)
+    journal: List[Tuple[int, Rename]] = field(default_factory=list)
+    dropped: List[Tuple[int, str, str]] = field(default_factory=list)
+    unmodelled: List[Tuple[sqllex.Statement, str]] = field(default_factory=list)
+
+
+def unquote(text):
+    return sqllex.unquote_ident(text)
+
+
+def normalize_expr(text):
+    """
+    Canonical form of an expression for comparison: single spaces, unquoted
+    words in lower case.
+    """
+    out = []
+    for token in sqllex.tokenize(text):
+        t = token.text
+        out.append(t if t[0] in "'\"$" else t.lower())
+    return " ".join(out)
+
+
+def normalize_type(text):
+    normalized = re.sub(r"\s*\(\s*", "(", normalize_expr(text))
+    normalized = re.sub(r"\s*\)", ")", normalized)
+    normalized = re.sub(r"\s*,\s*", ",", normalized)
+    normalized = re.sub(r"\s*\[\s*\]", "[]", normalized)
+    base, rest = re.match(r"([^(\[]*)(.*)", normalized).groups()
+    return TYPE_ALIASES.get(base.strip(), base.strip()) + rest
+
+
+def clip_identifier(name, length):
+    """
+    At most `length` bytes of `name`, without splitting a UTF-8 character.
+    """
+    return name.encode("utf-8")[:length].decode("utf-8", "ignore")
+
+
+def make_object_name(name1, name2, label):
+    """
+    Postgres' makeObjectName: "name1_name2_label", with name1 and name2
+    shortened (the longer one first) so that the whole fits in an identifier
+    and the label is kept.
+    """
+    name1_bytes = len(name1.encode("utf-8"))
+    name2_bytes = len(name2.encode("utf-8")) if name2 else 0
+    overhead = (1 if name2 else 0) + (len(label) + 1 if label else 0)
+    available = MAX_IDENTIFIER - overhead
+    while name1_bytes + name2_bytes > available:
+        if name1_bytes > name2_bytes:
+            name1_bytes -= 1
+        else:
+            name2_bytes -= 1
+    parts = [clip_identifier(name1, name1_bytes)]
+    if name2:
+        parts.append(clip_identifier(name2, name2_bytes))
+    if label:
+        parts.append(label)
+    return "_".join(parts)
+
+
+def column_name_addition(columns):
+    """
+    Postgres' ChooseIndexNameAddition: the column names joined with "_",
+    stopping once an identifier's length is reached.
+    """
+    joined = b""
+    for column in columns:
+        if joined:
+            joined += b"_"
+        joined = (joined + column.encode("utf-8"))[:MAX_IDENTIFIER]
+        if len(joined) >= MAX_IDENTIFIER:
+            break
+    return joined.decode("utf-8", "ignore")
+
+
+def default_constraint_name(table, columns, suffix):
+    """
+    The name Postgres chooses for an unnamed constraint (before it appends a
+    number to avoid a clash).
+    """
+    return make_object_name(table, column_name_addition(columns) or None, suffix)
+
+
+class Cursor:
+    """
+    A position in the tokens of one statement.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = sqllex.tokenize(text)
+        self.pos = 0
+
+    def at_end(self):
+        return self.pos >= len(self.tokens)
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index].upper if index < len(self.tokens) else None
+
+    def accept(self, *words):
+        if all(self.peek(i) == word for i, word in enumerate(words)):
+            self.pos += len(words)
+            return True
+        return False
+
+    def expect(self, *words):
+        if not self.accept(*words):
+            raise ParseError("expected {} at {!r}".format(" ".join(words), self.remaining()[:60]))
+
+    def take(self):
+        if self.at_end():
+            raise ParseError("unexpected end of statement")
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token.text
+
+    def name(self):
+        """
+        An identifier, without quotes and without a `public.` qualifier.
+        """
+        text = self.take()
+        if self.peek() == ".":
+            self.pos += 1
+            text = self.take()
+        return unquote(text)
+
+    def group(self):
+        """
+        The raw text inside the parenthesised group at the cursor.
+        """
+        if self.peek() != "(":
+            raise ParseError("expected ( at {!r}".format(self.remaining()[:60]))
+        start = self.tokens[self.pos].end
+        depth = 0
+        while not self.at_end():
+            token = self.tokens[self.pos]
+            self.pos += 1
+            if token.text in "([":
+                depth += 1
+            elif token.text in ")]":
+                depth -= 1
+                if depth == 0:
+                    return self.text[start:token.start].strip()
+        raise ParseError("unbalanced parentheses")
+
+    def until(self, stop_words=(), at_least_one=False):
+        """
+        Raw text up to the next top-level comma or one of `stop_words`.
+        """
+        if self.at_end():
+            return ""
+        start = self.tokens[self.pos].start
+        end = start
+        depth = 0
+        first = self.pos
+        while not self.at_end():
+            token = self.tokens[self.pos]
+            stop = token.text == "," or token.upper in stop_words
+            if depth == 0 and stop and not (at_least_one and self.pos == first):
+                break
+            if token.text in "([":
+                depth += 1
+            elif token.text in ")]":
+                depth -= 1
+            end = token.end
+            self.pos += 1
+        return self.text[start:end].strip()
+
+    def remaining(self):
+        if self.at_end():
+            return ""
+        return self.text[self.tokens[self.pos].start:].strip()
+
+
+def split_list(text):
+    """
+    Items of a comma-separated list, split at the top level only.
+    """
+    cursor = Cursor(text)
+    items = []
+    while not cursor.at_end():
+        items.append(cursor.until())
+        cursor.accept(",")
+    return [item for item in items if item]
+
+
+def column_names(text):
+    return tuple(unquote(item.split()[0]) for item in split_list(text))
+
+
+def parse_column(cursor, table):
+    """
+    A column definition and the constraints declared inline with it.
+    """
+    column = Column(cursor.name(), cursor.until(COLUMN_CONSTRAINT_WORDS))
+    constraints = []
+    name = None
+    while not cursor.at_end() and cursor.peek() != ",":
+        if cursor.accept("CONSTRAINT"):
+            name = cursor.name()
+            continue
+        if cursor.accept("NOT", "NULL"):
+            column.nullable = False
+        elif cursor.accept("NULL"):
+            column.nullable = True
+        elif cursor.accept("DEFAULT"):
+            column.default = cursor.until(COLUMN_CONSTRAINT_WORDS, at_least_one=True)
+        elif cursor.accept("PRIMARY", "KEY"):
+            column.nullable = False
+            constraints.append(Constraint(
+                name or default_constraint_name(table, [], "pkey"), "p",
+                "PRIMARY KEY ({})".format(sqllex.quote_ident(column.name)), (column.name,)))
+        elif cursor.accept("UNIQUE"):
+            constraints.append(Constraint(
+                name or default_constraint_name(table, [column.name], "key"), "u",
+                "UNIQUE ({})".format(sqllex.quote_ident(column.name)), (column.name,)))
+        elif cursor.accept("REFERENCES"):
+            reference = cursor.until(COLUMN_CONSTRAINT_WORDS - {"NOT", "NULL"})
+            constraints.append(Constraint(
+                name or default_constraint_name(table, [column.name], "fkey"), "f",
+                "FOREIGN KEY ({}) REFERENCES {}".format(sqllex.quote_ident(column.name), reference),
+                (column.name,)))
+        elif cursor.accept("CHECK"):
+            constraints.append(Constraint(
+                name or default_constraint_name(table, [column.name], "check"), "c",
+                "CHECK ({})".format(cursor.group()), (column.name,)))
+        elif cursor.accept("COLLATE"):
+            column.type = "{} COLLATE {}".format(column.type, cursor.take())
+        else:
+            raise ParseError("unsupported column option {!r}".format(cursor.remaining()[:60]))
+        name = None
+    return column, constraints
+
+
+def check_columns(body, columns):
+    """
+    The columns of a CHECK expression that Postgres names it after: the one
+    column it references, if it references exactly one of `columns`.
+    """
+    referenced = {
+        unquote(token.text) for token in sqllex.tokenize(body)
+        if token.text[0] == '"' or token.text[0].isalpha() or token.text[0] == "_"
+    } & set(columns)
+    return sorted(referenced) if len(referenced) == 1 else []
+
+
+def parse_table_constraint(cursor, table, columns=()):
+    """
+    A table constraint of `table`, whose columns so far are `columns`.
+    """
+    name = cursor.name() if cursor.accept("CONSTRAINT") else None
+    if cursor.accept("PRIMARY", "KEY"):
+        columns = column_names(cursor.group())
+        kind, suffix, definition = "p", "pkey", "PRIMARY KEY"
+        name = name or default_constraint_name(table, [], suffix)
+    elif cursor.accept("UNIQUE"):
+        columns = column_names(cursor.group())
+        kind, definition = "u", "UNIQUE"
+        name = name or default_constraint_name(table, columns, "key")
+    elif cursor.accept("FOREIGN", "KEY"):
+        columns = column_names(cursor.group())
+        kind, definition = "f", "FOREIGN KEY"
+        name = name or default_constraint_name(table, columns, "fkey")
+    elif cursor.accept("CHECK"):
+        body = cursor.group()
+        return Constraint(
+            name or default_constraint_name(table, check_columns(body, columns), "check"), "c",
+            "CHECK ({})".format(body))
+    else:
+        raise ParseError("unsupported table constraint {!r}".format(cursor.remaining()[:60]))
+
+    definition = "{} ({})".format(definition, ", ".join(sqllex.quote_ident(c) for c in columns))
+    rest = cursor.until()
+    if rest:
+        definition = "{} {}".format(definition, rest)
+    return Constraint(name, kind, definition, columns)
+
+
+def add_constraints(table, constraints):
+    for constraint in constraints:
+        table.constraints[constraint.name] = constraint
+        if constraint.kind == "p":
+            for name in constraint.columns:
+                table.columns[name].nullable = False
+
+
+class Replayer:
+    def __init__(self, schema=None):
+        self.result = Replay(schema or Schema())
+        self.index = -1
+
+    @property
+    def schema(self):
+        return self.result.schema
+
+    def run(self, statements):
+        for index, statement in enumerate(statements):
+            words = statement.keywords
+            try:
+                if words and words[0] in DATA_KEYWORDS:
+                    if not (words[0] == "DO" and self.do_block(statement.sql)):
+                        self.result.data.append((index, statement))
+                    continue
+                self.statement(index, statement.sql)
+            except (ParseError, KeyError, ValueError) as e:
+                self.result.unmodelled.append((statement, str(e)))
+        return self.result
+
+    def statement(self, index, text):
+        cursor = Cursor(text)
+        self.index = index
+        if cursor.accept("CREATE", "TYPE"):
+            self.create_type(cursor)
+        elif cursor.accept("ALTER", "TYPE"):
+            self.alter_type(cursor)
+        elif cursor.accept("DROP", "TYPE"):
+            cursor.accept("IF", "EXISTS")
+            for name in split_list(cursor.until({"CASCADE", "RESTRICT"})):
+                self.schema.enums.pop(unquote(name.split(".")[-1]), None)
+        elif cursor.accept("CREATE", "TABLE") or cursor.accept("CREATE", "UNLOGGED", "TABLE"):
+            self.create_table(cursor)
+        elif cursor.accept("DROP", "TABLE"):
+            cursor.accept("IF", "EXISTS")
+            for name in split_list(cursor.until({"CASCADE", "RESTRICT"})):
+                self.drop_table(unquote(name.split(".")[-1]))
+        elif cursor.accept("ALTER", "TABLE"):
+            self.alter_table(cursor)
+        elif cursor.peek() == "CREATE" and "INDEX" in (cursor.peek(1), cursor.peek(2)):
+            self.create_index(cursor)
+        elif cursor.accept("DROP", "INDEX"):
+            cursor.accept("CONCURRENTLY")
+            cursor.accept("IF", "EXISTS")
+            for name in split_list(cursor.until({"CASCADE", "RESTRICT"})):
+                self.schema.indexes.pop(unquote(name.split(".")[-1]), None)
+        elif cursor.accept("ALTER", "INDEX"):
+            cursor.accept("IF", "EXISTS")
+            old = cursor.name()
+            cursor.expect("RENAME", "TO")
+            self.rename_index(old, cursor.name())
+        elif cursor.accept("CREATE", "OR", "REPLACE", "FUNCTION") or cursor.accept("CREATE", "FUNCTION"):
+            self.schema.functions[cursor.name()] = text
+        elif cursor.accept("DROP", "FUNCTION"):
+            cursor.accept("IF", "EXISTS")
+            self.schema.functions.pop(cursor.name(), None)
+        else:
+            raise ParseError("unsupported statement")
+
+    def create_type(self, cursor):
+        name = cursor.name()
+        cursor.expect("AS", "ENUM")
+        self.schema.enums[name] = [sqllex.unquote_literal(v) for v in split_list(cursor.group())]
+
+    def add_enum_value(self, name, value, position=None, neighbour=None):
+        values = self.schema.enums[name]
+        if value in values:
+            return
+        if position == "BEFORE":
+            values.insert(values.index(neighbour), value)
+        elif position == "AFTER":
+            values.insert(values.index(neighbour) + 1, value)
+        else:
+            values.append(value)
+
+    def alter_type(self, cursor):
+        name = cursor.name()
+        if cursor.accept("ADD", "VALUE"):
+            cursor.accept("IF", "NOT", "EXISTS")
+            value = sqllex.unquote_literal(cursor.take())
+            position = cursor.peek()
+            neighbour = None
+            if position in ("BEFORE", "AFTER"):
+                cursor.take()
+                neighbour = sqllex.unquote_literal(cursor.take())
+            self.add_enum_value(name, value, position, neighbour)
+        elif cursor.accept("RENAME", "VALUE"):
+            old = sqllex.unquote_literal(cursor.take())
+            cursor.expect("TO")
+            new = sqllex.unquote_literal(cursor.take())
+            values = self.schema.enums[name]
+            values[values.index(old)] = new
+            self.journal(Rename("enum_value", name, old, new))
+        elif cursor.accept("RENAME", "TO"):
+            new = cursor.name()
+            self.schema.enums[new] = self.schema.enums.pop(name)
+            self.retype(name, new)
+            self.journal(Rename("type", None, name, new))
+        else:
+            raise ParseError("unsupported ALTER TYPE")
+
+    def retype(self, old, new):
+        for table, column in self.schema.columns_of_type(old):
+            column.type = column.type.replace(sqllex.quote_ident(old), sqllex.quote_ident(new), 1)
+
+    def do_block(self, text):
+        """
+        Model the enum additions made by DO blocks, either literal
+        ALTER TYPE ... ADD VALUE statements or a loop over an ARRAY of labels.
+        Returns whether the block was fully understood.
+        """
+        body = re.search(r"\$(\w*)\$(.*)\$\1\$", text, re.S)
+        if not body:
+            return False
+        body = body.group(2)
+        literal = re.findall(r"""ALTER\s+TYPE\s+("[^"]+"|\w+)\s+ADD\s+VALUE\s+(?:IF\s+NOT\s+EXISTS\s+)?('(?:[^']|'')*')(?:\s+(BEFORE|AFTER)\s+('(?:[^']|'')*'))?""", body, re.I)
+        looped = re.search(r"""ARRAY\s*\[(.*?)\].*?ALTER\s+TYPE\s+("[^"]+"|\w+)\s+ADD\s+VALUE\s+%L""", body, re.I | re.S)
+        if not literal and not looped:
+            return False
+        for name, value, position, neighbour in literal:
+            self.add_enum_value(unquote(name), sqllex.unquote_literal(value),
+                                position.upper() or None,
+                                sqllex.unquote_literal(neighbour) if neighbour else None)
+        if looped:
+            for value in split_list(looped.group(1)):
+                self.add_enum_value(unquote(looped.group(2)), sqllex.unquote_literal(value))
+        return True
+
+    def create_table(self, cursor):
+        if_not_exists = cursor.accept("IF", "NOT", "EXISTS")
+        name = cursor.name()
+        if if_not_exists and name in self.schema.tables:
+            return
+        table = Table(name)
+        for element in split_list(cursor.group()):
+            element_cursor = Cursor(element)
+            if element_cursor.peek() in TABLE_CONSTRAINT_WORDS:
+                add_constraints(table, [parse_table_constraint(element_cursor, name, table.columns)])
+            else:
+                column, constraints = parse_column(element_cursor, name)
+                table.columns[column.name] = column
+                add_constraints(table, constraints)
+        self.schema.tables[name] = table
+
+    def drop_table(self, name):
+        self.schema.tables.pop(name, None)
+        for index in [i for i in self.schema.indexes.values() if i.table == name]:
+            del self.schema.indexes[index.name]
+
+    def alter_table(self, cursor):
+        if_exists = cursor.accept("IF", "EXISTS")
+        cursor.accept("ONLY")
+        name = cursor.name()
+        if name not in self.schema.tables:
+            if if_exists:
+                return
+            raise ParseError("unknown table {}".format(name))
+        table = self.schema.tables[name]
+        if cursor.accept("RENAME", "TO"):
+            new = cursor.name()
+            table.name = new
+            self.schema.tables[new] = self.schema.tables.pop(name)
+            for index in self.schema.indexes.values():
+                if index.table == name:
+                    index.table = new
+            self.journal(Rename("table", None, name, new))
+            return
+        if cursor.accept("RENAME", "CONSTRAINT"):
+            old = cursor.name()
+            cursor.expect("TO")
+            new = cursor.name()
+            constraint = table.constraints.pop(old)
+            constraint.name = new
+            table.constraints[new] = constraint
+            self.journal(Rename("constraint", name, old, new))
+            return
+        if cursor.accept("RENAME"):
+            cursor.accept("COLUMN")
+            old = cursor.name()
+            cursor.expect("TO")
+            self.rename_column(table, old, cursor.name())
+            return
+        while not cursor.at_end():
+            self.alter_table_action(table, cursor)
+            if not cursor.accept(","):
+                break
+        if not cursor.at_end():
+            raise ParseError("unsupported ALTER TABLE clause {!r}".format(cursor.remaining()[:60]))
+
+    def alter_table_action(self, table, cursor):
+        if cursor.accept("ADD"):
+            if cursor.peek() in TABLE_CONSTRAINT_WORDS:
+                add_constraints(table, [parse_table_constraint(cursor, table.name, table.columns)])
+                return
+            cursor.accept("COLUMN")
+            if_not_exists = cursor.accept("IF", "NOT", "EXISTS")
+            column, constraints = parse_column(cursor, table.name)
+            if if_not_exists and column.name in table.columns:
+                return
+            table.columns[column.name] = column
+            add_constraints(table, constraints)
+        elif cursor.accept("DROP", "CONSTRAINT"):
+            cursor.accept("IF", "EXISTS")
+            table.constraints.pop(cursor.name(), None)
+            cursor.accept("CASCADE") or cursor.accept("RESTRICT")
+        elif cursor.accept("DROP"):
+            cursor.accept("COLUMN")
+            cursor.accept("IF", "EXISTS")
+            self.drop_column(table, cursor.name())
+            cursor.accept("CASCADE") or cursor.accept("RESTRICT")
+        elif cursor.accept("ALTER"):
+            cursor.accept("COLUMN")
+            column = table.columns[cursor.name()]
+            if cursor.accept("SET", "DATA", "TYPE") or cursor.accept("TYPE"):
+                column.type = cursor.until({"USING", "COLLATE"})
+                if cursor.accept("USING"):
+                    cursor.until()
+            elif cursor.accept("SET", "DEFAULT"):
+                column.default = cursor.until()
+            elif cursor.accept("DROP", "DEFAULT"):
+                column.default = None
+            elif cursor.accept("SET", "NOT", "NULL"):
+                column.nullable = False
+            elif cursor.accept("DROP", "NOT", "NULL"):
+                column.nullable = True
+            else:
+                raise ParseError("unsupported ALTER COLUMN {!r}".format(cursor.remaining()[:60]))
+        else:
+            raise ParseError("unsupported ALTER TABLE action {!r}".format(cursor.remaining()[:60]))
+
+    def drop_column(self, table, name):
+        if table.columns.pop(name, None) is None:
+            return
+        self.result.dropped.append((self.index, table.name, name))
+        # Postgres drops the constraints and indexes that use the column.
+        for constraint in [c for c in table.constraints.values() if name in c.columns]:
+            del table.constraints[constraint.name]
+        for index in [i for i in self.schema.indexes.values() if i.table == table.name and name in i.columns]:
+            del self.schema.indexes[index.name]
+
+    def rename_column(self, table, old, new):
+        column = table.columns[old]
+        column.name = new
+        table.columns = {(new if key == old else key): value for key, value in table.columns.items()}
+        quoted_old, quoted_new = sqllex.quote_ident(old), sqllex.quote_ident(new)
+        for constraint in table.constraints.values():
+            if old in constraint.columns:
+                constraint.columns = tuple(new if c == old else c for c in constraint.columns)
+                constraint.definition = re.sub(r"(?<![\w\"]){}(?![\w\"])".format(re.escape(quoted_old)), quoted_new, constraint.definition)
+        for index in self.schema.indexes.values():
+            if index.table == table.name and old in index.columns:
+                index.definition = re.sub(r"(?<![\w\"]){}(?![\w\"])".format(re.escape(quoted_old)), quoted_new, index.definition)
+        self.journal(Rename("column", table.name, old, new))
+
+    def create_index(self, cursor):
+        cursor.expect("CREATE")
+        unique = cursor.accept("UNIQUE")
+        cursor.expect("INDEX")
+        cursor.accept("CONCURRENTLY")
+        if_not_exists = cursor.accept("IF", "NOT", "EXISTS")
+        name = cursor.name()
+        cursor.expect("ON")
+        cursor.accept("ONLY")
+        table = cursor.name()
+        if if_not_exists and name in self.schema.indexes:
+            return
+        if table not in self.schema.tables:
+            raise ParseError("index {} on unknown table {}".format(name, table))
+        self.schema.indexes[name] = Index(name, table, unique, cursor.remaining())
+
+    def rename_index(self, old, new):
+        index = self.schema.indexes.pop(old)
+        index.name = new
+        self.schema.indexes[new] = index
+        for table in self.schema.tables.values():
+            if old in table.constraints:
+                constraint = table.constraints.pop(old)
+                constraint.name = new
+                table.constraints[new] = constraint
+        self.journal(Rename("index", None, old, new))
+
+    def journal(self, rename):
+        self.result.journal.append((self.index, rename))
+
+
+def replay(statements, schema=None):
+    """
+    Replay `statements` on `schema` (an empty schema by default).
+    """
+    return Replayer(schema).run(statements)
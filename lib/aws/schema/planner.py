@@ -0,0 +1,376 @@
+"""
+Incremental migration planner between two schema snapshots.
+
+Both snapshots are replayed into the object model and diffed, so the plan only
+touches the objects that differ. When the newer snapshot extends the older one
+(the snapshots in lib/aws/migrations are append-only), the renames and data
+backfills of the appended migrations are carried over as well: renames keep
+the data of renamed columns, and backfills run after every addition and before
+NOT NULL is enforced or anything is dropped.
+
+Steps are ordered by phase:
+
+    enum values      ALTER TYPE ... ADD VALUE, committed before the rest
+    renames          renames recorded by the appended migrations
+    types            new enums, and enums that lost values (recreated)
+    functions        new or changed functions
+    drop indexes     removed or redefined indexes
+    drop constraints removed or redefined constraints
+    recreate         columns the appended migrations drop and add again
+    tables           new tables, without their foreign keys
+    columns          added columns (nullable), type, default and DROP NOT NULL
+    backfill         data statements of the appended migrations
+    not null         SET NOT NULL
+    constraints      new or redefined constraints and all new foreign keys
+    indexes          new or redefined indexes
+    drops            dropped columns, tables and enums (destructive)
+"""
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import List
+
+import model
+import sql as sqllex
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "migrations")
+
+PHASES = [
+    "enum values", "renames", "types", "functions", "drop indexes", "drop constraints", "recreate", "tables",
+    "columns", "backfill", "not null", "constraints", "indexes", "drops",
+]
+
+SERIAL_TYPES = {"smallserial": "smallint", "serial": "integer", "bigserial": "bigint"}
+
+# Suffix for an enum renamed aside while it is recreated without some values.
+RECREATE_SUFFIX = "__replaced"
+
+
+@dataclass
+class Step:
+    phase: str
+    sql: str
+    destructive: bool = False
+
+    @property
+    def transactional(self):
+        # A value added to an enum cannot be used before it is committed.
+        return self.phase != "enum values"
+
+
+@dataclass
+class Plan:
+    source: str
+    target: str
+    steps: List[Step] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    def add(self, phase, text, destructive=False):
+        self.steps.append(Step(phase, text, destructive))
+
+    def ordered(self):
+        return sorted(self.steps, key=lambda step: PHASES.index(step.phase))
+
+    @property
+    def destructive(self):
+        return [step for step in self.steps if step.destructive]
+
+    def render(self):
+        lines = ["-- Migration plan {} -> {}: {} statements".format(self.source, self.target, len(self.steps))]
+        lines.extend("-- WARNING: {}".format(warning) for warning in self.warnings)
+        phase = None
+        for step in self.ordered():
+            if step.phase != phase:
+                phase = step.phase
+                note = " (outside the transaction)" if not step.transactional else ""
+                lines.append("\n-- Phase: {}{}".format(phase, note))
+            if step.destructive:
+                lines.append("-- destructive")
+            lines.append(step.sql.rstrip(";") + ";")
+        return "\n".join(lines) + "\n"
+
+
+class Snapshot:
+    """
+    A schema snapshot: lib/aws/migrations/<version>/schema.sql, or any path.
+    """
+
+    def __init__(self, version, path=None):
+        self.version = version
+        self.path = path or os.path.join(MIGRATIONS_DIR, version, "schema.sql")
+        with open(self.path, encoding="utf-8") as f:
+            self.text = f.read()
+        self.checksum = hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+        self.statements = sqllex.split_files(self.text)
+        self._replay = None
+
+    @classmethod
+    def load(cls, name):
+        if os.path.isfile(name):
+            return cls(os.path.basename(os.path.dirname(os.path.abspath(name))), name)
+        return cls(name)
+
+    @property
+    def replay(self):
+        if self._replay is None:
+            self._replay = model.replay(self.statements)
+        return self._replay
+
+    def extends(self, other):
+        """
+        Whether this snapshot is `other` followed by more migrations.
+        """
+        if len(self.statements) < len(other.statements):
+            return False
+        return all(a.sql == b.sql for a, b in zip(self.statements, other.statements))
+
+
+def versions():
+    return sorted(
+        (name for name in os.listdir(MIGRATIONS_DIR) if os.path.isfile(os.path.join(MIGRATIONS_DIR, name, "schema.sql"))),
+        key=lambda name: [int(part) if part.isdigit() else part for part in name.lstrip("v").split(".")],
+    )
+
+
+def q(name):
+    return sqllex.quote_ident(name)
+
+
+def column_sql(column, nullable=None):
+    nullable = column.nullable if nullable is None else nullable
+    parts = [q(column.name), column.type]
+    if column.default is not None:
+        parts.append("DEFAULT {}".format(column.default))
+    if not nullable:
+        parts.append("NOT NULL")
+    return " ".join(parts)
+
+
+def cast_sql(column_name, type_text):
+    """
+    USING expression converting a column to `type_text`, going through text so
+    that enum and string conversions work both ways.
+    """
+    if type_text.endswith("[]"):
+        return "{}::text[]::{}".format(q(column_name), type_text)
+    return "{}::text::{}".format(q(column_name), type_text)
+
+
+def rename_sql(rename):
+    if rename.kind == "column":
+        return "ALTER TABLE {} RENAME COLUMN {} TO {}".format(q(rename.table), q(rename.old), q(rename.new))
+    if rename.kind == "table":
+        return "ALTER TABLE {} RENAME TO {}".format(q(rename.old), q(rename.new))
+    if rename.kind == "constraint":
+        return "ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(q(rename.table), q(rename.old), q(rename.new))
+    if rename.kind == "index":
+        return "ALTER INDEX {} RENAME TO {}".format(q(rename.old), q(rename.new))
+    if rename.kind == "type":
+        return "ALTER TYPE {} RENAME TO {}".format(q(rename.old), q(rename.new))
+    return "ALTER TYPE {} RENAME VALUE {} TO {}".format(
+        q(rename.table), sqllex.quote_literal(rename.old), sqllex.quote_literal(rename.new))
+
+
+def is_subsequence(old, new):
+    remaining = iter(new)
+    return all(value in remaining for value in old)
+
+
+class Differ:
+    def __init__(self, old, new, plan):
+        self.old = old
+        self.new = new
+        self.plan = plan
+
+    def run(self):
+        self.enums()
+        self.functions()
+        self.tables()
+        self.indexes()
+
+    def enums(self):
+        for name, values in self.new.enums.items():
+            old_values = self.old.enums.get(name)
+            if old_values is None:
+                self.plan.add("types", "CREATE TYPE {} AS ENUM ({})".format(
+                    q(name), ", ".join(sqllex.quote_literal(v) for v in values)))
+            elif is_subsequence(old_values, values):
+                for position, value in enumerate(values):
+                    if value in old_values:
+                        continue
+                    anchor = "AFTER {}".format(sqllex.quote_literal(values[position - 1])) if position else \
+                        "BEFORE {}".format(sqllex.quote_literal(values[1])) if len(values) > 1 else ""
+                    self.plan.add("enum values", "ALTER TYPE {} ADD VALUE IF NOT EXISTS {} {}".format(
+                        q(name), sqllex.quote_literal(value), anchor).strip())
+            elif old_values != values:
+                self.recreate_enum(name, values)
+
+        for name in self.old.enums:
+            if name not in self.new.enums:
+                self.plan.add("drops", "DROP TYPE IF EXISTS {}".format(q(name)), destructive=True)
+
+    def recreate_enum(self, name, values):
+        """
+        Postgres cannot drop or reorder enum values: build the new type and
+        convert the columns using it. Rows holding a removed value fail the
+        conversion instead of being altered silently.
+        """
+        aside = name + RECREATE_SUFFIX
+        self.plan.add("types", "ALTER TYPE {} RENAME TO {}".format(q(name), q(aside)), destructive=True)
+        self.plan.add("types", "CREATE TYPE {} AS ENUM ({})".format(
+            q(name), ", ".join(sqllex.quote_literal(v) for v in values)))
+        for table_name, column in self.old.columns_of_type(name):
+            if table_name not in self.new.tables or column.name not in self.new.tables[table_name].columns:
+                continue
+            table = q(table_name)
+            if column.default is not None:
+                self.plan.add("types", "ALTER TABLE {} ALTER COLUMN {} DROP DEFAULT".format(table, q(column.name)))
+            self.plan.add("types", "ALTER TABLE {} ALTER COLUMN {} TYPE {} USING {}".format(
+                table, q(column.name), column.type, cast_sql(column.name, column.type)))
+            if column.default is not None:
+                self.plan.add("types", "ALTER TABLE {} ALTER COLUMN {} SET DEFAULT {}".format(
+                    table, q(column.name), column.default))
+        self.plan.add("types", "DROP TYPE {}".format(q(aside)), destructive=True)
+
+    def functions(self):
+        for name, text in self.new.functions.items():
+            if model.normalize_expr(self.old.functions.get(name, "")) != model.normalize_expr(text):
+                self.plan.add("functions", text)
+        for name in self.old.functions:
+            if name not in self.new.functions:
+                self.plan.warnings.append("function {} was removed from the snapshot; drop it by hand".format(name))
+
+    def tables(self):
+        for name, table in self.new.tables.items():
+            old_table = self.old.tables.get(name)
+            if old_table is None:
+                self.create_table(table)
+            else:
+                self.alter_table(old_table, table)
+        for name in self.old.tables:
+            if name not in self.new.tables:
+                self.plan.add("drops", "DROP TABLE IF EXISTS {}".format(q(name)), destructive=True)
+
+    def create_table(self, table):
+        elements = [column_sql(column) for column in table.columns.values()]
+        for constraint in table.constraints.values():
+            if constraint.kind == "f":
+                self.add_constraint(table.name, constraint)
+            else:
+                elements.append("CONSTRAINT {} {}".format(q(constraint.name), constraint.definition))
+        self.plan.add("tables", "CREATE TABLE IF NOT EXISTS {} (\n    {}\n)".format(
+            q(table.name), ",\n    ".join(elements)))
+
+    def add_constraint(self, table_name, constraint):
+        self.plan.add("constraints", "ALTER TABLE {} ADD CONSTRAINT {} {}".format(
+            q(table_name), q(constraint.name), constraint.definition))
+
+    def alter_table(self, old, new):
+        table = q(new.name)
+        for name, constraint in old.constraints.items():
+            current = new.constraints.get(name)
+            if current is None or current.key != constraint.key:
+                self.plan.add("drop constraints", "ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}".format(table, q(name)))
+
+        for name, column in new.columns.items():
+            old_column = old.columns.get(name)
+            if old_column is None:
+                # Without a default, NOT NULL can only hold once backfilled.
+                immediate = column.nullable or column.default is not None
+                self.plan.add("columns", "ALTER TABLE {} ADD COLUMN IF NOT EXISTS {}".format(
+                    table, column_sql(column, nullable=column.nullable if immediate else True)))
+                if not immediate:
+                    self.plan.add("not null", "ALTER TABLE {} ALTER COLUMN {} SET NOT NULL".format(table, q(name)))
+                continue
+            if old_column.type_key != column.type_key and self.alter_type(new.name, old_column, column):
+                continue
+            if old_column.default_key != column.default_key:
+                if column.default is None:
+                    self.plan.add("columns", "ALTER TABLE {} ALTER COLUMN {} DROP DEFAULT".format(table, q(name)))
+                else:
+                    self.plan.add("columns", "ALTER TABLE {} ALTER COLUMN {} SET DEFAULT {}".format(
+                        table, q(name), column.default))
+            if old_column.nullable and not column.nullable:
+                self.plan.add("not null", "ALTER TABLE {} ALTER COLUMN {} SET NOT NULL".format(table, q(name)))
+            elif not old_column.nullable and column.nullable:
+                self.plan.add("columns", "ALTER TABLE {} ALTER COLUMN {} DROP NOT NULL".format(table, q(name)))
+
+        for name in old.columns:
+            if name not in new.columns:
+                self.plan.add("drops", "ALTER TABLE {} DROP COLUMN IF EXISTS {}".format(table, q(name)), destructive=True)
+
+        for name, constraint in new.constraints.items():
+            previous = old.constraints.get(name)
+            if previous is None or previous.key != constraint.key:
+                self.add_constraint(new.name, constraint)
+
+    def alter_type(self, table_name, old, new):
+        table = q(table_name)
+        if new.type_key in SERIAL_TYPES:
+            # Only ADD COLUMN creates the sequence behind a serial column.
+            self.plan.add("recreate", "ALTER TABLE {} DROP COLUMN IF EXISTS {}".format(table, q(new.name)), destructive=True)
+            self.plan.add("columns", "ALTER TABLE {} ADD COLUMN {}".format(table, column_sql(new)))
+            return True
+        if old.type_key in SERIAL_TYPES and new.default is None:
+            # The sequence default of a serial column does not follow the type.
+            self.plan.add("columns", "ALTER TABLE {} ALTER COLUMN {} DROP DEFAULT".format(table, q(new.name)))
+        self.plan.add("columns", "ALTER TABLE {} ALTER COLUMN {} TYPE {} USING {}".format(
+            table, q(new.name), new.type, cast_sql(new.name, new.type)))
+        return False
+
+    def indexes(self):
+        for name, index in self.old.indexes.items():
+            current = self.new.indexes.get(name)
+            if index.table in self.new.tables and (current is None or current.key != index.key):
+                self.plan.add("drop indexes", "DROP INDEX IF EXISTS {}".format(q(name)))
+        for name, index in self.new.indexes.items():
+            previous = self.old.indexes.get(name)
+            if previous is None or previous.key != index.key:
+                self.plan.add("indexes", "CREATE {}INDEX IF NOT EXISTS {} ON {} {}".format(
+                    "UNIQUE " if index.unique else "", q(name), q(index.table), index.definition))
+
+
+def plan(source, target):
+    """
+    The ordered DDL taking a database at snapshot `source` to `target`.
+    """
+    result = Plan(source.version, target.version)
+    old = source.replay
+    new = target.replay
+    for statement, error in target.replay.unmodelled:
+        result.warnings.append("line {} of {} is not modelled ({}): {}".format(
+            statement.line, target.version, error, statement.sql.splitlines()[0][:80]))
+
+    working = old.schema.copy()
+    if target.extends(source):
+        appended = len(source.statements)
+        replayer = model.Replayer(working)
+        for index, rename in new.journal:
+            if index < appended:
+                continue
+            try:
+                replayer.statement(index, rename_sql(rename))
+            except (model.ParseError, KeyError, ValueError):
+                # Renames of objects created by the appended migrations
+                # themselves are covered by the diff.
+                continue
+            result.add("renames", rename_sql(rename))
+        # A column dropped and added again by the appended migrations is a new
+        # column, not a conversion of the old one.
+        for index, table, column in new.dropped:
+            if index < appended or table not in working.tables or column not in working.tables[table].columns:
+                continue
+            if table in new.schema.tables and column in new.schema.tables[table].columns:
+                replayer.drop_column(working.tables[table], column)
+                result.add("recreate", "ALTER TABLE {} DROP COLUMN IF EXISTS {}".format(q(table), q(column)),
+                           destructive=True)
+        for index, statement in new.data:
+            if index >= appended:
+                result.add("backfill", statement.sql)
+    else:
+        result.warnings.append(
+            "{} does not extend {}: renames are planned as drop and add, and no backfills are carried over".format(
+                target.version, source.version))
+
+    Differ(working, new.schema, result).run()
+    return result
@@ -0,0 +1,614 @@
+"""
+Fill a database with synthetic payment data, for sizing instances and indexes.
+
+    python3 lib/aws/schema/seed.py --to v1.116.0 --merchants 50 --intents 5000000 [--dsn ...]
+    python3 lib/aws/schema/seed.py --to v1.116.0 --intents 100000 --output /tmp/seed
+    python3 lib/aws/schema/seed.py --to v1.116.0 --intents 0 --cards 1000000 --locker-dsn ...
+
+The columns come from the replayed snapshot, so the rows fit the version the
+database was bootstrapped with (bootstrap.py). Every row is consistent with
+the others: intents belong to merchants and profiles, attempts to intents
+(the active attempt is the last one), refunds to succeeded attempts, and
+locker cards to locker merchants and card hashes. Merchants get Zipf-skewed
+traffic, amounts are log-normal and created_at grows with the payment number,
+as in a table filled over time. Columns the generator does not know are left
+to their defaults when nullable or defaulted, and otherwise get a filler
+value of their type.
+
+Payments are generated in chunks by a pool of processes. Each chunk is
+encoded as COPY binary, or CSV for tables with a column type the binary
+encoder does not cover, and streamed on the worker's own connection. With
+--output the chunks are written to files instead, for `psql \\copy`.
+--defer-indexes drops the secondary indexes of the loaded tables before the
+load and rebuilds them afterwards, timing each build.
+
+The data is only meant for sizing and benchmarks (bench.py): keys and
+ciphertexts are random, so the router and the locker cannot use it.
+"""
+import argparse
+import bisect
+import datetime
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import struct
+import time
+import uuid
+
+import migrate
+import model
+import planner
+import sql as sqllex
+
+LOCKER_SCHEMA = os.path.join(planner.MIGRATIONS_DIR, "locker-schema.sql")
+
+DEFAULT_CHUNK = 50000
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER = struct.pack(">h", -1)
+
+MERCHANT_TABLES = ["organization", "merchant_account", "merchant_key_store", "business_profile", "customers"]
+PAYMENT_TABLES = ["payment_intent", "payment_attempt", "refund"]
+LOCKER_TABLES = ["merchant", "hash_table", "locker"]
+
+TYPE_KINDS = {
+    "smallint": "int2", "integer": "int4", "serial": "int4", "bigint": "int8", "bigserial": "int8",
+    "boolean": "bool", "varchar": "text", "text": "text", "char": "text", "timestamp": "timestamp",
+    "timestamptz": "timestamp", "date": "date", "bytea": "bytea", "json": "json", "jsonb": "jsonb",
+    "double precision": "float8", "real": "float4", "numeric": "numeric", "uuid": "uuid",
+}
+BINARY_ENCODERS = {
+    "int2": struct.Struct(">h").pack,
+    "int4": struct.Struct(">i").pack,
+    "int8": struct.Struct(">q").pack,
+    "float4": struct.Struct(">f").pack,
+    "float8": struct.Struct(">d").pack,
+    "bool": lambda v: b"\x01" if v else b"\x00",
+    "text": lambda v: v.encode("utf-8"),
+    "enum": lambda v: v.encode("utf-8"),
+    "timestamp": lambda v: struct.pack(">q", (v - PG_EPOCH) // datetime.timedelta(microseconds=1)),
+    "date": lambda v: struct.pack(">i", (v - PG_EPOCH.date()).days),
+    "bytea": bytes,
+    "json": lambda v: json.dumps(v, separators=(",", ":")).encode("utf-8"),
+    "jsonb": lambda v: b"\x01" + json.dumps(v, separators=(",", ":")).encode("utf-8"),
+    "uuid": lambda v: uuid.UUID(v).bytes,
+}
+LENGTH = struct.Struct(">i").pack
+FIELDS = struct.Struct(">h").pack
+
+# Weighted choices; labels missing from the snapshot's enum are skipped.
+INTENT_STATUSES = [
+    ("succeeded", 70), ("failed", 12), ("requires_payment_method", 8), ("cancelled", 3),
+    ("processing", 2), ("requires_capture", 3), ("requires_customer_action", 2),
+]
+ATTEMPT_STATUSES = {
+    "succeeded": "charged", "failed": "failure", "requires_payment_method": "failure", "cancelled": "voided",
+    "processing": "pending", "requires_capture": "authorized", "requires_customer_action": "authentication_pending",
+}
+REFUND_STATUSES = [("success", 88), ("failure", 5), ("pending", 5), ("manual_review", 2)]
+CURRENCIES = [("USD", 45), ("EUR", 20), ("INR", 15), ("GBP", 10), ("SGD", 5), ("BRL", 5)]
+CONNECTORS = [("stripe", 40), ("adyen", 25), ("checkout", 15), ("cybersource", 10), ("paypal", 10)]
+PAYMENT_METHODS = [
+    (("card", "credit"), 45), (("card", "debit"), 30), (("wallet", "google_pay"), 10),
+    (("wallet", "apple_pay"), 8), (("bank_redirect", "ideal"), 4), (("pay_later", "klarna"), 3),
+]
+CARD_NETWORKS = [("Visa", 55), ("Mastercard", 35), ("AmericanExpress", 7), ("Discover", 3)]
+ERRORS = [("card_declined", "Your card was declined."), ("insufficient_funds", "Insufficient funds."),
+          ("expired_card", "Your card has expired."), ("processing_error", "An error occurred while processing.")]
+
+
+class Choice:
+    def __init__(self, weighted):
+        self.values = [value for value, weight in weighted]
+        self.cumulative = []
+        total = 0
+        for value, weight in weighted:
+            total += weight
+            self.cumulative.append(total)
+
+    def pick(self, rng):
+        return self.values[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+def kind_of(type_key, enums):
+    if type_key.endswith("[]"):
+        return "array"
+    if model.unquote(type_key) in enums:
+        return "enum"
+    return TYPE_KINDS.get(re.sub(r"\(.*\)", "", type_key).strip(), "other")
+
+
+def quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def csv_value(kind, value):
+    if value is None:
+        return ""
+    if kind in ("text", "enum", "uuid"):
+        return quote(value)
+    if kind == "bool":
+        return "t" if value else "f"
+    if kind == "timestamp":
+        return value.isoformat(" ")
+    if kind == "date":
+        return value.isoformat()
+    if kind == "bytea":
+        return "\\x" + value.hex()
+    if kind in ("json", "jsonb"):
+        return quote(json.dumps(value, separators=(",", ":")))
+    if kind == "array":
+        return quote("{" + ",".join('"{}"'.format(str(v).replace("\\", "\\\\").replace('"', '\\"')) for v in value) + "}")
+    return str(value)
+
+
+def filler(column, kind, enums):
+    """
+    A value for a NOT NULL column without a default that the generator does
+    not fill itself.
+    """
+    if kind == "text":
+        length = re.search(r"\((\d+)\)", column.type)
+        return column.name[:int(length.group(1))] if length else column.name
+    if kind == "enum":
+        return enums[model.unquote(column.type_key)][0]
+    fillers = {
+        "int2": 0, "int4": 0, "int8": 0, "float4": 0.0, "float8": 0.0, "numeric": 0, "bool": False,
+        "timestamp": PG_EPOCH, "date": PG_EPOCH.date(), "bytea": b"", "json": {}, "jsonb": {}, "array": [],
+        "uuid": "00000000-0000-0000-0000-000000000000",
+    }
+    if kind not in fillers:
+        raise SystemExit("{} {} is NOT NULL without a default and cannot be generated".format(column.name, column.type))
+    return fillers[kind]
+
+
+class Layout:
+    """
+    The COPY columns of a table and their encoders: the columns the
+    generator fills, plus the NOT NULL columns without a default.
+    """
+
+    def __init__(self, table, enums, generated, binary):
+        self.table = table.name
+        self.columns = [
+            column for column in table.columns.values()
+            if column.name in generated or (not column.nullable and column.default is None)
+        ]
+        self.kinds = [kind_of(column.type_key, enums) for column in self.columns]
+        self.fillers = [
+            filler(column, kind, enums) if not column.nullable else None
+            for column, kind in zip(self.columns, self.kinds)
+        ]
+        self.labels = [
+            set(enums[model.unquote(column.type_key)]) if kind == "enum" else None
+            for column, kind in zip(self.columns, self.kinds)
+        ]
+        self.binary = binary and all(kind in BINARY_ENCODERS for kind in self.kinds)
+        self.names = [column.name for column in self.columns]
+        self.encoders = [BINARY_ENCODERS.get(kind) for kind in self.kinds]
+
+    @property
+    def copy_sql(self):
+        return "COPY {} ({}) FROM STDIN WITH (FORMAT {})".format(
+            planner.q(self.table), ", ".join(planner.q(name) for name in self.names), "binary" if self.binary else "csv")
+
+    @property
+    def suffix(self):
+        return "bin" if self.binary else "csv"
+
+    def values(self, row):
+        for name, fill, labels in zip(self.names, self.fillers, self.labels):
+            value = row.get(name, fill)
+            if labels is not None and value is not None and value not in labels:
+                value = fill
+            yield value
+
+    def encode(self, rows):
+        """
+        `rows` (dicts) as one self-contained COPY payload.
+        """
+        buffer = io.BytesIO()
+        write = buffer.write
+        if self.binary:
+            write(BINARY_HEADER)
+            count = FIELDS(len(self.names))
+            null = LENGTH(-1)
+            for row in rows:
+                fields = [count]
+                for encoder, value in zip(self.encoders, self.values(row)):
+                    if value is None:
+                        fields.append(null)
+                    else:
+                        data = encoder(value)
+                        fields.append(LENGTH(len(data)))
+                        fields.append(data)
+                write(b"".join(fields))
+            write(BINARY_TRAILER)
+        else:
+            for row in rows:
+                line = ",".join(csv_value(kind, value) for kind, value in zip(self.kinds, self.values(row)))
+                write(line.encode("utf-8"))
+                write(b"\n")
+        buffer.seek(0)
+        return buffer
+
+
+class Dataset:
+    """
+    Deterministic synthetic data: the same seed and sizes give the same rows,
+    whichever worker generates a chunk.
+    """
+
+    def __init__(self, seed, merchants, intents, cards, customers, days, refund_rate, chunk, end):
+        self.seed = seed
+        self.merchants = merchants
+        self.intents = intents
+        self.cards = cards
+        self.customers = customers
+        self.refund_rate = refund_rate
+        self.chunk = chunk
+        self.end = end
+        self.start = end - datetime.timedelta(days=days)
+        self.span = (self.end - self.start).total_seconds()
+        self.merchant_choice = Choice([(m, 1.0 / (m + 1) ** 1.1) for m in range(merchants)])
+        self.intent_statuses = Choice(INTENT_STATUSES)
+        self.refund_statuses = Choice(REFUND_STATUSES)
+        self.currencies = Choice(CURRENCIES)
+        self.connectors = Choice(CONNECTORS)
+        self.payment_methods = Choice(PAYMENT_METHODS)
+        self.card_networks = Choice(CARD_NETWORKS)
+
+    def token(self, prefix, *parts):
+        digest = hashlib.blake2b(repr((self.seed, prefix) + parts).encode(), digest_size=12).hexdigest()
+        return "{}_{}".format(prefix, digest)
+
+    def merchant_id(self, m):
+        return "merchant_{}_{}".format(self.seed, m)
+
+    def profile_id(self, m):
+        return "pro_{}_{}".format(self.seed, m)
+
+    def organization_id(self, m):
+        return "org_{}_{}".format(self.seed, m // 10)
+
+    def customer_id(self, m, c):
+        return "cus_{}_{}_{}".format(self.seed, m, c)
+
+    def chunks(self, total):
+        return [(lo, min(lo + self.chunk, total)) for lo in range(0, total, self.chunk)]
+
+    def merchant_rows(self):
+        rng = random.Random(self.seed)
+        rows = {table: [] for table in MERCHANT_TABLES}
+        for m in range(self.merchants):
+            merchant_id = self.merchant_id(m)
+            created = self.start - datetime.timedelta(days=rng.randint(1, 365))
+            if m % 10 == 0:
+                rows["organization"].append({
+                    "org_id": self.organization_id(m), "org_name": "Organization {}".format(m // 10),
+                    "organization_name": "Organization {}".format(m // 10), "created_at": created, "modified_at": created,
+                })
+            rows["merchant_account"].append({
+                "merchant_id": merchant_id, "primary_business_details": [{"country": "US", "business": "default"}],
+                "publishable_key": self.token("pk_snd", "pk", m), "created_at": created, "modified_at": created,
+                "organization_id": self.organization_id(m), "default_profile": self.profile_id(m),
+                "sub_merchants_enabled": False, "locker_id": "m0010",
+            })
+            rows["merchant_key_store"].append({
+                "merchant_id": merchant_id, "key": rng.getrandbits(256).to_bytes(32, "big"), "created_at": created,
+            })
+            rows["business_profile"].append({
+                "profile_id": self.profile_id(m), "merchant_id": merchant_id, "profile_name": "default",
+                "created_at": created, "modified_at": created, "return_url": "https://example.com/return",
+            })
+            for c in range(self.customers):
+                rows["customers"].append({
+                    "customer_id": self.customer_id(m, c), "merchant_id": merchant_id,
+                    "email": b"synthetic", "created_at": created, "modified_at": created,
+                })
+        return rows
+
+    def payment_rows(self, lo, hi):
+        rng = random.Random("{}:{}".format(self.seed, lo))
+        rows = {table: [] for table in PAYMENT_TABLES}
+        intents, attempts, refunds = rows["payment_intent"], rows["payment_attempt"], rows["refund"]
+        for n in range(lo, hi):
+            m = self.merchant_choice.pick(rng)
+            merchant_id = self.merchant_id(m)
+            created = self.start + datetime.timedelta(seconds=self.span * (n + rng.random()) / max(self.intents, 1))
+            status = self.intent_statuses.pick(rng)
+            amount = int(rng.lognormvariate(8.5, 1.2)) + 100
+            currency = self.currencies.pick(rng)
+            customer_id = self.customer_id(m, rng.randrange(self.customers)) if self.customers and rng.random() < 0.7 else None
+            payment_id = self.token("pay", n)
+            count = 1 if rng.random() < 0.8 else 2 if rng.random() < 0.75 else 3
+            common = {
+                "merchant_id": merchant_id, "payment_id": payment_id, "amount": amount, "currency": currency,
+                "profile_id": self.profile_id(m), "organization_id": self.organization_id(m),
+                "capture_method": "automatic", "authentication_type": "no_three_ds",
+            }
+
+            modified = created
+            for a in range(count):
+                last = a == count - 1
+                attempt_status = ATTEMPT_STATUSES[status] if last else "failure"
+                method, method_type = self.payment_methods.pick(rng)
+                connector = self.connectors.pick(rng)
+                modified = created + datetime.timedelta(seconds=a * 30 + rng.randint(1, 20))
+                attempt = dict(
+                    common, attempt_id="{}_{}".format(payment_id, a + 1), status=attempt_status, connector=connector,
+                    payment_method=method, payment_method_type=method_type, confirm=True,
+                    connector_transaction_id=self.token("txn", n, a) if attempt_status != "failure" or rng.random() < 0.5 else None,
+                    merchant_connector_id=self.token("mca", m, connector), net_amount=amount,
+                    amount_capturable=amount if attempt_status == "authorized" else 0,
+                    created_at=created + datetime.timedelta(seconds=a * 30), modified_at=modified, last_synced=modified,
+                )
+                if method == "card":
+                    network = self.card_networks.pick(rng)
+                    attempt["card_network"] = network
+                    attempt["payment_method_data"] = {"card": {
+                        "last4": "{:04d}".format(rng.randrange(10000)), "card_network": network,
+                        "card_exp_month": "{:02d}".format(rng.randint(1, 12)), "card_exp_year": str(rng.randint(2026, 2032)),
+                    }}
+                if attempt_status == "failure":
+                    attempt["error_code"], attempt["error_message"] = rng.choice(ERRORS)
+                attempts.append(attempt)
+
+            succeeded = status == "succeeded"
+            intents.append(dict(
+                common, status=status, amount_captured=amount if succeeded else None, customer_id=customer_id,
+                client_secret="{}_secret_{}".format(payment_id, self.token("cs", n)[3:]),
+                active_attempt_id=attempts[-1]["attempt_id"], attempt_count=count, business_country="US",
+                return_url="https://example.com/return", metadata={"order": n},
+                created_at=created, modified_at=modified, last_synced=modified,
+            ))
+
+            if succeeded and rng.random() < self.refund_rate:
+                refunded = amount if rng.random() < 0.7 else rng.randint(1, amount)
+                refund_at = modified + datetime.timedelta(hours=rng.randint(1, 72))
+                attempt = attempts[-1]
+                refunds.append(dict(
+                    common, refund_id=self.token("ref", n), internal_reference_id=self.token("refid", n),
+                    attempt_id=attempt["attempt_id"], connector=attempt["connector"],
+                    connector_transaction_id=attempt["connector_transaction_id"] or self.token("txn", n, count - 1),
+                    connector_refund_id=self.token("re", n), refund_type="instant_refund", total_amount=amount,
+                    refund_amount=refunded, refund_status=self.refund_statuses.pick(rng), sent_to_gateway=True,
+                    created_at=refund_at, modified_at=refund_at,
+                ))
+        return rows
+
+    def locker_merchant_rows(self):
+        rng = random.Random(self.seed)
+        return {"merchant": [
+            {"tenant_id": "public", "merchant_id": self.merchant_id(m),
+             "enc_key": rng.getrandbits(256).to_bytes(32, "big"), "created_at": self.start}
+            for m in range(self.merchants)
+        ]}
+
+    def card_rows(self, lo, hi):
+        """
+        Locker entries; one card in twenty is stored again for another
+        customer and shares the hash of an earlier card.
+        """
+        rng = random.Random("cards:{}:{}".format(self.seed, lo))
+        rows = {"hash_table": [], "locker": []}
+        for n in range(lo, hi):
+            m = self.merchant_choice.pick(rng)
+            card = rng.randrange(n) if n and rng.random() < 0.05 else n
+            hash_id = self.token("hash", card)
+            created = self.start + datetime.timedelta(seconds=self.span * (n + rng.random()) / max(self.cards, 1))
+            if card == n:
+                rows["hash_table"].append({
+                    "hash_id": hash_id, "created_at": created,
+                    "data_hash": hashlib.blake2b(repr((self.seed, card)).encode(), digest_size=32).digest(),
+                })
+            rows["locker"].append({
+                "locker_id": self.token("loc", n), "tenant_id": "public", "merchant_id": self.merchant_id(m),
+                "customer_id": self.customer_id(m, rng.randrange(max(self.customers, 1))),
+                "enc_data": rng.getrandbits(8 * 320).to_bytes(320, "big"), "hash_id": hash_id, "created_at": created,
+            })
+        return rows
+
+
+def layouts(schema, tables, sample, binary):
+    """
+    Layouts of `tables` that exist in `schema`, with the generated columns
+    taken from `sample` rows.
+    """
+    result = {}
+    for name in tables:
+        table = schema.tables.get(name)
+        if table is None:
+            print("{} is not in the schema, skipped".format(name))
+            continue
+        generated = set()
+        for row in sample.get(name, []):
+            generated.update(row)
+        result[name] = Layout(table, schema.enums, generated, binary)
+    return result
+
+
+class Sink:
+    """
+    Where encoded chunks go: a COPY on a database connection, or files.
+    """
+
+    def __init__(self, dsn, output):
+        self.output = output
+        self.conn = None
+        if output is None:
+            self.conn = migrate.connect(dsn)
+            self.conn.autocommit = True
+
+    def write(self, layout, payload, part):
+        size = len(payload.getbuffer())
+        if self.conn is None:
+            path = os.path.join(self.output, "{}.{:05d}.{}".format(layout.table, part, layout.suffix))
+            with open(path, "wb") as f:
+                f.write(payload.getbuffer())
+        else:
+            self.conn.cursor().copy_expert(layout.copy_sql, payload)
+        return size
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+# State of a worker process, set up once by `init_worker`.
+_worker = {}
+
+
+def init_worker(dataset, table_layouts, dsn, output):
+    _worker.update(dataset=dataset, layouts=table_layouts, sink=Sink(dsn, output))
+
+
+def load_chunk(job):
+    kind, lo, hi = job
+    dataset, sink = _worker["dataset"], _worker["sink"]
+    rows = dataset.payment_rows(lo, hi) if kind == "payments" else dataset.card_rows(lo, hi)
+    counts = {}
+    for name, table_rows in rows.items():
+        layout = _worker["layouts"].get(name)
+        if layout is None or not table_rows:
+            continue
+        size = sink.write(layout, layout.encode(table_rows), lo // dataset.chunk)
+        counts[name] = (len(table_rows), size)
+    return counts
+
+
+def secondary_indexes(schema, tables):
+    return [index for index in schema.indexes.values() if index.table in tables]
+
+
+def defer_indexes(dsn, indexes):
+    conn = migrate.connect(dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for index in indexes:
+        cursor.execute("DROP INDEX IF EXISTS {}".format(planner.q(index.name)))
+    conn.close()
+
+
+def rebuild_indexes(dsn, indexes):
+    conn = migrate.connect(dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for index in indexes:
+        started = time.monotonic()
+        cursor.execute("CREATE {}INDEX IF NOT EXISTS {} ON {} {}".format(
+            "UNIQUE " if index.unique else "", planner.q(index.name), planner.q(index.table), index.definition))
+        print("  index {:<60} {:8.2f}s".format(index.name, time.monotonic() - started))
+    conn.close()
+
+
+def analyze(dsn, tables):
+    conn = migrate.connect(dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for table in tables:
+        cursor.execute("ANALYZE {}".format(planner.q(table)))
+    conn.close()
+
+
+def load(schema, dataset, prefix_rows, tables, jobs, dsn, args):
+    """
+    COPY the `prefix_rows` from this process, then the generated chunks
+    from the worker pool. Returns rows and bytes per table.
+    """
+    sample = dict(prefix_rows)
+    if jobs:
+        kind, lo, _ = jobs[0]
+        first = dataset.payment_rows(lo, min(lo + 1000, dataset.intents)) if kind == "payments" \
+            else dataset.card_rows(lo, min(lo + 1000, dataset.cards))
+        sample.update(first)
+    table_layouts = layouts(schema, tables, sample, args.format == "binary")
+    for layout in table_layouts.values():
+        if not layout.binary and args.format == "binary":
+            print("{} has columns without a binary encoder, loaded as CSV".format(layout.table))
+
+    indexes = secondary_indexes(schema, table_layouts) if args.defer_indexes and not args.output else []
+    if indexes:
+        defer_indexes(dsn, indexes)
+
+    totals = {}
+    sink = Sink(dsn, args.output)
+    try:
+        for name, rows in prefix_rows.items():
+            if name in table_layouts and rows:
+                size = sink.write(table_layouts[name], table_layouts[name].encode(rows), 0)
+                totals[name] = (len(rows), size)
+    finally:
+        sink.close()
+
+    done = 0
+    started = time.monotonic()
+    with multiprocessing.Pool(args.workers, init_worker, (dataset, table_layouts, dsn, args.output)) as pool:
+        for counts in pool.imap_unordered(load_chunk, jobs):
+            for name, (rows, size) in counts.items():
+                count, total = totals.get(name, (0, 0))
+                totals[name] = (count + rows, total + size)
+            done += 1
+            if done % max(1, len(jobs) // 10) == 0 or done == len(jobs):
+                print("  {}/{} chunks, {:.0f}s".format(done, len(jobs), time.monotonic() - started))
+
+    if indexes:
+        rebuild_indexes(dsn, indexes)
+    if not args.output:
+        analyze(dsn, table_layouts)
+    return totals
+
+
+def summary(totals, elapsed):
+    rows = sum(count for count, size in totals.values())
+    for name, (count, size) in totals.items():
+        print("{:<24} {:>12,} rows {:>10.1f} MB".format(name, count, size / 1048576))
+    print("{:,} rows in {:.1f}s ({:,.0f} rows/min)".format(rows, elapsed, rows / max(elapsed, 1e-9) * 60))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--to", required=True, help="snapshot version or schema.sql path the database was created from")
+    parser.add_argument("--dsn", help="router database (default: DATABASE_URL)")
+    parser.add_argument("--locker-dsn", help="locker database, for --cards")
+    parser.add_argument("--output", help="write COPY files to this directory instead of loading them")
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--customers", type=int, default=1000, help="customers per merchant")
+    parser.add_argument("--intents", type=int, default=1000000, help="payment intents; attempts and refunds follow")
+    parser.add_argument("--cards", type=int, default=0, help="locker cards")
+    parser.add_argument("--days", type=int, default=90, help="period the payments are spread over")
+    parser.add_argument("--refund-rate", type=float, default=0.1, help="share of succeeded payments refunded")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--format", choices=["binary", "csv"], default="binary")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="payments per COPY")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--defer-indexes", action="store_true", help="rebuild secondary indexes after the load")
+    args = parser.parse_args(argv)
+    if args.cards and not (args.locker_dsn or args.output):
+        parser.error("--cards needs --locker-dsn or --output")
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    end = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    dataset = Dataset(args.seed, args.merchants, args.intents, args.cards, args.customers, args.days,
+                      args.refund_rate, args.chunk, end)
+    started = time.monotonic()
+    totals = {}
+    if args.intents or not args.cards:
+        schema = planner.Snapshot.load(args.to).replay.schema
+        jobs = [("payments", lo, hi) for lo, hi in dataset.chunks(args.intents)]
+        totals.update(load(schema, dataset, dataset.merchant_rows(), MERCHANT_TABLES + PAYMENT_TABLES, jobs, args.dsn, args))
+    if args.cards:
+        with open(LOCKER_SCHEMA, encoding="utf-8") as f:
+            schema = model.replay(sqllex.split_statements(f.read(), LOCKER_SCHEMA)).schema
+        jobs = [("cards", lo, hi) for lo, hi in dataset.chunks(args.cards)]
+        totals.update(load(schema, dataset, dataset.locker_merchant_rows(), LOCKER_TABLES, jobs, args.locker_dsn, args))
+    summary(totals, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Lexical helpers for the schema snapshots in lib/aws/migrations.
+
+The snapshots are concatenated Diesel `up.sql` files, so a script is split on
+top-level semicolons only: quoted identifiers, string literals (including
+E'' escapes), comments and dollar-quoted function bodies are skipped over.
+"""
+import re
+from dataclasses import dataclass
+
+DOLLAR_TAG = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)?\$")
+FILE_MARKER = re.compile(r"^-- File: (.*)$", re.M)
+
+
+@dataclass
+class Statement:
+    sql: str
+    line: int
+    source: str = ""
+
+    @property
+    def keywords(self):
+        """
+        The leading words of the statement, upper-cased, for classification.
+        """
+        return leading_words(self.sql)
+
+
+def leading_words(sql, count=4):
+    return [word.upper() for word in re.findall(r'"[^"]*"|[^\s(,;]+', sql)[:count]]
+
+
+def _skip_quoted(text, i, quote, backslash=False):
+    """
+    Index just past the literal or identifier opened at `text[i]`.
+    """
+    i += 1
+    while i < len(text):
+        c = text[i]
+        if backslash and c == "\\":
+            i += 2
+            continue
+        if c == quote:
+            if i + 1 < len(text) and text[i + 1] == quote:
+                i += 2
+                continue
+            return i + 1
+        i += 1
+    return i
+
+
+def _skip_block_comment(text, i):
+    depth = 0
+    while i < len(text):
+        if text.startswith("/*", i):
+            depth += 1
+            i += 2
+        elif text.startswith("*/", i):
+            depth -= 1
+            i += 2
+            if depth == 0:
+                return i
+        else:
+            i += 1
+    return i
+
+
+def strip_comments(sql):
+    """
+    Remove comments from a statement, leaving literals and bodies untouched.
+    """
+    out = []
+    i = 0
+    while i < len(sql):
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = len(sql) if end < 0 else end
+        elif sql.startswith("/*", i):
+            i = _skip_block_comment(sql, i)
+            out.append(" ")
+        else:
+            end = _token_end(sql, i)
+            out.append(sql[i:end])
+            i = end
+    return "".join(out).strip()
+
+
+def _token_end(text, i):
+    """
+    End of the token at `text[i]`: a whole literal, identifier or dollar-quoted
+    body, or the single character otherwise.
+    """
+    c = text[i]
+    if c == "'":
+        backslash = i > 0 and text[i - 1] in "eE" and (i < 2 or not text[i - 2].isalnum())
+        return _skip_quoted(text, i, "'", backslash)
+    if c == '"':
+        return _skip_quoted(text, i, '"')
+    if c == "$":
+        match = DOLLAR_TAG.match(text, i)
+        if match and not (i > 0 and (text[i - 1].isalnum() or text[i - 1] == "_")):
+            end = text.find(match.group(0), match.end())
+            return len(text) if end < 0 else end + len(match.group(0))
+    return i + 1
+
+
+def split_statements(text, source=""):
+    """
+    Split a SQL script into its statements, without comments, in order.
+    """
+    statements = []
+    start = 0
+    i = 0
+    while i < len(text):
+        if text.startswith("--", i):
+            end = text.find("\n", i)
+            i = len(text) if end < 0 else end
+        elif text.startswith("/*", i):
+            i = _skip_block_comment(text, i)
+        elif text[i] == ";":
+            _append(statements, text, start, i, source)
+            i += 1
+            start = i
+        else:
+            i = _token_end(text, i)
+    _append(statements, text, start, len(text), source)
+    return statements
+
+
+def _append(statements, text, start, end, source):
+    sql = strip_comments(text[start:end])
+    if not sql:
+        return
+    # Line of the first significant character, for error reporting.
+    offset = start + len(text[start:end]) - len(text[start:end].lstrip())
+    statements.append(Statement(sql, text.count("\n", 0, offset) + 1, source))
+
+
+def split_files(text):
+    """
+    Split a snapshot into statements, tagging each with the migration file it
+    came from where the snapshot records one.
+    """
+    statements = []
+    markers = [(m.start(), m.group(1)) for m in FILE_MARKER.finditer(text)]
+    bounds = [(0, "")] + markers
+    for index, (start, source) in enumerate(bounds):
+        end = bounds[index + 1][0] if index + 1 < len(bounds) else len(text)
+        base_line = text.count("\n", 0, start)
+        for statement in split_statements(text[start:end], source):
+            statement.line += base_line
+            statements.append(statement)
+    return statements
+
+
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*|\d+(?:\.\d+)?|::|<>|!=|<=|>=|->>|->|\|\||.", re.S)
+
+
+@dataclass
+class Token:
+    text: str
+    start: int
+    end: int
+
+    @property
+    def upper(self):
+        return self.text.upper()
+
+
+def tokenize(sql):
+    """
+    Tokens of a comment-free statement: words, numbers, quoted identifiers,
+    literals, dollar-quoted bodies and operators.
+    """
+    tokens = []
+    i = 0
+    while i < len(sql):
+        if sql[i].isspace():
+            i += 1
+            continue
+        end = _token_end(sql, i)
+        if end == i + 1:
+            end = WORD.match(sql, i).end()
+        tokens.append(Token(sql[i:end], i, end))
+        i = end
+    return tokens
+
+
+def quote_ident(name):
+    """
+    Quote an identifier the way pg_dump would: only when it is not a plain
+    lower-case name.
+    """
+    if re.fullmatch(r"[a-z_][a-z0-9_]*", name) and name.upper() not in RESERVED:
+        return name
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def unquote_ident(text):
+    if text.startswith('"'):
+        return text[1:-1].replace('""', '"')
+    return text.lower()
+
+
+def quote_literal(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def unquote_literal(text):
+    return text[1:-1].replace("''", "'")
+
+
+# Reserved words that appear as identifiers in the snapshots.
+RESERVED = {"USER", "ORDER", "GROUP", "DEFAULT", "TABLE", "COLUMN", "CHECK", "PRIMARY", "REFERENCES", "UNIQUE"}
@@ -0,0 +1,276 @@
+import * as cdk from "aws-cdk-lib";
+import * as iam from "aws-cdk-lib/aws-iam";
+import * as kms from "aws-cdk-lib/aws-kms";
+import * as s3 from "aws-cdk-lib/aws-s3";
+import { Function, Runtime } from "aws-cdk-lib/aws-lambda";
+import { ISecret } from "aws-cdk-lib/aws-secretsmanager";
+import { Construct } from "constructs";
+import { customResourceCode } from "./lambda_code";
+
+// Modules of the provisioning Lambda next to its handler, lib/aws/encryption.py.
+export const PROVISIONING_MODULES = [
+  "lib/aws/lambda/secret_pipeline.py",
+  "lib/aws/lambda/secret_targets.py",
+  "lib/aws/lambda/envelope.py",
+  "lib/aws/lambda/secret_manifest.py",
+  "lib/aws/lambda/parameter_writer.py",
+  "lib/aws/lambda/key_rotation.py",
+];
+
+export interface ProvisioningTarget {
+  // Name of the target in lib/aws/lambda/secret_targets.py.
+  name: string;
+  secret: ISecret;
+  // A non-secret identifier that changes whenever the values in `secret` do,
+  // e.g. a release tag. Defaults to the `secret_revision` context.
+  revision?: string;
+  kmsKey: kms.IKey;
+  // SSM path the target's parameters are written under, e.g. "/hyperswitch/".
+  parameterPath?: string;
+  // Bucket and key of the target's env file.
+  bucket?: s3.IBucket;
+  file?: string;
+}
+
+const PROVISIONER_FUNCTION_NAME = "HyperswitchKmsEncryptionLambda";
+
+// A context value given as an object or as "name=value,name=value".
+function mappingContext(stack: cdk.Stack, name: string): { [key: string]: string } {
+  const mapping = stack.node.tryGetContext(name) || {};
+  if (typeof mapping !== "string") {
+    return mapping;
+  }
+  return Object.fromEntries(
+    mapping
+      .split(",")
+      .filter((entry: string) => entry.trim())
+      .map((entry: string) => entry.split("=").map((part: string) => part.trim())),
+  );
+}
+
+// The `secret_replicas` context: the regions the parameter targets are also
+// provisioned in, with the KMS key to use in each, given as an object or as
+// "us-west-2=alias/hyperswitch-dr,eu-west-1=mrk-...".
+function replicaRegions(stack: cdk.Stack): { [region: string]: string } {
+  const replicas = mappingContext(stack, "secret_replicas");
+  if (!cdk.Token.isUnresolved(stack.region) && replicas[stack.region]) {
+    throw new Error(`secret_replicas cannot include the stack's own region ${stack.region}`);
+  }
+  return replicas;
+}
+
+// Statements granting `actions` on the KMS keys referenced by `keys`: key
+// ARNs, key ids (in the given region) or aliases (names or ARNs). Aliases
+// cannot be resolved at synth time, so they are granted on the keys of their
+// region that carry the alias, through the kms:ResourceAliases condition.
+function kmsKeyStatements(
+  stack: cdk.Stack,
+  actions: string[],
+  keys: { region: string; key: string }[],
+): iam.PolicyStatement[] {
+  const arns: string[] = [];
+  const aliases: { [region: string]: string[] } = {};
+  for (const { region, key } of keys) {
+    const arn = key.startsWith("arn:") ? cdk.Arn.split(key, cdk.ArnFormat.SLASH_RESOURCE_NAME) : undefined;
+    if (arn ? arn.resource === "alias" : key.startsWith("alias/")) {
+      const keyRegion = arn?.region ?? region;
+      (aliases[keyRegion] = aliases[keyRegion] ?? []).push(arn ? `alias/${arn.resourceName}` : key);
+    } else if (arn) {
+      arns.push(key);
+    } else {
+      arns.push(stack.formatArn({ service: "kms", region, resource: "key", resourceName: key }));
+    }
+  }
+
+  const statements = arns.length ? [new iam.PolicyStatement({ actions, resources: arns })] : [];
+  for (const [region, names] of Object.entries(aliases)) {
+    statements.push(
+      new iam.PolicyStatement({
+        actions,
+        resources: [stack.formatArn({ service: "kms", region, resource: "key", resourceName: "*" })],
+        conditions: { "ForAnyValue:StringEquals": { "kms:ResourceAliases": names } },
+      }),
+    );
+  }
+  return statements;
+}
+
+// The `secret_rotation_keys` context: the KMS keys (ARNs, ids or aliases,
+// comma separated) the secrets may be rotated to with key_rotation.py.
+function rotationKeys(stack: cdk.Stack): string[] {
+  let keys = stack.node.tryGetContext("secret_rotation_keys") || [];
+  if (typeof keys === "string") {
+    keys = keys.split(",");
+  }
+  return keys.map((key: string) => key.trim()).filter((key: string) => key);
+}
+
+// The `secret_target_keys` context: the KMS key (ARN, id or alias) a target
+// is provisioned with instead of the `kms_id` of its secret, e.g.
+// "router=alias/hyperswitch-2025" once its secrets were rotated to that key.
+function targetKeys(stack: cdk.Stack): { [name: string]: string } {
+  return mappingContext(stack, "secret_target_keys");
+}
+
+// The `secret_revision` context: the revision of targets that have none of
+// their own. Deploying with a new value, e.g. `-c secret_revision=2`, makes
+// the provisioner run again and write the secret values that changed.
+function defaultRevision(stack: cdk.Stack): string {
+  return String(stack.node.tryGetContext("secret_revision") ?? "1");
+}
+
+const provisioners = new WeakMap<cdk.Stack, SecretProvisioner>();
+
+// The one Lambda and custom resource of a stack that provision the secrets of
+// every target registered with `addTarget`, in a single invocation.
+export class SecretProvisioner {
+  readonly function: Function;
+  readonly resource: cdk.CustomResource;
+  private readonly role: iam.Role;
+  private readonly options: { [name: string]: { [key: string]: string } } = {};
+  // The revision and options of each target, which make up the `Targets`
+  // property, so that changing either sends an Update.
+  private readonly targets: { [name: string]: { [key: string]: string } } = {};
+  private readonly replicas: { [region: string]: string };
+  private readonly targetKeys: { [name: string]: string };
+
+  static of(scope: Construct): SecretProvisioner {
+    const stack = cdk.Stack.of(scope);
+    let provisioner = provisioners.get(stack);
+    if (!provisioner) {
+      provisioner = new SecretProvisioner(stack);
+      provisioners.set(stack, provisioner);
+    }
+    return provisioner;
+  }
+
+  private constructor(stack: cdk.Stack) {
+    this.replicas = replicaRegions(stack);
+    this.targetKeys = targetKeys(stack);
+    this.role = new iam.Role(stack, "hyperswitch-lambda-role", {
+      assumedBy: new iam.ServicePrincipal("lambda.amazonaws.com"),
+      managedPolicies: [
+        iam.ManagedPolicy.fromAwsManagedPolicyName("service-role/AWSLambdaBasicExecutionRole"),
+      ],
+    });
+    this.role.addToPolicy(
+      new iam.PolicyStatement({
+        actions: ["secretsmanager:BatchGetSecretValue"],
+        resources: ["*"],
+      }),
+    );
+    // Key rotations (key_rotation.py) re-encrypt from the key of a target
+    // (granted in addTarget) to one of the rotation keys, and continue in new
+    // invocations of the function. The secrets are provisioned with the new
+    // key afterwards, through `secret_target_keys`, like with the key of a
+    // target.
+    kmsKeyStatements(
+      stack,
+      [
+        "kms:Encrypt",
+        "kms:Decrypt",
+        "kms:GenerateDataKey",
+        "kms:DescribeKey",
+        "kms:ReEncryptFrom",
+        "kms:ReEncryptTo",
+      ],
+      [...new Set([...rotationKeys(stack), ...Object.values(this.targetKeys)])].map((key) => ({
+        region: stack.region,
+        key,
+      })),
+    ).forEach((statement) => this.role.addToPolicy(statement));
+    this.role.addToPolicy(
+      new iam.PolicyStatement({
+        actions: ["lambda:InvokeFunction"],
+        resources: [
+          stack.formatArn({
+            service: "lambda",
+            resource: "function",
+            resourceName: `${PROVISIONER_FUNCTION_NAME}*`,
+            arnFormat: cdk.ArnFormat.COLON_RESOURCE_NAME,
+          }),
+        ],
+      }),
+    );
+
+    // The ids and function name are the ones of the router's former
+    // provisioning Lambda, so existing stacks update it in place.
+    this.function = new Function(stack, "hyperswitch-kms-encrypt", {
+      functionName: PROVISIONER_FUNCTION_NAME,
+      runtime: Runtime.PYTHON_3_9,
+      handler: "index.lambda_handler",
+      code: customResourceCode("lib/aws/encryption.py", PROVISIONING_MODULES),
+      timeout: cdk.Duration.minutes(15),
+      role: this.role,
+      environment: {
+        PROVISIONING_TARGETS: cdk.Lazy.string({ produce: () => stack.toJsonString(this.options) }),
+      },
+    });
+
+    this.resource = new cdk.CustomResource(stack, "HyperswitchKmsEncryptionCR", {
+      serviceToken: this.function.functionArn,
+      properties: {
+        Targets: cdk.Lazy.any({ produce: () => this.targets }),
+        Replicas: this.replicas,
+      },
+    });
+
+    // Only the replica keys themselves, not every key of their regions.
+    kmsKeyStatements(
+      stack,
+      ["kms:Encrypt", "kms:Decrypt", "kms:GenerateDataKey"],
+      Object.entries(this.replicas).map(([region, key]) => ({ region, key })),
+    ).forEach((statement) => this.role.addToPolicy(statement));
+  }
+
+  addTarget(target: ProvisioningTarget) {
+    if (this.options[target.name]) {
+      throw new Error(`Provisioning target ${target.name} is already registered`);
+    }
+
+    const options: { [key: string]: string } = { secret: target.secret.secretArn };
+    if (this.targetKeys[target.name]) {
+      options.key_id = this.targetKeys[target.name];
+    }
+    target.secret.grantRead(this.role);
+    target.kmsKey.grantEncryptDecrypt(this.role);
+    target.kmsKey.grant(this.role, "kms:DescribeKey", "kms:ReEncryptFrom");
+
+    if (target.parameterPath) {
+      const path = target.parameterPath.replace(/^\/|\/$/g, "");
+      const stack = cdk.Stack.of(this.resource);
+      const regions = [stack.region, ...Object.keys(this.replicas)];
+      this.role.addToPolicy(
+        new iam.PolicyStatement({
+          actions: [
+            "ssm:GetParameter",
+            "ssm:PutParameter",
+            "ssm:DeleteParameters",
+            "ssm:GetParametersByPath",
+          ],
+          resources: regions.flatMap((region) => [
+            stack.formatArn({ service: "ssm", region, resource: "parameter", resourceName: path }),
+            stack.formatArn({ service: "ssm", region, resource: "parameter", resourceName: `${path}/*` }),
+          ]),
+        }),
+      );
+    }
+
+    if (target.bucket && target.file) {
+      options.bucket = target.bucket.bucketName;
+      options.file = target.file;
+      target.bucket.grantReadWrite(this.role, target.file);
+    }
+
+    this.options[target.name] = options;
+    this.targets[target.name] = {
+      ...options,
+      revision: target.revision ?? defaultRevision(cdk.Stack.of(this.resource)),
+    };
+  }
+
+  // An attribute of the response Data of one target, e.g. attribute("locker", "digest").
+  attribute(target: string, name: string): string {
+    return this.resource.getAttString(target + name.charAt(0).toUpperCase() + name.slice(1));
+  }
+}
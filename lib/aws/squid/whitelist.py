@@ -0,0 +1,378 @@
+"""
+Compile the Squid domain whitelist and measure its use from the access log.
+
+    python3 lib/aws/squid/whitelist.py compile --in-place
+    python3 lib/aws/squid/whitelist.py compile --check
+    python3 lib/aws/squid/whitelist.py compile whitelist.txt whitelist_old.txt --output merged.txt
+    python3 lib/aws/squid/whitelist.py usage /var/log/squid/access.log* [--json usage.json] [--prune pruned.txt]
+
+The whitelist is loaded by the `allowed_http_sites` dstdomain ACL of
+squid.conf. A `.example.com` entry matches example.com and every host under
+it, a plain `example.com` entry only that host; names are case-insensitive.
+`compile` normalises the entries (case, trailing dots, comments) and drops
+duplicates, entries covered by a `.domain` wildcard (Squid warns about these
+and keeps only one of them) and entries that can match no host, such as ones
+with a URL path. The result is sorted and checked to match exactly the hosts
+the input matched: every input entry is covered by a kept one, and every kept
+entry comes from the input.
+
+`usage` streams Squid's native access log, the format squid_vector.toml
+parses, one line at a time (gzipped rotations included), so the memory used
+depends on the size of the whitelist and not of the logs. Each allowed request
+is attributed to the entry that matched it, and the hits, bytes and latency of
+every entry are reported along with the entries nothing used. The most denied
+hosts are listed too. --prune writes the whitelist without the unused entries;
+review it against a log window long enough to include rare callers (refunds,
+webhooks, monthly jobs) before deploying it.
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import re
+import sys
+
+DEFAULT_WHITELIST = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "configurations", "squid", "whitelist.txt"))
+DEFAULT_ACCESS_LOG = "/var/log/squid/access.log"
+
+# Letters, digits, hyphens and underscores in dot-separated labels.
+VALID_NAME = re.compile(r"^[a-z0-9_](?:[a-z0-9_-]*[a-z0-9_])?(?:\.[a-z0-9_](?:[a-z0-9_-]*[a-z0-9_])?)*$")
+
+# Latency histogram: bucket i holds durations up to LATENCY_GROWTH ** i ms,
+# so a percentile is reported within 25% of its value.
+LATENCY_GROWTH = 1.25
+LATENCY_BUCKETS = 80
+# Distinct denied hosts counted before the rest are summed up as "other".
+MAX_DENIED_HOSTS = 10000
+
+
+class Entry:
+    """
+    A whitelist entry: `name` without the leading dot, `wildcard` when it
+    covers the subdomains too.
+    """
+
+    def __init__(self, name, wildcard, source=None):
+        self.name = name
+        self.wildcard = wildcard
+        self.source = source
+
+    @property
+    def key(self):
+        return (self.name, self.wildcard)
+
+    def __str__(self):
+        return ("." if self.wildcard else "") + self.name
+
+    def covers(self, other):
+        if other.name == self.name:
+            return self.wildcard or not other.wildcard
+        return self.wildcard and other.name.endswith("." + self.name)
+
+
+def parse(path):
+    """
+    The entries of a whitelist file, and the ones that can match no host
+    (with the reason).
+    """
+    entries, invalid = [], []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            text = line.split("#", 1)[0].strip()
+            if not text:
+                continue
+            source = "{}:{}".format(path, number)
+            value = text.lower().rstrip(".")
+            wildcard = value.startswith(".")
+            name = value.lstrip(".")
+            if not VALID_NAME.match(name):
+                invalid.append((text, source, "not a host name"))
+                continue
+            entries.append(Entry(name, wildcard, source))
+    return entries, invalid
+
+
+class Compiled:
+
+    def __init__(self, entries):
+        self.input = entries
+        self.duplicates = []
+        self.covered = []
+        by_key = {}
+        for entry in entries:
+            if entry.key in by_key:
+                self.duplicates.append((entry, by_key[entry.key]))
+            else:
+                by_key[entry.key] = entry
+        unique = list(by_key.values())
+        self.matcher = Matcher(unique)
+        self.entries = []
+        for entry in unique:
+            cover = self.matcher.cover(entry)
+            if cover is not entry:
+                self.covered.append((entry, cover))
+            else:
+                self.entries.append(entry)
+        self.entries.sort(key=lambda entry: (entry.name, entry.wildcard))
+        self.matcher = Matcher(self.entries)
+
+    def render(self):
+        return "".join(str(entry) + "\n" for entry in self.entries)
+
+    def verify(self):
+        """
+        Prove that the compiled list matches the same hosts as the input:
+        the kept entries are input entries, and each input entry is covered
+        by a kept one. A probe host per entry is then matched both ways.
+        """
+        keys = {entry.key for entry in self.input}
+        for entry in self.entries:
+            if entry.key not in keys:
+                raise AssertionError("{} is not in the input".format(entry))
+        for entry in self.input:
+            if not any(kept.covers(entry) for kept in self.entries):
+                raise AssertionError("{} ({}) is not covered".format(entry, entry.source))
+        for entry in self.input:
+            for host in (entry.name, "probe." + entry.name, "probe" + entry.name):
+                expected = any(original.covers(Entry(host, False)) for original in self.input)
+                if (self.matcher.match(host) is not None) != expected:
+                    raise AssertionError("{} is matched differently".format(host))
+
+
+class Matcher:
+    """
+    dstdomain lookup in one dictionary probe per label of the host.
+    """
+
+    def __init__(self, entries):
+        self.exact = {}
+        self.wildcards = {}
+        for entry in entries:
+            (self.wildcards if entry.wildcard else self.exact).setdefault(entry.name, entry)
+
+    def match(self, host):
+        """
+        The most general entry matching `host`, or None.
+        """
+        labels = host.split(".")
+        for i in range(len(labels) - 1, -1, -1):
+            entry = self.wildcards.get(".".join(labels[i:]))
+            if entry is not None:
+                return entry
+        return self.exact.get(host)
+
+    def cover(self, entry):
+        if entry.wildcard:
+            return self.match(entry.name)
+        return self.match(entry.name) or entry
+
+
+def compile_paths(paths):
+    entries, invalid = [], []
+    for path in paths:
+        file_entries, file_invalid = parse(path)
+        entries.extend(file_entries)
+        invalid.extend(file_invalid)
+    compiled = Compiled(entries)
+    compiled.verify()
+    return compiled, invalid
+
+
+def compile_command(args):
+    paths = args.whitelist or [DEFAULT_WHITELIST]
+    compiled, invalid = compile_paths(paths)
+    for text, source, reason in invalid:
+        print("{}: dropped {} ({})".format(source, text, reason), file=sys.stderr)
+    for entry, first in compiled.duplicates:
+        print("{}: dropped {}, duplicate of {}".format(entry.source, entry, first.source), file=sys.stderr)
+    for entry, cover in compiled.covered:
+        print("{}: dropped {}, covered by {} ({})".format(entry.source, entry, cover, cover.source), file=sys.stderr)
+    print("{} entries in, {} out; the same hosts are matched".format(
+        len(compiled.input) + len(invalid), len(compiled.entries)), file=sys.stderr)
+
+    output = compiled.render()
+    if args.check:
+        with open(paths[0], encoding="utf-8") as f:
+            if f.read() != output:
+                sys.exit("{} is not compiled; run compile --in-place".format(paths[0]))
+        return
+    if args.in_place:
+        if len(paths) != 1:
+            sys.exit("--in-place takes a single whitelist")
+        args.output = paths[0]
+    if args.output and args.output != "-":
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+
+
+def open_log(path):
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def request_host(method, url):
+    """
+    The destination host of a logged request: CONNECT logs host:port, the
+    other methods an absolute URL.
+    """
+    if method != "CONNECT":
+        scheme = url.find("://")
+        if scheme < 0:
+            return None
+        url = url[scheme + 3:]
+        end = len(url)
+        for separator in "/?#":
+            position = url.find(separator)
+            if 0 <= position < end:
+                end = position
+        url = url[:end]
+    url = url.rpartition("@")[2]
+    if url.startswith("["):
+        return url[1:url.find("]")].lower() if "]" in url else None
+    return url.partition(":")[0].lower().rstrip(".") or None
+
+
+def records(paths):
+    """
+    (timestamp, elapsed ms, result code, status, bytes, method, host) for
+    every request line of the native Squid log format:
+
+        time elapsed client code/status bytes method URL user hierarchy/peer type
+    """
+    for path in paths:
+        with open_log(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 7:
+                    continue
+                try:
+                    timestamp = float(fields[0])
+                    elapsed = int(fields[1])
+                    size = int(fields[4])
+                except ValueError:
+                    continue
+                code, _, status = fields[3].partition("/")
+                host = request_host(fields[5], fields[6])
+                if host is not None:
+                    yield timestamp, elapsed, code, status, size, fields[5], host
+
+
+class Usage:
+
+    def __init__(self):
+        self.hits = 0
+        self.bytes = 0
+        self.total_ms = 0
+        self.max_ms = 0
+        self.hosts = {}
+        self.latency = [0] * LATENCY_BUCKETS
+
+    def add(self, host, elapsed, size):
+        self.hits += 1
+        self.bytes += size
+        self.total_ms += elapsed
+        self.max_ms = max(self.max_ms, elapsed)
+        if host in self.hosts or len(self.hosts) < 5:
+            self.hosts[host] = self.hosts.get(host, 0) + 1
+        bucket = 0 if elapsed <= 1 else min(LATENCY_BUCKETS - 1, math.ceil(math.log(elapsed, LATENCY_GROWTH)))
+        self.latency[bucket] += 1
+
+    def percentile(self, fraction):
+        rank = fraction * self.hits
+        seen = 0
+        for bucket, count in enumerate(self.latency):
+            seen += count
+            if count and seen >= rank:
+                return min(self.max_ms, round(LATENCY_GROWTH ** bucket))
+        return self.max_ms
+
+
+def usage_command(args):
+    compiled, _ = compile_paths(args.whitelist or [DEFAULT_WHITELIST])
+    usage = {entry.key: Usage() for entry in compiled.entries}
+    denied = {}
+    requests = allowed = refused = 0
+    first = last = None
+    for timestamp, elapsed, code, status, size, method, host in records(args.logs or [DEFAULT_ACCESS_LOG]):
+        requests += 1
+        first = timestamp if first is None else min(first, timestamp)
+        last = timestamp if last is None else max(last, timestamp)
+        if code.endswith("_DENIED"):
+            refused += 1
+            key = host if host in denied or len(denied) < MAX_DENIED_HOSTS else "(other)"
+            denied[key] = denied.get(key, 0) + 1
+            continue
+        entry = compiled.matcher.match(host)
+        if entry is not None:
+            allowed += 1
+            usage[entry.key].add(host, elapsed, size)
+
+    results = []
+    for entry in compiled.entries:
+        stats = usage[entry.key]
+        results.append({
+            "entry": str(entry), "hits": stats.hits, "bytes": stats.bytes,
+            "avg_ms": round(stats.total_ms / stats.hits, 1) if stats.hits else None,
+            "p50_ms": stats.percentile(0.5) if stats.hits else None,
+            "p95_ms": stats.percentile(0.95) if stats.hits else None,
+            "max_ms": stats.max_ms if stats.hits else None,
+            "hosts": sorted(stats.hosts, key=lambda host: -stats.hosts[host]),
+        })
+    unused = [result["entry"] for result in results if not result["hits"]]
+    top_denied = sorted(denied.items(), key=lambda item: -item[1])[:args.top]
+
+    window = "no requests" if first is None else "{:.1f} hours of logs".format((last - first) / 3600)
+    print("{} requests ({}): {} allowed by the whitelist, {} denied".format(requests, window, allowed, refused))
+    print("{:<45} {:>9} {:>12} {:>8} {:>8} {:>8}".format("entry", "hits", "bytes", "p50 ms", "p95 ms", "max ms"))
+    for result in sorted(results, key=lambda result: -result["hits"]):
+        if result["hits"]:
+            print("{:<45} {:>9} {:>12} {:>8} {:>8} {:>8}".format(
+                result["entry"], result["hits"], result["bytes"],
+                result["p50_ms"], result["p95_ms"], result["max_ms"]))
+    print("{} of {} entries unused: {}".format(len(unused), len(results), " ".join(unused) or "-"))
+    if top_denied:
+        print("most denied: " + ", ".join("{} {}x".format(host, count) for host, count in top_denied))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "requests": requests, "allowed": allowed, "denied": refused, "from": first, "to": last,
+                "entries": results, "unused": unused, "top_denied": dict(top_denied),
+            }, f, indent=2)
+    if args.prune:
+        with open(args.prune, "w", encoding="utf-8") as f:
+            f.write("".join(str(entry) + "\n" for entry in compiled.entries if usage[entry.key].hits))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = commands.add_parser("compile", help="normalise and minimise the whitelist")
+    compile_parser.add_argument("whitelist", nargs="*", help="whitelist files (default: the deployed whitelist.txt)")
+    compile_parser.add_argument("--output", help="write the compiled list to this file (default: stdout)")
+    compile_parser.add_argument("--in-place", action="store_true", help="rewrite the whitelist file")
+    compile_parser.add_argument("--check", action="store_true", help="fail if the first file is not compiled")
+    compile_parser.set_defaults(run=compile_command)
+
+    usage_parser = commands.add_parser("usage", help="report the use of each entry from access logs")
+    usage_parser.add_argument("logs", nargs="*", help="access logs, .gz or - for stdin (default: {})".format(DEFAULT_ACCESS_LOG))
+    usage_parser.add_argument("--whitelist", action="append", help="whitelist file (repeatable)")
+    usage_parser.add_argument("--json", help="write the report to this file")
+    usage_parser.add_argument("--prune", help="write the whitelist without the unused entries to this file")
+    usage_parser.add_argument("--top", type=int, default=10, help="denied hosts to list")
+    usage_parser.set_defaults(run=usage_command)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,34 @@
 set -e
 set -x
 
-sudo mkdir -p /home/ubuntu/
-aws s3 cp s3://{{bucket-name}}/envoy/envoy.yaml /home/ubuntu/
-sudo sed -i 's/^|//g' /home/ubuntu/envoy.yaml
-sudo rm -rf /etc/envoy/envoy.yaml
-sudo rm /dev/shm/envoy_shared_memory_*
+# Install the config published by the EnvoyConfig custom resource. The
+# envoy/current pointer carries the digest of the current config as metadata,
+# and the compressed config is only downloaded when it differs from the digest
+# of the installed one. With --restart, Envoy is restarted after a change.
+sudo tee /usr/local/bin/fetch-envoy-config > /dev/null <<'SCRIPT'
+#!/bin/bash
+set -e
+digest=$(aws s3api head-object --bucket {{bucket-name}} --key envoy/current --query Metadata.sha256 --output text)
+if [ -f /etc/envoy/envoy.yaml ] && [ "$digest" = "$(cat /etc/envoy/envoy.yaml.sha256 2>/dev/null)" ]; then
+    echo "Envoy config is up to date ($digest)"
+    exit 0
+fi
+mkdir -p /home/ubuntu/ /etc/envoy
+aws s3 cp "s3://{{bucket-name}}/envoy/config/$digest.yaml.gz" - | gunzip > /home/ubuntu/envoy.yaml
+echo "$digest  /home/ubuntu/envoy.yaml" | sha256sum --check --status
+for file in envoy-config-template.yaml envoy.yaml; do
+    install -o envoy -g envoy -m 664 /home/ubuntu/envoy.yaml /etc/envoy/$file
+done
+echo "$digest" > /etc/envoy/envoy.yaml.sha256
+echo "Installed Envoy config $digest"
+if [ "$1" = "--restart" ]; then
+    systemctl restart envoy.service
+fi
+SCRIPT
+sudo chmod +x /usr/local/bin/fetch-envoy-config
+
+sudo /usr/local/bin/fetch-envoy-config
+sudo rm -f /dev/shm/envoy_shared_memory_*
 
 # Create log directory and set proper permissions
 sudo mkdir -p /var/log/envoy
@@ -15,14 +38,6 @@ sudo chown -R envoy:envoy /var/log/envoy
 sudo chmod 755 /var/log/envoy
 sudo chmod 644 /var/log/envoy/listener-https_access.log
 
-# Copy and configure Envoy config files
-sudo cp /home/ubuntu/envoy.yaml /etc/envoy/envoy-config-template.yaml
-sudo cp /home/ubuntu/envoy.yaml /etc/envoy/
-sudo chmod ug+rw /etc/envoy/envoy.yaml
-sudo chown envoy:envoy /etc/envoy/envoy.yaml
-sudo chmod ug+rw /etc/envoy/envoy-config-template.yaml
-sudo chown envoy:envoy /etc/envoy/envoy-config-template.yaml
-
 # Restart Envoy service
 sudo systemctl restart envoy.service
-sudo systemctl status envoy.service
\ No newline at end of file
+sudo systemctl status envoy.service
@@ -0,0 +1,86 @@
+"""
+Tests of the load balancer cleanup in lib/aws/delete_stack.py, against moto.
+
+    python3 -m pytest test/lambda
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, os.path.join(ROOT, "lib", "aws", "lambda"))
+sys.path.insert(0, os.path.join(ROOT, "lib", "aws"))
+
+import boto3  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+import delete_stack  # noqa: E402
+
+REGION = "us-east-1"
+
+
+class Context:
+
+    def get_remaining_time_in_millis(self):
+        return 600000
+
+
+class DeleteTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock_aws()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        environment = mock.patch.dict(os.environ, {
+            "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": REGION})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+        self.elbv2 = boto3.client("elbv2", region_name=REGION)
+        ec2 = boto3.client("ec2", region_name=REGION)
+        self.vpc = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+        self.subnets = [
+            ec2.create_subnet(VpcId=self.vpc, CidrBlock="10.0.{}.0/24".format(i), AvailabilityZone=REGION + zone)
+            ["Subnet"]["SubnetId"]
+            for i, zone in enumerate("ab")
+        ]
+
+    def load_balancer(self, name, *target_groups):
+        lb = self.elbv2.create_load_balancer(Name=name, Subnets=self.subnets)["LoadBalancers"][0]
+        for port, tg in zip((80, 443), target_groups):
+            self.elbv2.create_listener(
+                LoadBalancerArn=lb["LoadBalancerArn"], Protocol="HTTP", Port=port,
+                DefaultActions=[{"Type": "forward", "TargetGroupArn": tg}])
+        return lb
+
+    def target_group(self, name):
+        return self.elbv2.create_target_group(
+            Name=name, Protocol="HTTP", Port=80, VpcId=self.vpc)["TargetGroups"][0]["TargetGroupArn"]
+
+    def remaining_target_groups(self):
+        return sorted(tg["TargetGroupName"] for tg in self.elbv2.describe_target_groups()["TargetGroups"])
+
+    def test_target_groups_of_failed_load_balancers_are_kept(self):
+        own, shared, other = self.target_group("own"), self.target_group("shared"), self.target_group("other")
+        self.load_balancer("hyperswitch", own, shared)
+        self.load_balancer("hyperswitch-web", other, shared)
+        delete_load_balancer = delete_stack.delete_load_balancer
+
+        def fail_web(lb, context):
+            if lb["LoadBalancerName"] == "hyperswitch-web":
+                raise RuntimeError("still in use")
+            delete_load_balancer(lb, context)
+
+        with mock.patch.object(delete_stack, "delete_load_balancer", fail_web), \
+                mock.patch.object(delete_stack.elbv2, "delete_target_group",
+                                  wraps=delete_stack.elbv2.delete_target_group) as delete_target_group:
+            data = delete_stack.delete({}, Context())
+
+        self.assertEqual(data["deleted"], "hyperswitch")
+        self.assertEqual([call.kwargs["TargetGroupArn"] for call in delete_target_group.call_args_list], [own])
+        self.assertEqual(self.remaining_target_groups(), ["other", "shared"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Tests of the cached Istio ALB lookup in get_istio_alb_dns.py, against moto.
+
+    python3 -m pytest test/lambda
+"""
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib", "aws", "lambda"))
+
+import boto3  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+import get_istio_alb_dns  # noqa: E402
+
+REGION = "us-east-1"
+CLUSTER = "hs-eks-cluster"
+INGRESS = "istio-system/hyperswitch-istio"
+PARAMETER = "/istio/internal-alb"
+
+
+class Context:
+
+    def get_remaining_time_in_millis(self):
+        return 600000
+
+
+class CachedAlbTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock_aws()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        environment = mock.patch.dict(os.environ, {
+            "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": REGION,
+            "CLUSTER_NAME": CLUSTER, "INGRESS_STACK": INGRESS, "CACHE_PARAMETER": PARAMETER})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+        self.elbv2 = boto3.client("elbv2", region_name=REGION)
+        self.ssm = boto3.client("ssm", region_name=REGION)
+        ec2 = boto3.client("ec2", region_name=REGION)
+        vpc = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+        self.subnets = [
+            ec2.create_subnet(VpcId=vpc, CidrBlock="10.0.{}.0/24".format(i), AvailabilityZone=REGION + zone)
+            ["Subnet"]["SubnetId"]
+            for i, zone in enumerate("ab")
+        ]
+
+    def alb(self, name, cluster=CLUSTER):
+        return self.elbv2.create_load_balancer(
+            Name=name, Subnets=self.subnets,
+            Tags=[{"Key": get_istio_alb_dns.CLUSTER_TAG, "Value": cluster},
+                  {"Key": get_istio_alb_dns.INGRESS_STACK_TAG, "Value": INGRESS}])["LoadBalancers"][0]
+
+    def cache(self, lb):
+        get_istio_alb_dns.write_cached_alb(PARAMETER, lb)
+
+    def cached_arn(self):
+        return json.loads(self.ssm.get_parameter(Name=PARAMETER)["Parameter"]["Value"])["arn"]
+
+    def lookup(self, request_type="Update"):
+        return get_istio_alb_dns.handler({"RequestType": request_type}, Context())
+
+    def test_cached_alb_is_used(self):
+        lb = self.alb("k8s-hyperswitchistio-alb")
+        self.cache(lb)
+        self.assertEqual(self.lookup(), {"DnsName": lb["DNSName"]})
+
+    def test_deleted_alb_is_discovered_again(self):
+        old = self.alb("k8s-hyperswitchistio-old")
+        self.cache(old)
+        self.elbv2.delete_load_balancer(LoadBalancerArn=old["LoadBalancerArn"])
+        new = self.alb("k8s-hyperswitchistio-new")
+        self.assertEqual(self.lookup(), {"DnsName": new["DNSName"]})
+        self.assertEqual(self.cached_arn(), new["LoadBalancerArn"])
+
+    def test_alb_of_another_cluster_is_discovered_again(self):
+        other = self.alb("k8s-hyperswitchistio-other", cluster="other-cluster")
+        self.cache(other)
+        lb = self.alb("k8s-hyperswitchistio-alb")
+        self.assertEqual(self.lookup(), {"DnsName": lb["DNSName"]})
+        self.assertEqual(self.cached_arn(), lb["LoadBalancerArn"])
+
+    def test_delete_removes_the_cache(self):
+        self.cache(self.alb("k8s-hyperswitchistio-alb"))
+        self.lookup("Delete")
+        with self.assertRaises(self.ssm.exceptions.ParameterNotFound):
+            self.ssm.get_parameter(Name=PARAMETER)
+        self.lookup("Delete")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+Tests of key_rotation.py and of provisioning after a rotation, against moto.
+
+    python3 -m pytest test/lambda
+"""
+import base64
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, os.path.join(ROOT, "lib", "aws", "lambda"))
+sys.path.insert(0, os.path.join(ROOT, "lib", "aws"))
+
+import boto3  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+import encryption  # noqa: E402
+import key_rotation  # noqa: E402
+import parameter_writer  # noqa: E402
+import secret_manifest  # noqa: E402
+import secret_pipeline  # noqa: E402
+
+REGION = "us-east-1"
+PATH = "/hyperswitch/"
+PLAINTEXTS = {"db_password": "db-password", "jwt_secret": "jwt-secret"}
+
+
+class Context:
+
+    def get_remaining_time_in_millis(self):
+        return 600000
+
+
+class TargetKeyTest(unittest.TestCase):
+
+    def test_option_replaces_the_secret_key(self):
+        self.assertEqual(encryption.target_key({}, {"kms_id": "old"}), "old")
+        self.assertEqual(encryption.target_key({"key_id": "alias/new"}, {"kms_id": "old"}), "alias/new")
+
+
+class RotationTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock_aws()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        environment = mock.patch.dict(os.environ, {
+            "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": REGION})
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.kms = boto3.client("kms", region_name=REGION)
+        self.ssm = boto3.client("ssm", region_name=REGION)
+        self.old_key = self.kms.create_key()["KeyMetadata"]["KeyId"]
+        self.new_key = self.kms.create_key()["KeyMetadata"]
+
+    def provision(self, key_id, incremental):
+        writer = parameter_writer.Writer(self.ssm)
+        return secret_pipeline.provision(
+            PLAINTEXTS, key_id, self.kms, encryption.kms_encryptor(key_id, REGION, self.kms),
+            read=lambda key: encryption.read_parameter(self.ssm, PATH, key),
+            store=lambda key, value: encryption.store_parameter(writer, PATH, key, value),
+            incremental=incremental)
+
+    def key_of(self, name):
+        value = self.ssm.get_parameter(Name=PATH + name)["Parameter"]["Value"]
+        return self.kms.decrypt(CiphertextBlob=base64.b64decode(value))["KeyId"]
+
+    def test_update_on_the_rotated_key_keeps_it(self):
+        self.provision(self.old_key, incremental=False)
+        data = key_rotation.rotate(
+            self.ssm, parameter_writer.Writer(self.ssm), self.kms, PATH, self.new_key["KeyId"], Context())
+        self.assertEqual((data["state"], data["rotated"]), ("complete", str(len(PLAINTEXTS))))
+
+        manifest = json.loads(self.ssm.get_parameter(Name=PATH + secret_manifest.MANIFEST_NAME)["Parameter"]["Value"])
+        self.assertEqual(manifest["key_id"], self.new_key["KeyId"])
+
+        data = self.provision(self.new_key["KeyId"], incremental=True)
+        self.assertEqual((data["succeeded"], data["unchanged"]), ("", str(len(PLAINTEXTS))))
+        for name in PLAINTEXTS:
+            self.assertEqual(self.key_of(name), self.new_key["Arn"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Tests of the counts kept by parameter_writer.Writer.
+
+    python3 -m pytest test/lambda
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib", "aws", "lambda"))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+import parameter_writer  # noqa: E402
+
+
+class ThrottlingClient:
+    """
+    An SSM client whose first `throttles` PutParameter calls are throttled.
+    """
+
+    def __init__(self, throttles):
+        self.meta = SimpleNamespace(region_name="test-writer-1")
+        self.throttles = throttles
+        self.calls = 0
+
+    def put_parameter(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise ClientError({"Error": {"Code": "ThrottlingException"}}, "PutParameter")
+        return {"Version": 1, "Tier": "Standard"}
+
+
+class WriterTest(unittest.TestCase):
+
+    def test_retries_are_not_counted_as_writes(self):
+        ssm = ThrottlingClient(throttles=2)
+        writer = parameter_writer.Writer(ssm)
+        with mock.patch.object(parameter_writer.time, "sleep"):
+            writer.put("/test/a", "value")
+            writer.put("/test/b", "value")
+        self.assertEqual(ssm.calls, 4)
+        self.assertEqual(writer.counts, {"writes": 2, "throttled": 2, "standard": 2, "advanced": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Tests of the AMI history kept by record_ami.py, against moto.
+
+    python3 -m pytest test/lambda
+"""
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib", "aws", "lambda"))
+
+import boto3  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+import record_ami  # noqa: E402
+
+REGION = "us-east-1"
+NAME = "/test/envoy-ami_history"
+
+
+def entry(ami, timestamp):
+    return {"ami": ami, "region": REGION, "hash": None, "timestamp": timestamp}
+
+
+class ConcurrentWriter:
+    """
+    An SSM client on which `writes` other histories are written just before
+    the first write of the history, as concurrent invocations would.
+    """
+
+    def __init__(self, ssm, writes):
+        self.ssm = ssm
+        self.writes = list(writes)
+
+    def __getattr__(self, name):
+        return getattr(self.ssm, name)
+
+    def put_parameter(self, **kwargs):
+        while kwargs["Name"] == NAME and self.writes:
+            record_ami.put_parameter(self.ssm, NAME, json.dumps(self.writes.pop(0)))
+        return self.ssm.put_parameter(**kwargs)
+
+
+class UpdateHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock_aws()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        environment = mock.patch.dict(os.environ, {
+            "AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing", "AWS_DEFAULT_REGION": REGION})
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.ssm = boto3.client("ssm", region_name=REGION)
+
+    def stored(self):
+        return [item["ami"] for item in json.loads(self.ssm.get_parameter(Name=NAME)["Parameter"]["Value"])]
+
+    def test_adds_new_entries_first(self):
+        record_ami.put_parameter(self.ssm, NAME, json.dumps([entry("ami-1", 1)]))
+        history = record_ami.update_history(self.ssm, NAME, [entry("ami-2", 2), entry("ami-1", 2)], 5)
+        self.assertEqual([item["ami"] for item in history], ["ami-2", "ami-1"])
+        self.assertEqual(history[1]["timestamp"], 1)
+        self.assertEqual(self.stored(), ["ami-2", "ami-1"])
+
+    def test_concurrent_writes_are_merged(self):
+        record_ami.put_parameter(self.ssm, NAME, json.dumps([entry("ami-1", 1)]))
+        ssm = ConcurrentWriter(self.ssm, [[entry("ami-2", 2), entry("ami-1", 1)], [entry("ami-3", 3), entry("ami-1", 1)]])
+        history = record_ami.update_history(ssm, NAME, [entry("ami-4", 4)], 5)
+        self.assertEqual([item["ami"] for item in history], ["ami-4", "ami-3", "ami-2", "ami-1"])
+        self.assertEqual(self.stored(), ["ami-4", "ami-3", "ami-2", "ami-1"])
+
+    def test_gives_up_when_every_write_loses(self):
+        ssm = ConcurrentWriter(self.ssm, [])
+        ssm.put_parameter = lambda **kwargs: (
+            self.ssm.put_parameter(**kwargs), self.ssm.put_parameter(**kwargs))[1]
+        with self.assertRaises(RuntimeError):
+            record_ami.update_history(ssm, NAME, [entry("ami-1", 1)], 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
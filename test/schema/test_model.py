@@ -0,0 +1,115 @@
+"""
+Tests of the snapshot replay in lib/aws/schema/model.py.
+
+    python3 -m pytest test/schema
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib", "aws", "schema"))
+
+import model  # noqa: E402
+import sql  # noqa: E402
+
+SCRIPT = """
+CREATE TYPE "Status" AS ENUM ('active', 'inactive');
+CREATE TABLE merchant (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(64) NOT NULL UNIQUE,
+    status "Status" NOT NULL DEFAULT 'active'
+);
+CREATE TABLE account (
+    id INT4,
+    merchant_id INTEGER REFERENCES merchant (id),
+    CHECK (id > 0)
+);
+CREATE UNIQUE INDEX account_merchant_idx ON account (merchant_id);
+UPDATE merchant SET name = lower(name);
+ALTER TABLE merchant RENAME COLUMN name TO merchant_name;
+CREATE FUNCTION touch() RETURNS trigger AS $$ BEGIN RETURN NEW; END; $$ LANGUAGE plpgsql;
+"""
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.replay = model.replay(sql.split_statements(SCRIPT))
+        self.schema = self.replay.schema
+
+    def test_objects(self):
+        self.assertEqual(self.schema.enums, {"Status": ["active", "inactive"]})
+        self.assertEqual(list(self.schema.tables), ["merchant", "account"])
+        self.assertEqual(list(self.schema.indexes), ["account_merchant_idx"])
+        self.assertEqual(list(self.schema.functions), ["touch"])
+        self.assertEqual(self.replay.unmodelled, [])
+
+    def test_columns(self):
+        merchant = self.schema.tables["merchant"]
+        self.assertEqual(list(merchant.columns), ["id", "merchant_name", "status"])
+        self.assertFalse(merchant.columns["merchant_name"].nullable)
+        self.assertEqual(merchant.columns["status"].default_key, "'active'")
+        self.assertEqual(self.schema.tables["account"].columns["id"].type_key, "integer")
+
+    def test_unnamed_constraints_get_the_postgres_names(self):
+        self.assertEqual(
+            {name: constraint.kind for name, constraint in self.schema.tables["merchant"].constraints.items()},
+            {"merchant_pkey": "p", "merchant_name_key": "u"})
+        self.assertEqual(
+            {name: constraint.kind for name, constraint in self.schema.tables["account"].constraints.items()},
+            {"account_merchant_id_fkey": "f", "account_id_check": "c"})
+
+    def test_renames_keep_constraint_names(self):
+        unique = self.schema.tables["merchant"].constraints["merchant_name_key"]
+        self.assertEqual(unique.definition, "UNIQUE (merchant_name)")
+        self.assertEqual([(index, rename.kind, rename.old, rename.new) for index, rename in self.replay.journal],
+                         [(5, "column", "name", "merchant_name")])
+
+    def test_data_statements_are_kept_in_order(self):
+        self.assertEqual([(index, statement.sql) for index, statement in self.replay.data],
+                         [(4, "UPDATE merchant SET name = lower(name)")])
+
+    def test_unsupported_statements_are_reported(self):
+        replay = model.replay(sql.split_statements("CREATE TABLE a (id INT); ALTER TABLE missing ADD COLUMN b INT;"))
+        self.assertEqual(len(replay.unmodelled), 1)
+        self.assertIn("missing", replay.unmodelled[0][0].sql)
+
+
+class DefaultConstraintNameTest(unittest.TestCase):
+
+    def test_short_names(self):
+        self.assertEqual(model.default_constraint_name("payment_attempt", [], "pkey"), "payment_attempt_pkey")
+        self.assertEqual(model.default_constraint_name("refund", ["merchant_id", "refund_id"], "key"),
+                         "refund_merchant_id_refund_id_key")
+
+    def test_long_names_keep_the_suffix(self):
+        # Postgres shortens the longer of the table and column parts first.
+        table = "merchant_connector_account_business_profile_mapping"
+        self.assertEqual(
+            model.default_constraint_name(table, ["merchant_connector_account_identifier"], "fkey"),
+            "merchant_connector_account_bu_merchant_connector_account_i_fkey")
+        self.assertEqual(
+            model.default_constraint_name(table, [], "pkey"),
+            "merchant_connector_account_business_profile_mapping_pkey")
+        self.assertEqual(
+            model.default_constraint_name("t" * 70, [], "pkey"), "t" * 58 + "_pkey")
+
+    def test_long_column_lists(self):
+        name = model.default_constraint_name("t", ["a" * 40, "b" * 40, "c"], "key")
+        self.assertEqual(name, "t_" + "a" * 40 + "_" + "b" * 16 + "_key")
+        self.assertEqual(len(name.encode("utf-8")), model.MAX_IDENTIFIER)
+
+    def test_multibyte_characters_are_not_split(self):
+        name = model.default_constraint_name("é" * 40, ["ü" * 40], "key")
+        self.assertLessEqual(len(name.encode("utf-8")), model.MAX_IDENTIFIER)
+        self.assertTrue(name.endswith("_key"))
+
+    def test_check_constraints_are_named_after_their_only_column(self):
+        schema = model.replay(sql.split_statements(
+            "CREATE TABLE t (a INT, b INT, CHECK (a > 0), CHECK (a > b));"
+            'ALTER TABLE t ADD CHECK ("b" < 10);')).schema
+        self.assertEqual(list(schema.tables["t"].constraints), ["t_a_check", "t_check", "t_b_check"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+"""
+Tests of the migration planner in lib/aws/schema/planner.py.
+
+    python3 -m pytest test/schema
+
+With DATABASE_URL pointing at a scratch Postgres database (and psycopg2
+installed), the plans are also applied to it: each test works in a schema
+of its own, which it drops afterwards.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib", "aws", "schema"))
+
+import locks  # noqa: E402
+import model  # noqa: E402
+import planner  # noqa: E402
+
+BASE = """
+CREATE TYPE "Status" AS ENUM ('active', 'inactive');
+CREATE TABLE merchant (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(64) NOT NULL,
+    legacy TEXT,
+    status "Status" NOT NULL DEFAULT 'active'
+);
+CREATE INDEX merchant_name_idx ON merchant (name);
+"""
+
+APPENDED = """
+ALTER TYPE "Status" ADD VALUE 'blocked';
+ALTER TABLE merchant RENAME COLUMN name TO merchant_name;
+ALTER TABLE merchant ADD COLUMN country VARCHAR(2);
+UPDATE merchant SET country = 'US' WHERE country IS NULL;
+ALTER TABLE merchant ALTER COLUMN country SET NOT NULL;
+ALTER TABLE merchant DROP COLUMN legacy;
+CREATE TABLE merchant_connector_account_business_profile_mapping (
+    id SERIAL PRIMARY KEY,
+    merchant_connector_account_identifier INTEGER NOT NULL REFERENCES merchant (id)
+);
+"""
+
+
+class SnapshotsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def snapshot(self, version, text):
+        os.makedirs(os.path.join(self.directory, version))
+        path = os.path.join(self.directory, version, "schema.sql")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return planner.Snapshot.load(path)
+
+
+class PlanTest(SnapshotsTest):
+
+    def setUp(self):
+        super().setUp()
+        self.source = self.snapshot("v1", BASE)
+        self.target = self.snapshot("v2", BASE + APPENDED)
+        self.plan = planner.plan(self.source, self.target)
+
+    def test_steps_in_phase_order(self):
+        self.assertEqual([(step.phase, step.sql.split("\n")[0]) for step in self.plan.ordered()], [
+            ("enum values", "ALTER TYPE \"Status\" ADD VALUE IF NOT EXISTS 'blocked' AFTER 'inactive'"),
+            ("renames", "ALTER TABLE merchant RENAME COLUMN name TO merchant_name"),
+            ("tables", "CREATE TABLE IF NOT EXISTS merchant_connector_account_business_profile_mapping ("),
+            ("columns", "ALTER TABLE merchant ADD COLUMN IF NOT EXISTS country VARCHAR(2)"),
+            ("backfill", "UPDATE merchant SET country = 'US' WHERE country IS NULL"),
+            ("not null", "ALTER TABLE merchant ALTER COLUMN country SET NOT NULL"),
+            ("constraints", "ALTER TABLE merchant_connector_account_business_profile_mapping "
+                            "ADD CONSTRAINT merchant_connector_account_bu_merchant_connector_account_i_fkey "
+                            "FOREIGN KEY (merchant_connector_account_identifier) REFERENCES merchant (id)"),
+            ("drops", "ALTER TABLE merchant DROP COLUMN IF EXISTS legacy"),
+        ])
+        self.assertEqual(self.plan.warnings, [])
+
+    def test_destructive_steps(self):
+        self.assertEqual([step.sql for step in self.plan.destructive], ["ALTER TABLE merchant DROP COLUMN IF EXISTS legacy"])
+        self.assertIn("-- destructive\nALTER TABLE merchant DROP COLUMN IF EXISTS legacy;", self.plan.render())
+
+    def test_enum_values_run_outside_the_transaction(self):
+        self.assertEqual([step.phase for step in self.plan.steps if not step.transactional], ["enum values"])
+
+    def test_same_snapshot_plans_nothing(self):
+        self.assertEqual(planner.plan(self.target, self.target).steps, [])
+
+    def test_unrelated_snapshots_plan_renames_as_drop_and_add(self):
+        other = self.snapshot("v3", BASE.replace("name VARCHAR(64)", "title VARCHAR(64)"))
+        plan = planner.plan(self.source, other)
+        self.assertEqual(len(plan.warnings), 1)
+        self.assertIn("ALTER TABLE merchant DROP COLUMN IF EXISTS name", [step.sql for step in plan.destructive])
+
+
+class RepositorySnapshotsTest(unittest.TestCase):
+
+    def test_consecutive_snapshots_plan_without_unmodelled_statements(self):
+        versions = planner.versions()
+        for source, target in zip(versions, versions[1:]):
+            with self.subTest(source=source, target=target):
+                plan = planner.plan(planner.Snapshot(source), planner.Snapshot(target))
+                self.assertEqual([warning for warning in plan.warnings if "not modelled" in warning], [])
+
+
+class NotNullStepsTest(unittest.TestCase):
+
+    def test_check_constraint_name_fits_an_identifier(self):
+        table, column = "merchant_connector_account_business_profile_mapping", "merchant_connector_account_identifier"
+        check = model.default_constraint_name(table, [column], "not_null")
+        self.assertEqual(len(check), model.MAX_IDENTIFIER)
+        self.assertTrue(check.endswith("_not_null"))
+        steps = locks.not_null_steps(table, column)
+        self.assertIn("ADD CONSTRAINT {} CHECK".format(check), steps[0])
+        self.assertTrue(steps[-1].endswith("DROP CONSTRAINT {}".format(check)))
+
+
+@unittest.skipUnless(os.environ.get("DATABASE_URL"), "DATABASE_URL is not set")
+class PostgresTest(SnapshotsTest):
+    """
+    Applies snapshots and plans to a real database and compares the catalog.
+    """
+
+    def setUp(self):
+        super().setUp()
+        try:
+            import psycopg2
+        except ImportError:
+            self.skipTest("psycopg2 is not installed")
+        self.connection = psycopg2.connect(os.environ["DATABASE_URL"])
+        self.connection.autocommit = True
+        self.addCleanup(self.connection.close)
+
+    def schema(self, prefix):
+        name = "{}_{}".format(prefix, uuid.uuid4().hex[:8])
+        with self.connection.cursor() as cursor:
+            cursor.execute("CREATE SCHEMA {}".format(name))
+        self.addCleanup(self.execute, name, "DROP SCHEMA {} CASCADE".format(name))
+        return name
+
+    def execute(self, schema, *statements):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SET search_path TO {}".format(schema))
+            for statement in statements:
+                cursor.execute(statement)
+
+    def catalog(self, schema):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT table_name, column_name, data_type, is_nullable FROM information_schema.columns "
+                "WHERE table_schema = %s ORDER BY 1, 2", (schema,))
+            columns = cursor.fetchall()
+            cursor.execute(
+                "SELECT c.conrelid::regclass::text, c.conname, c.contype FROM pg_constraint c "
+                "JOIN pg_namespace n ON n.oid = c.connamespace WHERE n.nspname = %s ORDER BY 1, 2", (schema,))
+            constraints = cursor.fetchall()
+        return columns, constraints
+
+    def test_default_constraint_names_match(self):
+        schema = self.schema("names")
+        target = self.snapshot("v2", BASE + APPENDED)
+        self.execute(schema, *(statement.sql for statement in target.statements))
+        _, constraints = self.catalog(schema)
+        expected = sorted(
+            (table.name, name)
+            for table in target.replay.schema.tables.values()
+            for name in table.constraints)
+        self.assertEqual(sorted((table, name) for table, name, kind in constraints if kind != "n"), expected)
+
+    def test_plan_reaches_the_target_schema(self):
+        source = self.snapshot("v1", BASE)
+        target = self.snapshot("v2", BASE + APPENDED)
+        planned, replayed = self.schema("planned"), self.schema("replayed")
+
+        self.execute(planned, *(statement.sql for statement in source.statements))
+        self.execute(planned, "INSERT INTO merchant (name) VALUES ('a'), ('b')")
+        for step in planner.plan(source, target).ordered():
+            self.execute(planned, step.sql)
+        self.execute(replayed, *(statement.sql for statement in target.statements))
+
+        self.assertEqual(self.catalog(planned)[0], self.catalog(replayed)[0])
+        self.assertEqual(
+            [(table, name, kind) for table, name, kind in self.catalog(planned)[1]],
+            [(table, name, kind) for table, name, kind in self.catalog(replayed)[1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Tests of the statement splitter and tokenizer in lib/aws/schema/sql.py.
+
+    python3 -m pytest test/schema
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib", "aws", "schema"))
+
+import sql  # noqa: E402
+
+
+class SplitStatementsTest(unittest.TestCase):
+
+    def test_splits_on_top_level_semicolons(self):
+        statements = sql.split_statements(
+            "CREATE TABLE a (id INT);\n"
+            "INSERT INTO a VALUES (';');\n"
+            'CREATE TABLE "b;c" (id INT);\n'
+            "SELECT E'it\\'s; fine';")
+        self.assertEqual([statement.sql for statement in statements], [
+            "CREATE TABLE a (id INT)",
+            "INSERT INTO a VALUES (';')",
+            'CREATE TABLE "b;c" (id INT)',
+            "SELECT E'it\\'s; fine'",
+        ])
+
+    def test_dollar_quoted_bodies_are_kept_whole(self):
+        body = "CREATE FUNCTION f() RETURNS trigger AS $body$ BEGIN NEW.x = 1; RETURN NEW; END; $body$ LANGUAGE plpgsql"
+        statements = sql.split_statements(body + ";\nSELECT 1;")
+        self.assertEqual([statement.sql for statement in statements], [body, "SELECT 1"])
+
+    def test_comments_are_dropped(self):
+        statements = sql.split_statements(
+            "-- leading; comment\n/* block; /* nested; */ */\nCREATE TABLE a (id INT); -- trailing\nDROP TABLE a;")
+        self.assertEqual([statement.sql for statement in statements], ["CREATE TABLE a (id INT)", "DROP TABLE a"])
+
+    def test_lines(self):
+        statements = sql.split_statements("CREATE TABLE a (id INT);\n\n  DROP TABLE a;\nSELECT\n1;")
+        self.assertEqual([statement.line for statement in statements], [1, 3, 4])
+
+    def test_split_files_tags_the_migration_of_each_statement(self):
+        statements = sql.split_files(
+            "CREATE TABLE a (id INT);\n"
+            "-- File: migrations/1/up.sql\nCREATE TABLE b (id INT);\n"
+            "-- File: migrations/2/up.sql\nALTER TABLE b ADD COLUMN c INT;\nDROP TABLE a;\n")
+        self.assertEqual([(statement.source, statement.sql) for statement in statements], [
+            ("", "CREATE TABLE a (id INT)"),
+            ("migrations/1/up.sql", "CREATE TABLE b (id INT)"),
+            ("migrations/2/up.sql", "ALTER TABLE b ADD COLUMN c INT"),
+            ("migrations/2/up.sql", "DROP TABLE a"),
+        ])
+
+
+class IdentifierTest(unittest.TestCase):
+
+    def test_quote_ident(self):
+        self.assertEqual(sql.quote_ident("merchant"), "merchant")
+        self.assertEqual(sql.quote_ident("Status"), '"Status"')
+        self.assertEqual(sql.unquote_ident('"Status"'), "Status")
+
+    def test_literals(self):
+        self.assertEqual(sql.quote_literal("it's"), "'it''s'")
+        self.assertEqual(sql.unquote_literal("'it''s'"), "it's")
+
+
+if __name__ == "__main__":
+    unittest.main()